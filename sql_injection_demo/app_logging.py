@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步、采样的应用日志
+Asynchronous, Sampled Application Logging
+
+请求线程上的日志调用只做两件事：按消息类型的令牌桶采样，然后把未格式化的 ``LogRecord``
+放入有界队列。``%`` 格式化、JSON编码和文件写入都由 ``QueueListener`` 的后台线程完成。
+消息类型即日志调用的模板字符串（``"安全端点访问 - 返回%d条记录"``），同一类型超出速率的
+记录被丢弃并计数，下一条放行的同类记录会带上被丢弃的条数。ERROR及以上级别从不采样。
+Logging calls on request threads only sample the record against a
+per-message-type token bucket and enqueue the unformatted ``LogRecord`` into
+a bounded queue. ``%``-formatting, JSON encoding and file writes happen on
+the ``QueueListener`` thread. The message type is the call's template string
+(``"安全端点访问 - 返回%d条记录"``); records of one type beyond its rate are
+dropped and counted, and the next record of that type that gets through
+carries the number dropped. ERROR and above are never sampled.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from db_pool import _fork_hook
+from rate_limit import TokenBucketLimiter
+
+LOG_FORMATS = ("text", "json")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def _message_type(record):
+    # 模板字符串以外的消息对象（如异常实例）按类型归类，避免类型数量无限增长
+    msg = record.msg
+    return record.name, record.levelno, msg if isinstance(msg, str) else type(msg).__name__
+
+
+class SamplingFilter(logging.Filter):
+    """每种消息类型每秒最多放行 ``rate`` 条（可突发 ``burst`` 条），``max_level`` 以上不采样"""
+
+    def __init__(self, rate, burst, max_level=logging.WARNING, max_types=10_000):
+        super().__init__()
+        self.max_level = max_level
+        self.max_types = max_types
+        self._limiter = TokenBucketLimiter(rate, burst, max_clients=max_types)
+        self._suppressed = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = _message_type(record)
+        if not self._limiter.allow(key):
+            with self._lock:
+                self.sampled_out += 1
+                if key in self._suppressed or len(self._suppressed) < self.max_types:
+                    self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        if self._suppressed:
+            with self._lock:
+                suppressed = self._suppressed.pop(key, 0)
+            if suppressed:
+                record.sampled_out = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """原有的文本格式，附加被采样丢弃的同类消息条数"""
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "sampled_out", 0)
+        if suppressed:
+            line += f" (另有{suppressed}条同类消息被采样丢弃)"
+        return line
+
+
+class JsonLineFormatter(logging.Formatter):
+    """每条记录一行JSON；``type`` 为未格式化的模板，便于按消息类型聚合"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "type": record.msg if isinstance(record.msg, str) else type(record.msg).__name__,
+            "pid": record.process,
+        }
+        suppressed = getattr(record, "sampled_out", 0)
+        if suppressed:
+            entry["sampled_out"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """入队前不格式化记录：``args`` 原样交给监听线程，因此只应传入不会再被修改的值"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline._queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline._count("dropped")
+        else:
+            self.pipeline._count("enqueued")
+
+
+class LogPipeline:
+    """``QueueHandler`` → 有界队列 → ``QueueListener`` → 文件/控制台
+
+    - ``path``: 日志文件，``None`` 表示只输出到控制台
+    - ``fmt``: ``text`` 或 ``json``（每行一个JSON对象）
+    - ``max_queue``: 队列上限，已满时新记录被丢弃并计数
+    - ``sample_rate`` / ``sample_burst``: 每种消息类型的采样速率，``sample_rate=0`` 关闭采样
+    """
+
+    def __init__(self, path="app.log", level=logging.INFO, fmt="text", max_queue=10000,
+                 sample_rate=5.0, sample_burst=20, console=True):
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"未知的日志格式: {fmt} (可选: {', '.join(LOG_FORMATS)})")
+        self.level = level
+        self.fmt = fmt
+        self.max_queue = max_queue
+        self.sample_rate = sample_rate
+        self.sample_burst = sample_burst
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "dropped": 0}
+
+        formatter = JsonLineFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+        self.handlers = []
+        if path:
+            self.handlers.append(logging.FileHandler(path, encoding="utf-8"))
+        if console:
+            self.handlers.append(logging.StreamHandler())
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.handler = _DeferredQueueHandler(self)
+        self.sampler = None
+        if sample_rate > 0:
+            self.sampler = SamplingFilter(sample_rate, sample_burst)
+            self.handler.addFilter(self.sampler)
+        self._listener = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+        atexit.register(self.stop)
+
+    def install(self, logger=None):
+        """用队列处理器替换 ``logger``（默认根记录器）上的处理器并启动后台线程"""
+        logger = logger or logging.getLogger()
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        logger.setLevel(self.level)
+        self.start()
+        return self
+
+    def start(self):
+        if self._listener is None:
+            self._listener = logging.handlers.QueueListener(
+                self._queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+
+    def stop(self):
+        """写完队列中剩余的记录并停止后台线程"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+
+    def _reset_after_fork(self):
+        """监听线程不会被fork继承：子进程换用新队列（丢弃父进程尚未写出的记录）并重新启动线程"""
+        running = self._listener is not None
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "dropped": 0}
+        self._queue = self.handler.queue = queue.Queue(maxsize=self.max_queue)
+        self._listener = None
+        if running:
+            self.start()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "sampled_out": self.sampler.sampled_out if self.sampler else 0,
+            "queued": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "format": self.fmt,
+            "sample_rate": self.sample_rate,
+            "sample_burst": self.sample_burst,
+        })
+        return stats
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+攻击日志异步写入器
+Asynchronous Attack Log Writer
+
+请求线程只负责把日志行放入有界内存队列，由后台线程批量写入文件、按配置频率fsync，
+并在文件超过大小上限时轮转。攻击总数与最近记录由日志文件本身得出：每个进程记住已经
+扫描到的文件位置，读取时只扫描之后新追加的部分，再加上本进程已入队、尚未写入的记录。
+多个工作进程追加同一个文件，因此无论由哪个进程回答，总数都覆盖所有进程写入的行。
+启动时从检查点出发扫描，无需读取整个日志文件。
+Request threads only enqueue log lines into a bounded in-memory queue; a
+background thread writes them in batches, fsyncs at a configurable rate and
+rotates the file once it exceeds its size limit. Attack totals and the most
+recent entries come from the log file itself: each process remembers how far
+it has scanned and only reads what was appended since, plus the lines it has
+queued but not yet written. All workers append to the same file, so the total
+covers every worker whichever one answers. On startup the scan begins at a
+small checkpoint instead of reading the whole log.
+Structured events can be handed to an ``event_store`` in the same batches.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import _fork_hook
+
+try:
+    import fcntl
+except ImportError:  # Windows：不支持fork，只有单个写入进程
+    fcntl = None
+
+OVERFLOW_POLICIES = ("drop", "block")
+
+_STOP = object()
+
+_SCAN_CHUNK = 1024 * 1024
+_TAIL_WINDOW = 64 * 1024
+
+
+def _scan_tail(path, offset, recent_size):
+    """从 ``offset`` 开始扫描日志，返回 ``(行数, 最后recent_size行, 文件大小)``
+
+    计数按块统计换行符，内存占用与文件大小无关；最近记录只读取文件末尾的一小段。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        lines = 0
+        while True:
+            chunk = f.read(_SCAN_CHUNK)
+            if not chunk:
+                break
+            lines += chunk.count(b"\n")
+
+        start = max(offset, size - _TAIL_WINDOW)
+        f.seek(start)
+        tail = f.read(size - start).split(b"\n")
+        if start > offset:
+            tail = tail[1:]  # 丢弃被截断的首行
+        recent = [line.decode("utf-8", "replace").strip() for line in tail if line.strip()]
+    return lines, recent[-recent_size:], size
+
+
+def _read_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _advance_state(path, checkpoint, recent_size):
+    """从 ``checkpoint`` 出发扫描新增的日志行，返回新的状态；日志文件不存在时返回None
+
+    检查点指向的文件已被轮转为 ``path.1`` 时，先计入它在检查点之后追加的行，再从头扫描新文件。
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get("inode") == st.st_ino and checkpoint.get("offset") == st.st_size:
+        return checkpoint
+    total = int(checkpoint.get("total", 0))
+    recent = list(checkpoint.get("recent", []))
+    offset = int(checkpoint.get("offset", 0))
+
+    if checkpoint.get("inode") != st.st_ino or offset > st.st_size:
+        previous = f"{path}.1"
+        if os.path.exists(previous) and os.stat(previous).st_ino == checkpoint.get("inode"):
+            lines, tail_recent, _ = _scan_tail(previous, offset, recent_size)
+            total += lines
+            recent = (recent + tail_recent)[-recent_size:]
+        else:
+            total, recent = 0, []
+        offset = 0
+
+    lines, tail_recent, size = _scan_tail(path, offset, recent_size)
+    return {
+        "inode": st.st_ino,
+        "offset": size,
+        "total": total + lines,
+        "recent": (recent + tail_recent)[-recent_size:],
+    }
+
+
+def _advance_checkpoint(path, checkpoint_path, recent_size):
+    """从检查点文件出发扫描新增的日志行，返回新的检查点"""
+    return _advance_state(path, _read_checkpoint(checkpoint_path), recent_size)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """跨进程互斥锁（flock）；没有fcntl的平台只有一个写入进程，直接放行"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class AttackLogWriter:
+    """后台批量写入攻击日志
+
+    - ``batch_size`` / ``flush_interval``: 积累满一批或距批次首条超过该秒数即写入
+    - ``fsync_interval``: 两次fsync之间的最短秒数；0表示每批都fsync，负数表示从不fsync
+    - ``max_bytes`` / ``backup_count``: 文件轮转阈值与保留的历史文件数（0表示不轮转）
+    - ``overflow``: 队列已满时的策略，``drop`` 直接丢弃，``block`` 最多等待 ``block_timeout`` 秒
+    - ``recent_size`` / ``checkpoint_interval``: 返回的最近记录条数与检查点写入间隔
+
+    ``snapshot()`` 由日志文件（所有进程共用）加上本进程尚未写入的记录得出；
+    其他进程入队的记录在它们写入文件后（最多 ``flush_interval`` 秒）才可见。
+    - ``event_store``: 可选的结构化事件存储，与日志行在同一批次中写入
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=256, flush_interval=0.5,
+                 fsync_interval=1.0, max_bytes=50 * 1024 * 1024, backup_count=5,
+                 overflow="drop", block_timeout=0.05, recent_size=10,
+                 checkpoint_interval=5.0, event_store=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {overflow}")
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.checkpoint_path = f"{path}.ckpt"
+        self.checkpoint_interval = checkpoint_interval
+        self.recent_size = recent_size
+        self.event_store = event_store
+
+        # 已扫描到的日志文件位置及其累计的总数与最近记录；_write_lock 保证写文件与移出
+        # _pending 对 snapshot() 是原子的，同一行不会被重复计数或漏计
+        self._file_state = _advance_checkpoint(path, self.checkpoint_path, recent_size) or {}
+        self._pending = OrderedDict()
+        self._seq = 0
+        self._write_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "events_stored": 0,
+            "batches": 0,
+            "fsyncs": 0,
+            "rotations": 0,
+            "write_errors": 0,
+            "event_errors": 0,
+        }
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------------
+    # 请求线程接口
+    # ------------------------------------------------------------------
+
+    def _reset_after_fork(self):
+        """父进程队列中的记录由父进程写入，子进程不再把它们算作自己的待写入记录"""
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = OrderedDict()
+
+    def _ensure_started(self):
+        # 进程fork后后台线程不会被继承，需要在子进程中重新启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(
+                target=self._run, name="attack-log-writer", daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, line, event=None):
+        """把一行日志（及可选的结构化事件）放入队列，队列已满且被丢弃时返回False"""
+        self._ensure_started()
+        # 先登记为待写入再入队：后台线程写入后才能把它移出
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._pending[seq] = line.strip()
+        item = (line, event, seq)
+        try:
+            if self.overflow == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                del self._pending[seq]
+                self._stats["dropped"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _counters(self):
+        """扫描日志文件新追加的部分，返回 ``(文件状态, 本进程待写入的记录)``"""
+        with self._write_lock:
+            state = _advance_state(self.path, self._file_state, self.recent_size)
+            if state is not None:
+                self._file_state = state
+            with self._lock:
+                pending = list(self._pending.values())
+        return self._file_state, pending
+
+    def snapshot(self):
+        """返回 ``(攻击总数, 最近记录列表)``，包括其他进程写入日志文件的记录"""
+        state, pending = self._counters()
+        recent = (state.get("recent", []) + pending)[-self.recent_size:]
+        return state.get("total", 0) + len(pending), recent
+
+    def version(self):
+        """日志文件的行数与本进程待写入的条数；事件与日志行在同一批次中先于日志行入库，
+        任何一个变化都意味着统计结果可能变化"""
+        state, pending = self._counters()
+        return state.get("total", 0), len(pending)
+
+    def flush(self):
+        """阻塞直到当前队列中的日志全部写入文件"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """写完剩余日志并停止后台线程"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._pid = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize() if self._pid == os.getpid() else 0
+        stats["max_queue"] = self.max_queue
+        stats["overflow_policy"] = self.overflow
+        return stats
+
+    # ------------------------------------------------------------------
+    # 后台线程
+    # ------------------------------------------------------------------
+
+    def _open(self):
+        return open(self.path, "a", encoding="utf-8")
+
+    def _reopen_if_moved(self, f):
+        # 日志文件被外部删除或替换时重新打开，避免写入已不存在的inode
+        if not f.closed:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+        return self._open()
+
+    def _write_checkpoint(self):
+        """在检查点锁内由日志文件推进检查点（其他进程写入的行也被计入）"""
+        with _file_lock(f"{self.checkpoint_path}.lock"):
+            state = _advance_checkpoint(self.path, self.checkpoint_path, self.recent_size)
+            if state is not None:
+                tmp = f"{self.checkpoint_path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as out:
+                    json.dump(state, out, ensure_ascii=False)
+                os.replace(tmp, self.checkpoint_path)
+        return time.monotonic()
+
+    def _rotate(self, f):
+        # 轮转前先把检查点推进到旧文件末尾：旧文件改名后只能通过 path.1 找回检查点之后的行，
+        # 没有检查点（例如第一次轮转）时旧文件中的行会全部丢失
+        f.close()
+        self._write_checkpoint()
+        for n in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{n}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        with self._lock:
+            self._stats["rotations"] += 1
+        return self._open()
+
+    def _fsync(self, f):
+        os.fsync(f.fileno())
+        with self._lock:
+            self._stats["fsyncs"] += 1
+        return time.monotonic()
+
+    def _write_batch(self, f, batch):
+        data = "".join(line for line, _, _ in batch)
+        f = self._reopen_if_moved(f)
+        rotated = False
+        if self.max_bytes and self.backup_count and f.tell() and \
+                f.tell() + len(data) > self.max_bytes:
+            f = self._rotate(f)
+            rotated = True
+        f.write(data)
+        f.flush()
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+        return f, rotated
+
+    def _store_events(self, batch):
+        if self.event_store is None:
+            return
+        events = [event for _, event, _ in batch if event is not None]
+        if not events:
+            return
+        try:
+            self.event_store.insert_many(events)
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["event_errors"] += 1
+        else:
+            with self._lock:
+                self._stats["events_stored"] += len(events)
+
+    def _run(self):
+        q = self._queue
+        f = self._open()
+        last_fsync = 0.0
+        last_checkpoint = time.monotonic()
+        dirty = False
+        stopping = False
+        while not stopping:
+            # 有未fsync的数据时，空闲到期也要补一次fsync
+            wait = None
+            if dirty:
+                wait = max(0.0, last_fsync + self.fsync_interval - time.monotonic())
+            try:
+                item = q.get(timeout=wait)
+            except queue.Empty:
+                try:
+                    last_fsync = self._fsync(f)
+                    last_checkpoint = self._write_checkpoint()
+                except (OSError, ValueError):
+                    with self._lock:
+                        self._stats["write_errors"] += 1
+                dirty = False
+                continue
+            if item is _STOP:
+                q.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    q.task_done()
+                    break
+                batch.append(item)
+            self._store_events(batch)
+            rotated = False
+            try:
+                with self._write_lock:
+                    try:
+                        f, rotated = self._write_batch(f, batch)
+                    finally:
+                        # 写入失败的记录也不再等待写入，不再计入
+                        with self._lock:
+                            for _, _, seq in batch:
+                                self._pending.pop(seq, None)
+                if self.fsync_interval >= 0:
+                    dirty = True
+                    if time.monotonic() - last_fsync >= self.fsync_interval:
+                        last_fsync = self._fsync(f)
+                        dirty = False
+            except (OSError, ValueError):
+                with self._lock:
+                    self._stats["write_errors"] += 1
+            # 轮转后立即推进检查点：旧文件再被轮转一次就不再是 path.1，其中未计入的行无法找回
+            if rotated or time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                try:
+                    last_checkpoint = self._write_checkpoint()
+                except (OSError, ValueError):
+                    pass
+            for _ in batch:
+                q.task_done()
+        if not f.closed:
+            try:
+                f.flush()
+                if dirty:
+                    self._fsync(f)
+                self._write_checkpoint()
+            except OSError:
+                pass
+            finally:
+                f.close()
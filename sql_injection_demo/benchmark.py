@@ -0,0 +1,790 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQL注入演示系统性能基准测试
+SQL Injection Demo System Benchmarks
+
+用法 | Usage:
+    python benchmark.py wal --duration 5 --readers 4
+    python benchmark.py load --client inprocess --concurrency 8 --duration 5
+    python benchmark.py load --client http --base-url http://127.0.0.1:5000 --output run.json
+    python benchmark.py backends --backends file memory shared_memory --seed-users 20000
+    python benchmark.py json --rows 1 100 1000
+    python benchmark.py search --users 200000 --terms admin zhang moderator
+    python benchmark.py logins --workers 0 1 2 4 --concurrency 8
+    python benchmark.py detect --payloads 300 --requests 50000
+
+所有子命令都以JSON格式输出结果，便于对比不同版本的运行数据。
+Every subcommand prints its results as JSON so runs can be compared over time.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import detection
+import fast_json
+import passwords
+import search
+from db_pool import (
+    ConnectionPool,
+    readonly_uri,
+    reader_pragmas,
+    storage_profile,
+    writer_pragmas,
+)
+
+
+# ---------------------------------------------------------------------------
+# WAL读写并发测试 (Read Throughput Under Concurrent Writes)
+# ---------------------------------------------------------------------------
+
+def _create_bench_db(path, mode, rows):
+    """创建一个包含 ``rows`` 个用户的测试数据库"""
+    profile = storage_profile(mode)
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+        conn.execute(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, "
+            "password TEXT NOT NULL, role TEXT DEFAULT 'user')"
+        )
+        conn.executemany(
+            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+            ((f"user{i}", f"pass{i}", "user") for i in range(rows)),
+        )
+
+
+def bench_wal(args):
+    """在持续写入的同时测量只读查询吞吐量，对比rollback与WAL模式"""
+    results = {}
+    for mode in args.modes:
+        workdir = tempfile.mkdtemp(prefix="bench_wal_")
+        path = os.path.join(workdir, "bench.db")
+        try:
+            _create_bench_db(path, mode, args.rows)
+            profile = storage_profile(mode)
+            readers = ConnectionPool(
+                readonly_uri(path), size=args.readers,
+                pragmas=reader_pragmas(profile), uri=True, timeout=args.busy_timeout,
+            )
+            writer = ConnectionPool(
+                path, size=1, pragmas=writer_pragmas(profile), timeout=args.busy_timeout,
+            )
+
+            stop = threading.Event()
+            counters = {"reads": 0, "read_errors": 0, "writes": 0, "write_errors": 0}
+            lock = threading.Lock()
+
+            def write_loop():
+                conn = writer.acquire()
+                i = 0
+                try:
+                    while not stop.is_set():
+                        i += 1
+                        try:
+                            with conn:
+                                for _ in range(args.write_batch):
+                                    conn.execute(
+                                        "UPDATE users SET role=? WHERE id=?",
+                                        (f"role{i % 7}", i % args.rows + 1),
+                                    )
+                            ok, err = 1, 0
+                        except sqlite3.OperationalError:
+                            ok, err = 0, 1
+                        with lock:
+                            counters["writes"] += ok
+                            counters["write_errors"] += err
+                finally:
+                    writer.release(conn)
+
+            def read_loop(seed):
+                conn = readers.acquire()
+                reads = errors = 0
+                i = seed
+                try:
+                    while not stop.is_set():
+                        i += 1
+                        try:
+                            conn.execute(
+                                "SELECT id, username, role FROM users WHERE username=?",
+                                (f"user{i % args.rows}",),
+                            ).fetchall()
+                            reads += 1
+                        except sqlite3.OperationalError:
+                            errors += 1
+                finally:
+                    readers.release(conn)
+                    with lock:
+                        counters["reads"] += reads
+                        counters["read_errors"] += errors
+
+            threads = [threading.Thread(target=read_loop, args=(n * 1000,))
+                       for n in range(args.readers)]
+            if args.writers:
+                threads.append(threading.Thread(target=write_loop))
+            for t in threads:
+                t.start()
+            time.sleep(args.duration)
+            stop.set()
+            for t in threads:
+                t.join()
+            readers.close()
+            writer.close()
+
+            results[mode] = {
+                "reads_per_sec": round(counters["reads"] / args.duration, 1),
+                "write_txns_per_sec": round(counters["writes"] / args.duration, 1),
+                "read_errors": counters["read_errors"],
+                "write_errors": counters["write_errors"],
+            }
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "wal",
+        "duration_sec": args.duration,
+        "readers": args.readers,
+        "rows": args.rows,
+        "results": results,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 并发负载测试 (Concurrent Load Generation)
+# ---------------------------------------------------------------------------
+
+# 每个端点的代表性请求
+LOAD_SCENARIOS = {
+    "index": "/",
+    "login_vuln": "/login_vuln?username=admin%27--&password=any",
+    "login_safe": "/login_safe?username=admin&password=admin123",
+    "users": "/users?limit=50",
+    "stats": "/stats",
+    "advanced_vuln": "/advanced_vuln?search=admin",
+    "advanced_safe": "/advanced_safe?search=admin",
+}
+
+
+class HTTPLoadClient:
+    """每个线程持有一个keep-alive连接的HTTP客户端"""
+
+    def __init__(self, base_url, timeout=10.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return conn
+
+    def get(self, path):
+        conn = self._connection()
+        try:
+            conn.request("GET", self.prefix + path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class InProcessLoadClient:
+    """通过Flask测试客户端在进程内发起请求，不经过网络栈"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def get(self, path):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.get(path)
+        response.close()
+        return response.status_code
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _summarize(latencies, statuses, errors, elapsed):
+    latencies.sort()
+    total = len(latencies) + errors
+    failed = errors + sum(count for status, count in statuses.items() if status >= 500)
+    return {
+        "requests": total,
+        "errors": failed,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "p50": round(_percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p95": round(_percentile(latencies, 95) * 1000, 3) if latencies else None,
+            "p99": round(_percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def run_load(client, paths, concurrency, duration):
+    """用 ``concurrency`` 个线程在 ``duration`` 秒内循环请求 ``paths``，返回汇总结果"""
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    errors = [0]
+    stop = threading.Event()
+
+    def worker(offset):
+        local_latencies, local_statuses, local_errors = [], {}, 0
+        i = offset
+        clock = time.perf_counter
+        while not stop.is_set():
+            path = paths[i % len(paths)]
+            i += 1
+            started = clock()
+            try:
+                status = client.get(path)
+            except Exception:
+                local_errors += 1
+                continue
+            local_latencies.append(clock() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    return _summarize(latencies, statuses, errors[0], time.perf_counter() - started)
+
+
+def _load_client(args):
+    if args.client == "http":
+        return HTTPLoadClient(args.base_url)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        os.chdir(args.workdir)
+    # 所有压测线程共用同一个客户端地址，默认关闭限流以测量端点本身的容量
+    if not args.rate_limits:
+        os.environ.setdefault("RATE_LIMITS", "")
+    import flask_sql_injection_demo as demo
+    seeded = bool(args.seed_users or args.seed_secret_count)
+    demo.init_db(users=args.seed_users, secret_count=args.seed_secret_count, seed=42, force=seeded)
+    return InProcessLoadClient(demo.app)
+
+
+def bench_load(args):
+    """对各端点分别施压，最后再跑一轮混合负载"""
+    client = _load_client(args)
+    endpoints = args.endpoints or list(LOAD_SCENARIOS)
+    unknown = set(endpoints) - set(LOAD_SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知的端点: {', '.join(sorted(unknown))}")
+
+    # 预热：建立连接、填充连接池与缓存
+    for name in endpoints:
+        try:
+            client.get(LOAD_SCENARIOS[name])
+        except Exception:
+            pass
+
+    results = {}
+    for name in endpoints:
+        results[name] = run_load(client, [LOAD_SCENARIOS[name]], args.concurrency, args.duration)
+    if args.mixed and len(endpoints) > 1:
+        results["mixed"] = run_load(
+            client, [LOAD_SCENARIOS[name] for name in endpoints], args.concurrency, args.duration
+        )
+
+    return {
+        "benchmark": "load",
+        "label": args.label,
+        "client": args.client,
+        "target": args.base_url if args.client == "http" else "flask-test-client",
+        "concurrency": args.concurrency,
+        "duration_sec": args.duration,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def bench_backends(args):
+    """在每种存储后端上运行相同的进程内端点负载，对比吞吐量和延迟
+
+    存储后端在导入应用时由 ``DB_BACKEND`` 决定，每种后端在独立的子进程和工作目录中运行 ``load``。
+    """
+    from storage import BACKENDS
+
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        raise SystemExit(f"未知的存储后端: {', '.join(sorted(unknown))}")
+    workdir = tempfile.mkdtemp(prefix="bench_backends_")
+    runs = {}
+    try:
+        for backend in args.backends:
+            output = os.path.join(workdir, f"{backend}.json")
+            cmd = [
+                sys.executable, os.path.abspath(__file__), "--output", output, "load",
+                "--client", "inprocess", "--workdir", os.path.join(workdir, backend),
+                "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+                "--seed-users", str(args.seed_users),
+                "--seed-secret-count", str(args.seed_secret_count),
+                "--label", backend,
+            ]
+            if args.endpoints:
+                cmd += ["--endpoints", *args.endpoints]
+            env = dict(os.environ, DB_BACKEND=backend, LOG_LEVEL="WARNING")
+            proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                raise SystemExit(f"{backend} 后端压测失败:\n{proc.stderr[-2000:]}")
+            with open(output, encoding="utf-8") as f:
+                runs[backend] = json.load(f)["results"]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = args.backends[0]
+    comparison = {}
+    for scenario, base in runs[baseline].items():
+        row = {}
+        for backend, results in runs.items():
+            result = results[scenario]
+            row[backend] = {
+                "rps": result["rps"],
+                "p50_ms": result["latency_ms"]["p50"],
+                "p99_ms": result["latency_ms"]["p99"],
+                "error_rate": result["error_rate"],
+                f"rps_vs_{baseline}": round(result["rps"] / base["rps"], 2) if base["rps"] else None,
+            }
+        comparison[scenario] = row
+    return {
+        "benchmark": "backends",
+        "baseline": baseline,
+        "seed_users": args.seed_users,
+        "seed_secret_count": args.seed_secret_count,
+        "concurrency": args.concurrency,
+        "duration_sec": args.duration,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": comparison,
+    }
+
+
+# ---------------------------------------------------------------------------
+# JSON编码微基准 (JSON Encoding Microbenchmark)
+# ---------------------------------------------------------------------------
+
+PROTECTION_MECHANISMS = ["参数化查询", "输入长度限制", "敏感信息过滤", "错误信息控制"]
+
+
+def bench_json(args):
+    """对比 Row→dict→jsonify 与 元组→预编码模板 两种响应编码路径"""
+    from flask import Flask
+
+    provider = Flask(__name__).json  # 与 jsonify 相同的编码配置
+    template = fast_json.JSONTemplate({
+        "endpoint": "safe",
+        "success": fast_json.Slot("success"),
+        "user_count": fast_json.Slot("user_count"),
+        "users": fast_json.Slot("users"),
+        "security_analysis": {
+            "vulnerability_detected": False,
+            "risk_level": "LOW",
+            "protection_mechanisms": PROTECTION_MECHANISMS,
+            "suspicious_input_detected": fast_json.Slot("suspicious"),
+            "attack_patterns_neutralized": fast_json.Slot("patterns"),
+        },
+        "timestamp": fast_json.Slot("timestamp"),
+    })
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, role TEXT, created_at TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO users (username, role, created_at) VALUES (?, ?, ?)",
+        ((f"user.name{i}", "user", "2021-01-01 00:00:00") for i in range(max(args.rows))),
+    )
+    timestamp = "2024-01-01T00:00:00"
+
+    def current(limit):
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM users LIMIT ?", (limit,)).fetchall()
+        return provider.dumps({
+            "endpoint": "safe",
+            "success": len(rows) > 0,
+            "user_count": len(rows),
+            "users": [dict(r) for r in rows],
+            "security_analysis": {
+                "vulnerability_detected": False,
+                "risk_level": "LOW",
+                "protection_mechanisms": list(PROTECTION_MECHANISMS),
+                "suspicious_input_detected": False,
+                "attack_patterns_neutralized": [],
+            },
+            "timestamp": timestamp,
+        })
+
+    def fast(limit):
+        conn.row_factory = sqlite3.Row  # 与连接池配置相同，由 fetch_tuples 绕过
+        cur = conn.execute("SELECT * FROM users LIMIT ?", (limit,))
+        rows = fast_json.fetch_tuples(cur)
+        return template.render(
+            success=len(rows) > 0, user_count=len(rows),
+            users=fast_json.encode_rows(fast_json.column_names(cur), rows),
+            suspicious=False, patterns=[], timestamp=timestamp,
+        )
+
+    def measure(limit):
+        # 两条路径交替运行，各取最好成绩，减少机器负载波动的影响
+        best = {current: float("inf"), fast: float("inf")}
+        for _ in range(args.repeat):
+            for func in best:
+                started = time.perf_counter()
+                for _ in range(args.iterations):
+                    func(limit)
+                elapsed = (time.perf_counter() - started) / args.iterations
+                best[func] = min(best[func], elapsed)
+        return best[current] * 1e6, best[fast] * 1e6
+
+    results = {}
+    for limit in args.rows:
+        if json.loads(current(limit)) != json.loads(fast(limit)):
+            raise SystemExit(f"两种编码结果不一致 (rows={limit})")
+        current_us, fast_us = measure(limit)
+        results[str(limit)] = {
+            "current_us": round(current_us, 2),
+            "fast_us": round(fast_us, 2),
+            "speedup": round(current_us / fast_us, 2),
+        }
+    conn.close()
+
+    return {
+        "benchmark": "json",
+        "backend": fast_json.BACKEND,
+        "iterations": args.iterations,
+        "results": results,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 用户检索：LIKE扫描 vs 全文索引 (User Search: LIKE Scan vs Full-Text Index)
+# ---------------------------------------------------------------------------
+
+# 与 /advanced_vuln 相同形状的查询（参数化，便于重复测量）
+LIKE_SCAN_QUERY = """
+SELECT u.username, u.role, s.secret_info
+FROM users u
+LEFT JOIN sensitive_data s ON u.id = s.user_id
+WHERE u.username LIKE ? OR u.role LIKE ?
+"""
+
+
+def bench_search(args):
+    """在种子数据库上对比 /advanced_vuln 的LIKE扫描与 /advanced_safe 的索引检索"""
+    from seeder import seed_database
+
+    if not search.trigram_available():
+        raise SystemExit("当前SQLite不支持FTS5 trigram分词器")
+
+    workdir = tempfile.mkdtemp(prefix="bench_search_")
+    path = os.path.join(workdir, "bench.db")
+    try:
+        seed_timings = seed_database(path, users=args.users, secrets=args.secrets, seed=42)
+        conn = sqlite3.connect(path)
+
+        def best_ms(func):
+            best = float("inf")
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = func()
+                best = min(best, time.perf_counter() - started)
+            return best * 1000, len(rows)
+
+        results = {}
+        for term in args.terms:
+            pattern = f"%{term}%"
+            scan_ms, scan_rows = best_ms(
+                lambda: conn.execute(LIKE_SCAN_QUERY, (pattern, pattern)).fetchall()
+            )
+            page_ms, _ = best_ms(
+                lambda: conn.execute(
+                    f"{LIKE_SCAN_QUERY} LIMIT ?", (pattern, pattern, args.limit)
+                ).fetchall()
+            )
+            result = {
+                "matches": scan_rows,
+                "like_scan_ms": round(scan_ms, 3),
+                "like_first_page_ms": round(page_ms, 3),
+            }
+            for sort in search.SORT_ORDERS:
+                mode, _ = search.search_users(conn, term, args.limit, sort=sort)
+                index_ms, _ = best_ms(
+                    lambda: search.search_users(conn, term, args.limit, sort=sort)[1].fetchall()
+                )
+                result["search_mode"] = mode
+                result[f"indexed_{sort}_page_ms"] = round(index_ms, 3)
+                result[f"speedup_{sort}_vs_scan"] = round(scan_ms / index_ms, 1)
+            results[term] = result
+        conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "search",
+        "users": args.users,
+        "secrets": args.secrets,
+        "page_size": args.limit,
+        "seed_timings": seed_timings,
+        "results": results,
+    }
+
+
+class VerifierLoadClient:
+    """把"请求"映射为一次口令校验，复用 ``run_load`` 统计吞吐量和延迟"""
+
+    def __init__(self, verifier, encoded):
+        self.verifier = verifier
+        self.encoded = encoded
+
+    def get(self, password):
+        try:
+            self.verifier.verify(password, self.encoded)
+        except passwords.VerifierUnavailable:
+            return 503
+        return 200
+
+
+def bench_logins(args):
+    """不同校验进程数下 /login_safe 口令校验的每秒登录数；workers=0 为请求线程内直接计算"""
+    encoded = passwords.hash_password("admin123", cost=args.cost or None)
+    # 一半正确一半错误的口令，两者的计算量相同
+    attempts = ["admin123", "wrong-password"]
+    results = {}
+    for workers in args.workers:
+        verifier = passwords.PasswordVerifier(
+            workers=workers, max_pending=args.max_pending or None, timeout=args.timeout,
+        )
+        try:
+            verifier.start()
+            summary = run_load(
+                VerifierLoadClient(verifier, encoded), attempts, args.concurrency, args.duration,
+            )
+        finally:
+            verifier.shutdown()
+        summary["logins_per_sec"] = summary.pop("rps")
+        summary["verifier"] = verifier.stats()
+        results[f"workers={workers}"] = summary
+    return {
+        "benchmark": "logins",
+        "hash": encoded.rsplit("$", 2)[0],
+        "cpu_count": os.cpu_count(),
+        "concurrency": args.concurrency,
+        "results": results,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 检测结果缓存：重放扫描器载荷 (Detection Memo: Replayed Scanner Payloads)
+# ---------------------------------------------------------------------------
+
+# sqlmap风格的载荷模板：{v} 原始参数值，{n}/{m} 随机整数，{r} 随机标记，{nulls} UNION列
+SCANNER_TEMPLATES = (
+    "{v}' AND {n}={n}-- {r}",
+    "{v}' AND {n}={m}-- {r}",
+    "{v}') AND {n}={n} AND ('{r}'='{r}",
+    "{v}' OR NOT {n}={m}#",
+    "{v}%' AND {n}={n} AND '%'='",
+    "{v} AND {n}={n}",
+    "{v}' AND (SELECT {n} FROM (SELECT(SLEEP(5))){r})-- {r}",
+    "{v}' AND {n}=LIKE(CHAR(65,66,67,68,69,70,71),UPPER(HEX(RANDOMBLOB(500000000/2))))-- {r}",
+    "{v}' UNION ALL SELECT {nulls}-- -",
+    "{v}';SELECT PG_SLEEP(5)--",
+    "(SELECT (CASE WHEN ({n}={n}) THEN {n} ELSE {n}*(SELECT {n} UNION ALL SELECT {m}) END))",
+    "{v}' AND {n}=CAST((CHR(113)||CHR(118)||CHR(106))||(SELECT (CASE WHEN ({n}={n}) "
+    "THEN 1 ELSE 0 END))::text||(CHR(113)||CHR(122)) AS NUMERIC)-- {r}",
+)
+
+BENIGN_VALUES = ("admin", "test", "alice", "bob", "1", "guest", "test_user")
+
+
+def scanner_corpus(size, seed=42):
+    """生成 ``size`` 个互不相同的sqlmap风格载荷（同一次扫描中随机数固定，载荷会被反复发送）"""
+    rng = random.Random(seed)
+    corpus = dict.fromkeys(BENIGN_VALUES)
+    while len(corpus) < size:
+        template = rng.choice(SCANNER_TEMPLATES)
+        corpus[template.format(
+            v=rng.choice(BENIGN_VALUES),
+            n=rng.randint(1000, 9999),
+            m=rng.randint(1000, 9999),
+            r=rng.choice("abcdefghijklmnopqrstuvwxyz") * 4,
+            nulls=",".join(["NULL"] * rng.randint(1, 10)),
+        )] = None
+    return list(corpus)[:size]
+
+
+def bench_detect(args):
+    """重放扫描器载荷：每次重新扫描 vs 按原始输入缓存的检测结果"""
+    corpus = scanner_corpus(args.payloads)
+    rng = random.Random(7)
+    replay = [rng.choice(corpus) for _ in range(args.requests)]
+    matcher = detection.DEFAULT_MATCHER
+
+    def uncached():
+        for payload in replay:
+            matcher.matched_patterns(payload.lower())
+
+    memo = None
+
+    def cached():
+        nonlocal memo
+        memo = detection.DetectionMemo(matcher, args.cache_entries, args.max_input)
+        for payload in replay:
+            memo.matched_patterns(payload)
+
+    def best_us(func):
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        return best / len(replay) * 1e6
+
+    uncached_us = best_us(uncached)
+    cached_us = best_us(cached)
+    lengths = sorted(len(payload) for payload in corpus)
+    return {
+        "benchmark": "detect",
+        "payloads": len(corpus),
+        "requests": len(replay),
+        "payload_length": {"p50": _percentile(lengths, 50), "max": lengths[-1]},
+        "results": {
+            "uncached_us_per_call": round(uncached_us, 3),
+            "cached_us_per_call": round(cached_us, 3),
+            "speedup": round(uncached_us / cached_us, 1),
+            "cache": memo.stats(),
+        },
+    }
+
+
+# ---------------------------------------------------------------------------
+# 命令行入口 (Command Line Entry)
+# ---------------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="SQL注入演示系统性能基准测试")
+    parser.add_argument("--output", help="把JSON结果另存到文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("wal", help="写入进行时的读吞吐量 (rollback vs WAL)")
+    p.add_argument("--modes", nargs="+", default=["rollback", "wal"])
+    p.add_argument("--duration", type=float, default=5.0)
+    p.add_argument("--readers", type=int, default=4)
+    p.add_argument("--writers", type=int, choices=(0, 1), default=1)
+    p.add_argument("--write-batch", type=int, default=20, help="每个写事务更新的行数")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--busy-timeout", type=float, default=0.05)
+    p.set_defaults(func=bench_wal)
+
+    p = sub.add_parser("load", help="并发压测各端点，输出p50/p95/p99延迟、RPS和错误率")
+    p.add_argument("--client", choices=("http", "inprocess"), default="inprocess")
+    p.add_argument("--base-url", default="http://127.0.0.1:5000")
+    p.add_argument("--workdir", help="进程内模式的工作目录（数据库与日志文件所在位置）")
+    p.add_argument("--endpoints", nargs="+", help=f"可选: {', '.join(LOAD_SCENARIOS)}")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--duration", type=float, default=5.0, help="每个端点的压测秒数")
+    p.add_argument("--no-mixed", dest="mixed", action="store_false", help="不运行混合负载")
+    p.add_argument("--label", help="本次运行的标签，便于对比")
+    p.add_argument("--rate-limits", action="store_true", help="进程内模式下保留按客户端限流")
+    p.add_argument("--seed-users", type=int, default=0, help="进程内模式下额外生成的合成用户数")
+    p.add_argument("--seed-secret-count", "--seed-secrets", type=int, default=0,
+                   help="进程内模式下额外生成的合成敏感数据条数")
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("backends", help="同一端点负载在 file / memory / shared_memory 存储后端上的对比")
+    p.add_argument("--backends", nargs="+", default=["file", "memory", "shared_memory"],
+                   help="第一个后端作为对比基准")
+    p.add_argument("--endpoints", nargs="+", help=f"可选: {', '.join(LOAD_SCENARIOS)}")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--duration", type=float, default=3.0, help="每个端点的压测秒数")
+    p.add_argument("--seed-users", type=int, default=20000)
+    p.add_argument("--seed-secret-count", "--seed-secrets", type=int, default=2000)
+    p.set_defaults(func=bench_backends)
+
+    p = sub.add_parser("json", help="响应JSON编码：当前路径 vs 快速路径（含取数）")
+    p.add_argument("--rows", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p.add_argument("--iterations", type=int, default=500)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_json)
+
+    p = sub.add_parser("search", help="用户检索：LIKE全表扫描 vs FTS5 trigram索引")
+    p.add_argument("--users", type=int, default=200000)
+    p.add_argument("--secrets", type=int, default=20000)
+    p.add_argument("--terms", nargs="+", default=["admin", "zhang", "moderator", "li4", "ad"])
+    p.add_argument("--limit", type=int, default=20, help="每页结果数")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("logins", help="口令校验吞吐量：请求线程内计算 vs 进程池")
+    p.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    p.add_argument("--concurrency", type=int, default=8, help="并发登录的线程数")
+    p.add_argument("--duration", type=float, default=5.0, help="每种配置的压测秒数")
+    p.add_argument("--cost", type=int, default=0, help="哈希代价，0为默认值")
+    p.add_argument("--max-pending", type=int, default=0, help="排队上限，0为 workers*4")
+    p.add_argument("--timeout", type=float, default=5.0)
+    p.set_defaults(func=bench_logins)
+
+    p = sub.add_parser("detect", help="检测结果缓存：重放sqlmap风格载荷，每次扫描 vs 缓存")
+    p.add_argument("--payloads", type=int, default=300, help="载荷语料的不同载荷数")
+    p.add_argument("--requests", type=int, default=50000, help="重放的检测次数")
+    p.add_argument("--cache-entries", type=int, default=4096)
+    p.add_argument("--max-input", type=int, default=256, help="参与缓存的最大输入长度")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_detect)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output = getattr(args, "output", None)
+    result = json.dumps(args.func(args), ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(result + "\n")
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite连接池
+SQLite Connection Pool
+
+为演示系统提供线程安全、可复用的SQLite连接，避免每个请求都重新打开数据库文件、
+重新解析schema并丢失语句缓存。
+Provides thread-safe, reusable SQLite connections so that requests no longer
+reopen the database file, re-parse the schema and lose the statement cache.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from urllib.parse import quote
+
+
+# 存储模式调优参数 (Storage Profiles)
+# rollback: SQLite默认的回滚日志模式，任何写事务都会阻塞所有读者
+# wal:      预写日志模式，读者与唯一的写者互不阻塞
+# memory:   内存数据库（见 storage.py），回滚日志放在内存中，不需要落盘
+STORAGE_PROFILES = {
+    "rollback": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+    },
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+    },
+    "memory": {
+        "journal_mode": "MEMORY",
+        "synchronous": "OFF",
+        "mmap_size": 0,
+        "cache_size": -64000,
+    },
+}
+
+
+def storage_profile(mode, **overrides):
+    """返回指定存储模式的调优参数，``overrides`` 中非None的值覆盖默认值"""
+    if mode not in STORAGE_PROFILES:
+        raise ValueError(f"未知的存储模式: {mode} (可选: {', '.join(STORAGE_PROFILES)})")
+    profile = dict(STORAGE_PROFILES[mode])
+    profile.update({k: v for k, v in overrides.items() if v is not None})
+    return profile
+
+
+def writer_pragmas(profile):
+    """写连接的PRAGMA：设置日志模式与持久化级别"""
+    return (
+        f"journal_mode={profile['journal_mode']}",
+        f"synchronous={profile['synchronous']}",
+        f"mmap_size={profile['mmap_size']}",
+        f"cache_size={profile['cache_size']}",
+    )
+
+
+def reader_pragmas(profile):
+    """只读连接的PRAGMA：日志模式由写连接决定，这里只调整缓存"""
+    return (
+        "query_only=ON",
+        f"mmap_size={profile['mmap_size']}",
+        f"cache_size={profile['cache_size']}",
+    )
+
+
+def readonly_uri(database):
+    """返回以只读方式打开数据库文件的URI"""
+    return f"file:{quote(os.path.abspath(database))}?mode=ro"
+
+
+def _fork_hook(pool):
+    """返回只持有弱引用的fork回调，避免连接池因注册了回调而无法回收"""
+    ref = weakref.ref(pool)
+
+    def reset():
+        pool = ref()
+        if pool is not None:
+            pool._reset_after_fork()
+    return reset
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """在超时时间内无法获取连接"""
+
+
+class ConnectionPool:
+    """固定容量的SQLite连接池
+
+    - ``size``: 最多同时存在的连接数
+    - ``pragmas``: 每个新连接创建后执行的PRAGMA列表
+    - ``health_check_interval``: 空闲超过该秒数的连接在借出前执行 ``SELECT 1`` 检查
+    - ``factory``: 连接类，传给 ``sqlite3.connect``（例如带语句计时的子类）
+    """
+
+    def __init__(self, database, size=8, pragmas=(), timeout=5.0,
+                 health_check_interval=30.0, uri=False, row_factory=sqlite3.Row,
+                 factory=sqlite3.Connection):
+        if size < 1:
+            raise ValueError("连接池大小必须大于0")
+        self.database = database
+        self.size = size
+        self.pragmas = tuple(pragmas)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.uri = uri
+        self.row_factory = row_factory
+        self.factory = factory
+
+        # LIFO: 优先复用最近归还的连接，其页缓存最"热"
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._last_used = {}
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+        self._stats = {
+            "hits": 0,            # 直接拿到空闲连接
+            "misses": 0,          # 需要新建连接
+            "waits": 0,           # 连接池已满，需要等待归还
+            "wait_time_ms": 0.0,  # 累计等待时间
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # 连接创建与检查
+    # ------------------------------------------------------------------
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            uri=self.uri,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.row_factory = self.row_factory
+        for pragma in self.pragmas:
+            conn.execute(f"PRAGMA {pragma}")
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _reset_after_fork(self):
+        """fork后子进程不能复用父进程的连接：丢弃继承来的连接（不关闭，避免影响父进程）
+
+        在子进程中fork刚完成、尚无其它线程时调用，锁也一并重建。
+        """
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._last_used = {}
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._stats["discarded"] += 1
+
+    # ------------------------------------------------------------------
+    # 借出与归还
+    # ------------------------------------------------------------------
+
+    def acquire(self, timeout=None):
+        """借出一个连接，池满时最多等待 ``timeout`` 秒"""
+        timeout = self.timeout if timeout is None else timeout
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+                hit = True
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        self._stats["misses"] += 1
+                        hit = False
+                    else:
+                        self._stats["waits"] += 1
+                        hit = None
+
+                if hit is False:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"{timeout}秒内无法从连接池获取连接")
+                finally:
+                    with self._lock:
+                        self._stats["wait_time_ms"] += (time.perf_counter() - started) * 1000
+                hit = True
+
+            with self._lock:
+                self._stats["hits"] += 1
+
+            last_used = self._last_used.get(id(conn), 0.0)
+            if time.monotonic() - last_used > self.health_check_interval:
+                if not self._is_healthy(conn):
+                    with self._lock:
+                        self._stats["health_check_failures"] += 1
+                    self._discard(conn)
+                    continue
+            return conn
+
+    def release(self, conn, broken=False):
+        """归还连接；未提交的事务会被回滚，异常连接直接丢弃"""
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        if broken:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.put(conn)
+
+    def close(self):
+        """关闭所有空闲连接（借出中的连接在归还时重新入池）"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        """返回连接池使用统计，用于调整连接池大小"""
+        with self._lock:
+            stats = dict(self._stats)
+            created = self._created
+        idle = self._idle.qsize()
+        total = stats["hits"] + stats["misses"]
+        stats.update({
+            "size": self.size,
+            "open_connections": created,
+            "idle_connections": idle,
+            "in_use_connections": created - idle,
+            "hit_rate": round(stats["hits"] / total, 4) if total else 0.0,
+            "wait_time_ms": round(stats["wait_time_ms"], 3),
+        })
+        return stats
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQL注入特征检测引擎
+SQL Injection Signature Detection Engine
+
+使用Aho-Corasick自动机一次扫描输入即可找出所有特征串，检测开销与特征数量无关。
+扫描器会反复发送同样的几百个载荷，``DetectionMemo`` 按原始输入缓存检测结果。
+Uses an Aho-Corasick automaton so that every signature is found in a single
+pass over the input, independent of how many signatures are configured.
+Scanners replay the same few hundred payloads over and over, so
+``DetectionMemo`` caches verdicts keyed by the raw input.
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+
+# 可疑特征串（均为小写，输入在匹配前统一转为小写）
+SUSPICIOUS_PATTERNS = (
+    "'", '"', '--', '/*', '*/', 'union', 'select', 'drop', 'delete',
+    'insert', 'update', 'or 1=1', 'and 1=1', 'xp_', 'sp_'
+)
+
+
+class PatternMatcher:
+    """多模式串匹配器（Aho-Corasick自动机）
+
+    构建时把goto/fail函数展开为完整的状态转移表，匹配时每个字符只需一次字典查找。
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(dict.fromkeys(patterns))
+        if not all(self.patterns):
+            raise ValueError("特征串不能为空")
+
+        # 1. 构建trie
+        goto = [{}]
+        outputs = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # 2. 广度优先计算fail指针，同时把转移补全为确定性自动机
+        fail = [0] * len(goto)
+        delta = [dict(edges) for edges in goto]
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, nxt in goto[state].items():
+                pending.append(nxt)
+                if state:
+                    fallback = fail[state]
+                    while fallback and ch not in goto[fallback]:
+                        fallback = fail[fallback]
+                    fail[nxt] = goto[fallback].get(ch, 0)
+                outputs[nxt].extend(outputs[fail[nxt]])
+            # 状态的完整转移 = 自身的goto边 + fail状态的完整转移（BFS保证fail状态已补全）
+            if state:
+                merged = dict(delta[fail[state]])
+                merged.update(goto[state])
+                delta[state] = merged
+
+        self._delta = delta
+        self._outputs = [
+            tuple((index, len(self.patterns[index])) for index in sorted(out))
+            for out in outputs
+        ]
+
+    def finditer(self, text):
+        """逐个产出 ``(起始偏移, 特征串序号)``，包括相互重叠的匹配"""
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for position, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                end = position + 1
+                for index, length in outputs[state]:
+                    yield end - length, index
+
+    def scan(self, text):
+        """返回所有匹配 ``[(特征串, 起始偏移), ...]``，按出现位置排序"""
+        patterns = self.patterns
+        matches = [(patterns[index], start) for start, index in self.finditer(text)]
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def matched_patterns(self, text):
+        """返回出现过的特征串（去重，保持特征列表中的原始顺序）"""
+        found = {index for _, index in self.finditer(text)}
+        return [self.patterns[index] for index in sorted(found)]
+
+
+# 模块导入时构建一次，之后所有请求共享
+DEFAULT_MATCHER = PatternMatcher(SUSPICIOUS_PATTERNS)
+
+
+class DetectionMemo:
+    """按原始输入缓存 ``matched_patterns`` 结果的有界LRU（线程安全）
+
+    - ``max_entries``: 最多缓存的输入数
+    - ``max_input_length``: 超过该长度的输入不查缓存、也不放入缓存，直接扫描
+
+    缓存中保存元组，每次返回新的列表，调用者修改结果不会影响缓存。
+    """
+
+    def __init__(self, matcher, max_entries=4096, max_input_length=256):
+        self.matcher = matcher
+        self.max_entries = max_entries
+        self.max_input_length = max_input_length
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evicted = 0
+
+    def matched_patterns(self, text):
+        """与 ``matcher.matched_patterns(text.lower())`` 相同"""
+        if len(text) > self.max_input_length:
+            with self._lock:
+                self.bypassed += 1
+            return self.matcher.matched_patterns(text.lower())
+
+        entries = self._entries
+        with self._lock:
+            found = entries.get(text)
+            if found is not None:
+                entries.move_to_end(text)
+                self.hits += 1
+                return list(found)
+            self.misses += 1
+
+        found = tuple(self.matcher.matched_patterns(text.lower()))
+        with self._lock:
+            entries[text] = found
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evicted += 1
+        return list(found)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evicted": self.evicted,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_input_length": self.max_input_length,
+            }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结构化攻击事件存储
+Structured Attack Event Store
+
+把攻击事件（时间、端点、客户端IP、命中的特征、载荷长度）写入带索引的SQLite表，
+支持按条件过滤和按时间分桶聚合，所有查询都走索引而非全表扫描。
+Stores attack events (timestamp, endpoint, client IP, matched patterns and
+payload length) in indexed SQLite tables so they can be filtered and
+aggregated into time buckets straight from the indexes.
+"""
+
+import contextlib
+import json
+import sqlite3
+import threading
+
+from db_pool import ConnectionPool, readonly_uri
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attack_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    endpoint TEXT NOT NULL,
+    client_ip TEXT,
+    patterns TEXT NOT NULL,
+    payload_len INTEGER NOT NULL
+);
+
+-- 每个命中的特征一行，便于按特征聚合
+CREATE TABLE IF NOT EXISTS attack_event_patterns (
+    event_id INTEGER NOT NULL,
+    pattern TEXT NOT NULL,
+    ts REAL NOT NULL,
+    endpoint TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_events_ts ON attack_events (ts, endpoint, client_ip);
+CREATE INDEX IF NOT EXISTS idx_events_endpoint_ts ON attack_events (endpoint, ts, client_ip);
+CREATE INDEX IF NOT EXISTS idx_events_ip_ts ON attack_events (client_ip, ts, endpoint);
+CREATE INDEX IF NOT EXISTS idx_patterns_ts ON attack_event_patterns (ts, pattern, endpoint);
+CREATE INDEX IF NOT EXISTS idx_patterns_pattern_ts ON attack_event_patterns (pattern, ts, endpoint);
+"""
+
+GROUP_BY_FIELDS = ("pattern", "endpoint", "client_ip")
+
+
+class AttackEventStore:
+    """攻击事件表：写入只在日志写入线程中进行，查询使用只读连接池"""
+
+    def __init__(self, path, reader_pool_size=2):
+        self.path = path
+        self._local = threading.local()
+        with contextlib.closing(sqlite3.connect(path)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self._readers = ConnectionPool(
+            readonly_uri(path), size=reader_pool_size, uri=True,
+            pragmas=("query_only=ON",),
+        )
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _writer(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def insert_many(self, events):
+        """批量写入 ``(ts, endpoint, client_ip, patterns, payload_len)`` 事件"""
+        conn = self._writer()
+        with conn:
+            for ts, endpoint, client_ip, patterns, payload_len in events:
+                event_id = conn.execute(
+                    "INSERT INTO attack_events (ts, endpoint, client_ip, patterns, payload_len) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (ts, endpoint, client_ip, json.dumps(list(patterns)), payload_len),
+                ).lastrowid
+                if patterns:
+                    conn.executemany(
+                        "INSERT INTO attack_event_patterns (event_id, pattern, ts, endpoint) "
+                        "VALUES (?, ?, ?, ?)",
+                        [(event_id, pattern, ts, endpoint) for pattern in patterns],
+                    )
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def _query(self, sql, params):
+        conn = self._readers.acquire()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self._readers.release(conn)
+
+    @staticmethod
+    def _filters(since, until, endpoint=None, client_ip=None, prefix=""):
+        clauses = [f"{prefix}ts >= ?", f"{prefix}ts < ?"]
+        params = [since, until]
+        if endpoint:
+            clauses.append(f"{prefix}endpoint = ?")
+            params.append(endpoint)
+        if client_ip:
+            clauses.append(f"{prefix}client_ip = ?")
+            params.append(client_ip)
+        return clauses, params
+
+    def events(self, since, until, endpoint=None, client_ip=None, pattern=None, limit=50):
+        """按条件返回最近的攻击事件（时间倒序）"""
+        if pattern:
+            clauses, params = self._filters(since, until, endpoint, prefix="p.")
+            if client_ip:
+                clauses.append("e.client_ip = ?")
+                params.append(client_ip)
+            sql = (
+                "SELECT e.id, e.ts, e.endpoint, e.client_ip, e.patterns, e.payload_len "
+                "FROM attack_event_patterns p JOIN attack_events e ON e.id = p.event_id "
+                f"WHERE p.pattern = ? AND {' AND '.join(clauses)} "
+                "ORDER BY p.ts DESC LIMIT ?"
+            )
+            params = [pattern] + params
+        else:
+            clauses, params = self._filters(since, until, endpoint, client_ip)
+            sql = (
+                "SELECT id, ts, endpoint, client_ip, patterns, payload_len FROM attack_events "
+                f"WHERE {' AND '.join(clauses)} ORDER BY ts DESC LIMIT ?"
+            )
+        rows = self._query(sql, params + [limit])
+        return [
+            {
+                "id": row["id"],
+                "ts": row["ts"],
+                "endpoint": row["endpoint"],
+                "client_ip": row["client_ip"],
+                "patterns": json.loads(row["patterns"]),
+                "payload_len": row["payload_len"],
+            }
+            for row in rows
+        ]
+
+    def aggregate(self, since, until, bucket=60, group_by="pattern",
+                  endpoint=None, client_ip=None, pattern=None):
+        """按时间分桶统计攻击次数，``group_by`` 可选 pattern / endpoint / client_ip"""
+        if group_by not in GROUP_BY_FIELDS:
+            raise ValueError(f"group_by 仅支持: {', '.join(GROUP_BY_FIELDS)}")
+        if group_by == "pattern" or pattern:
+            clauses, params = self._filters(since, until, endpoint, prefix="p.")
+            if pattern:
+                clauses.append("p.pattern = ?")
+                params.append(pattern)
+            table = "attack_event_patterns p"
+            key = f"p.{group_by}"
+            # 特征表只冗余了端点字段，涉及客户端IP时按事件id关联事件表
+            if group_by == "client_ip" or client_ip:
+                table += " JOIN attack_events e ON e.id = p.event_id"
+                key = "e.client_ip" if group_by == "client_ip" else key
+                if client_ip:
+                    clauses.append("e.client_ip = ?")
+                    params.append(client_ip)
+            bucket_expr = "CAST(p.ts / ? AS INTEGER) * ?"
+        else:
+            clauses, params = self._filters(since, until, endpoint, client_ip)
+            table = "attack_events"
+            key = group_by
+            bucket_expr = "CAST(ts / ? AS INTEGER) * ?"
+
+        sql = (
+            f"SELECT {bucket_expr} AS bucket, {key} AS key, COUNT(*) AS count "
+            f"FROM {table} WHERE {' AND '.join(clauses)} "
+            "GROUP BY bucket, key ORDER BY bucket, key"
+        )
+        rows = self._query(sql, [bucket, bucket] + params)
+        return [{"bucket": row["bucket"], "key": row["key"], "count": row["count"]} for row in rows]
+
+    def close(self):
+        self._readers.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快速JSON响应编码
+Fast JSON Response Encoding
+
+- 安装了 orjson 时用它编码动态值，否则使用预先构造的紧凑型标准库编码器
+- 查询结果直接由列名和元组编码：按列判断类型后整列交给C实现的转义函数，
+  再用预先生成的 ``%s`` 模板拼出每个对象，不为每一行创建字典
+- 响应信封中的静态部分在导入时编码一次，请求时只编码动态字段
+- Dynamic values go through orjson when installed, otherwise a prebuilt
+  compact stdlib encoder.
+- Query results are encoded straight from column names and row tuples: each
+  column is type-checked once and escaped by the C string encoder, then
+  rows are formatted through a precomputed ``%s`` template, without building
+  a dict per row.
+- Static parts of a response envelope are encoded once at import time; only
+  the dynamic fields are encoded per request.
+"""
+
+import functools
+import json
+import os
+import re
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# auto: 优先 orjson；stdlib: 强制使用标准库
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+BACKEND = "orjson" if orjson is not None and JSON_BACKEND != "stdlib" else "stdlib"
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), check_circular=False)
+
+if BACKEND == "orjson":
+    def dumps(value):
+        """编码为紧凑的JSON字符串"""
+        return orjson.dumps(value).decode("utf-8")
+else:
+    dumps = _encoder.encode
+
+
+class RawJSON(str):
+    """已经编码好的JSON片段，填入模板时原样输出"""
+
+
+# 常见标量的直接编码函数（绕过编码器的调用开销）；float需处理NaN/Infinity，走通用路径
+_SCALAR_ENCODERS = {
+    str: encode_basestring,
+    int: int.__repr__,
+    bool: {True: "true", False: "false"}.__getitem__,
+    type(None): lambda value: "null",
+}
+
+
+# 行数不超过该值时逐行编码，按列判断类型的固定开销不划算
+_SMALL_BATCH = 3
+
+
+def _encode_any(value):
+    encoder = _SCALAR_ENCODERS.get(type(value))
+    return encoder(value) if encoder else dumps(value)
+
+
+@functools.lru_cache(maxsize=256)
+def _row_template(columns):
+    return "{" + ",".join(f"{encode_basestring(name)}:%s" for name in columns) + "}"
+
+
+def encode_row_objects(columns, rows):
+    """把元组行编码为JSON对象字符串列表（每行一个），键为 ``columns``"""
+    if not rows:
+        return []
+    template = _row_template(tuple(columns))
+    if len(rows) <= _SMALL_BATCH:
+        return [template % tuple(map(_encode_any, row)) for row in rows]
+    encoded_columns = []
+    for values in zip(*rows):
+        types = set(map(type, values))
+        encoder = _SCALAR_ENCODERS.get(types.pop()) if len(types) == 1 else None
+        encoded_columns.append(map(encoder or _encode_any, values))
+    return list(map(template.__mod__, zip(*encoded_columns)))
+
+
+def encode_rows(columns, rows):
+    """把元组行编码为JSON对象数组，返回可直接嵌入模板的 ``RawJSON``"""
+    return RawJSON("[" + ",".join(encode_row_objects(columns, rows)) + "]")
+
+
+def column_names(cursor):
+    return [column[0] for column in cursor.description or ()]
+
+
+def fetch_tuples(cursor, size=None):
+    """以普通元组取回结果，跳过连接上配置的 ``sqlite3.Row`` 工厂"""
+    cursor.row_factory = None
+    return cursor.fetchall() if size is None else cursor.fetchmany(size)
+
+
+class Slot:
+    """模板中的动态字段占位符"""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+_SLOT_MARK = "\x00slot\x00"
+_SLOT_PATTERN = re.compile(r'"\\u0000slot\\u0000(\w+)"')
+
+
+def _mark_slots(value):
+    if isinstance(value, Slot):
+        return _SLOT_MARK + value.name
+    if isinstance(value, dict):
+        return {key: _mark_slots(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_mark_slots(item) for item in value]
+    return value
+
+
+class JSONTemplate:
+    """预编码的响应信封：静态字段只在构造时编码一次
+
+    >>> t = JSONTemplate({"ok": True, "users": Slot("users")})
+    >>> t.render(users=[1, 2])
+    '{"ok":true,"users":[1,2]}'
+    """
+
+    def __init__(self, template):
+        parts = _SLOT_PATTERN.split(_encoder.encode(_mark_slots(template)))
+        self._pieces = parts[0::2]
+        self._names = parts[1::2]
+
+    def render(self, **values):
+        pieces = self._pieces
+        out = [pieces[0]]
+        for i, name in enumerate(self._names, 1):
+            value = values[name]
+            out.append(value if isinstance(value, RawJSON) else _encode_any(value))
+            out.append(pieces[i])
+        return "".join(out)
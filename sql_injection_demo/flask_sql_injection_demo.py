@@ -123,116 +123,570 @@ Users should comply with local laws, regulations, and ethical guidelines.
 """
 
 import os
+import json
+import time
+import contextlib
+import re
+import secrets
+import shutil
 import sqlite3
 import logging
+import threading
 import datetime
-from flask import Flask, request, jsonify, g, render_template_string
+import math
+from flask import (
+    Flask, Response, request, jsonify, g, render_template_string, stream_with_context
+)
+
+from db_pool import readonly_uri, storage_profile
+from detection import DEFAULT_MATCHER, DetectionMemo
+from app_logging import LogPipeline
+from attack_log import AttackLogWriter
+from event_store import AttackEventStore
+from seeder import schema_outdated, seed_database, upgrade_schema
+from passwords import PasswordVerifier, VerifierUnavailable, unknown_user_hash
+from server import default_workers
+from metrics import DEFAULT_BUCKETS, PhaseTimer, RequestMetrics
+from fast_json import (
+    JSONTemplate,
+    Slot,
+    column_names,
+    dumps,
+    encode_row_objects,
+    encode_rows,
+    fetch_tuples,
+)
+from precompressed import PrecompressedPage
+from profiler import SORT_KEYS, QueryProfiler
+from query_guard import QueryBudgetExceeded, QueryGuard, parse_budgets
+from rate_limit import TokenBucketLimiter, parse_limits
+from sandbox import SandboxManager
+from search import SORT_ORDERS, has_search_index, search_users
+from storage import DEFAULT_STORAGE_MODES, create_backend
+from response_cache import CachedResponse, ResponseCache, make_etag
 
 app = Flask(__name__)
-DATABASE = "demo.db"
+DATABASE = os.environ.get("DATABASE", "demo.db")
 ATTACK_LOG = "attack_log.txt"
+ATTACK_EVENTS_DB = os.environ.get("ATTACK_EVENTS_DB", "attack_events.db")
+# 初始化时保存的黄金快照，/reset 从它恢复数据库
+GOLDEN_DATABASE = os.environ.get("GOLDEN_DATABASE", "demo.golden.db")
+
+# 攻击日志写入配置 (Attack Log Writer Settings)
+ATTACK_LOG_QUEUE_SIZE = int(os.environ.get("ATTACK_LOG_QUEUE_SIZE", "10000"))
+ATTACK_LOG_BATCH_SIZE = int(os.environ.get("ATTACK_LOG_BATCH_SIZE", "256"))
+ATTACK_LOG_FLUSH_INTERVAL = float(os.environ.get("ATTACK_LOG_FLUSH_INTERVAL", "0.5"))
+ATTACK_LOG_FSYNC_INTERVAL = float(os.environ.get("ATTACK_LOG_FSYNC_INTERVAL", "1"))
+ATTACK_LOG_MAX_BYTES = int(os.environ.get("ATTACK_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+ATTACK_LOG_BACKUP_COUNT = int(os.environ.get("ATTACK_LOG_BACKUP_COUNT", "5"))
+ATTACK_LOG_OVERFLOW = os.environ.get("ATTACK_LOG_OVERFLOW", "drop")  # drop | block
+ATTACK_LOG_CHECKPOINT_INTERVAL = float(os.environ.get("ATTACK_LOG_CHECKPOINT_INTERVAL", "5"))
+
+# 应用日志：文本或JSON行格式，每种消息类型每秒最多记录 LOG_SAMPLE_RATE 条（0表示不采样）
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # text | json
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "5"))
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "20"))
+
+# /setup 允许生成的合成数据上限
+SETUP_MAX_ROWS = int(os.environ.get("SETUP_MAX_ROWS", str(10_000_000)))
+
+# /users 分页与流式输出配置
+USERS_MAX_PAGE_SIZE = int(os.environ.get("USERS_MAX_PAGE_SIZE", "1000"))
+USERS_FETCH_SIZE = int(os.environ.get("USERS_FETCH_SIZE", "500"))
+
+# /login_safe 的口令校验进程池：进程数（0表示在请求线程中校验）、排队上限与超时秒数
+PASSWORD_VERIFIER_WORKERS = int(os.environ.get("PASSWORD_VERIFIER_WORKERS", str(default_workers())))
+PASSWORD_VERIFIER_MAX_PENDING = int(os.environ.get("PASSWORD_VERIFIER_MAX_PENDING", "0")) or None
+PASSWORD_VERIFIER_TIMEOUT = float(os.environ.get("PASSWORD_VERIFIER_TIMEOUT", "5"))
+
+# 按会话隔离的内存沙箱数据库：SANDBOX_ENABLED=1 时每个会话使用黄金快照的独立副本
+SANDBOX_ENABLED = os.environ.get("SANDBOX_ENABLED", "0") == "1"
+SANDBOX_MAX_BYTES = int(os.environ.get("SANDBOX_MAX_BYTES", str(512 * 1024 * 1024)))
+SANDBOX_SESSION_MAX_BYTES = int(os.environ.get("SANDBOX_SESSION_MAX_BYTES", "0")) or None
+SANDBOX_IDLE_TIMEOUT = float(os.environ.get("SANDBOX_IDLE_TIMEOUT", "1800"))
+SANDBOX_COOKIE = "sandbox_session"
+
+# /advanced_safe 检索分页配置
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", "100"))
+SEARCH_MAX_OFFSET = int(os.environ.get("SEARCH_MAX_OFFSET", "10000"))
+SEARCH_MAX_TERM_LENGTH = int(os.environ.get("SEARCH_MAX_TERM_LENGTH", "100"))
+
+# 批量检测接口每次输出的结果行数，以及单个请求体的字节数与输入项数上限
+DETECT_CHUNK_ITEMS = int(os.environ.get("DETECT_CHUNK_ITEMS", "256"))
+DETECT_MAX_BYTES = int(os.environ.get("DETECT_MAX_BYTES", str(8 * 1024 * 1024)))
+DETECT_MAX_ITEMS = int(os.environ.get("DETECT_MAX_ITEMS", "10000"))
+
+# 登录与检索端点的检测结果缓存：条目数（0表示关闭）与参与缓存的最大输入长度
+DETECTION_CACHE_ENTRIES = int(os.environ.get("DETECTION_CACHE_ENTRIES", "4096"))
+DETECTION_CACHE_MAX_INPUT = int(os.environ.get("DETECTION_CACHE_MAX_INPUT", "256"))
+
+# 连接池配置 (Connection Pool Settings)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_WRITER_POOL_SIZE = int(os.environ.get("DB_WRITER_POOL_SIZE", "1"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))
+DB_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_HEALTH_CHECK_INTERVAL", "30"))
+
+# 存储后端 (Storage Backend): file | memory | shared_memory，见 storage.py
+DB_BACKEND = os.environ.get("DB_BACKEND", "file")
+
+# 存储模式配置 (Storage Mode): rollback | wal | memory，默认值取决于存储后端
+DB_STORAGE_MODE = os.environ.get("DB_STORAGE_MODE", DEFAULT_STORAGE_MODES.get(DB_BACKEND, "wal"))
+DB_STORAGE_PROFILE = storage_profile(
+    DB_STORAGE_MODE,
+    synchronous=os.environ.get("DB_SYNCHRONOUS"),
+    mmap_size=os.environ.get("DB_MMAP_SIZE"),
+    cache_size=os.environ.get("DB_CACHE_SIZE"),
+)
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+# 轮询端点（/users、/stats）按数据版本缓存的响应
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# 按客户端IP和端点限流：endpoint=每秒请求数:突发容量，RATE_LIMITS 为空时关闭
+RATE_LIMITS = parse_limits(os.environ.get(
+    "RATE_LIMITS",
+    "login_vuln=20:40,advanced_vuln=10:20,login_safe=50:100,advanced_safe=50:100,bulk_detect=5:10"
+))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# 脆弱端点的查询预算：endpoint=最大虚拟机指令数:最长秒数:最大行数，0表示该项不限制
+QUERY_BUDGETS = parse_budgets(os.environ.get(
+    "QUERY_BUDGETS", "login_vuln=5000000:0.5:1000,advanced_vuln=20000000:1.0:1000"
+))
+QUERY_MAX_VALUE_BYTES = int(os.environ.get("QUERY_MAX_VALUE_BYTES", str(1024 * 1024)))
+
+# 慢查询日志：执行加取数超过阈值毫秒数的语句按规范化SQL归并，并采集查询计划
+QUERY_PROFILER_ENABLED = os.environ.get("QUERY_PROFILER_ENABLED", "1") != "0"
+QUERY_PROFILER_THRESHOLD_MS = float(os.environ.get("QUERY_PROFILER_THRESHOLD_MS", "10"))
+QUERY_PROFILER_MAX_ENTRIES = int(os.environ.get("QUERY_PROFILER_MAX_ENTRIES", "200"))
+
+# 请求分阶段耗时统计，METRICS_ENABLED=0 时完全关闭（不注册任何钩子）
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+METRICS_BUCKETS = tuple(
+    float(b) for b in os.environ.get("METRICS_BUCKETS", "").split(",") if b.strip()
+) or DEFAULT_BUCKETS
+
+# 配置日志：请求线程只采样并入队，格式化和写入由后台线程完成
+log_pipeline = LogPipeline(
+    path=LOG_FILE,
+    level=LOG_LEVEL,
+    fmt=LOG_FORMAT,
+    max_queue=LOG_QUEUE_SIZE,
+    sample_rate=LOG_SAMPLE_RATE,
+    sample_burst=LOG_SAMPLE_BURST,
+).install()
+
+# ---------------------------------------------------------------------------
+# 请求耗时统计 (Request Phase Metrics)
+# ---------------------------------------------------------------------------
+
+request_metrics = RequestMetrics(METRICS_BUCKETS) if METRICS_ENABLED else None
+_NO_PHASE = contextlib.nullcontext()
+
+if METRICS_ENABLED:
+    def phase(name):
+        """统计当前请求中某一阶段（detect/get_db/execute/fetch/serialize/jsonify）的耗时"""
+        phases = g.get("_phases")
+        return _NO_PHASE if phases is None else PhaseTimer(phases, name)
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_started = time.perf_counter()
+        g._phases = []
+
+    @app.after_request
+    def _record_request_metrics(response):
+        # 流式响应只统计到生成器开始迭代之前
+        started = g.pop("_request_started", None)
+        if started is not None:
+            request_metrics.record(
+                request.endpoint or "unmatched", response.status_code,
+                time.perf_counter() - started, g._phases,
+            )
+        return response
+else:
+    def phase(name):
+        """统计已关闭：返回共享的空上下文"""
+        return _NO_PHASE
+
+
+# ---------------------------------------------------------------------------
+# 准入控制 (Admission Control)
+# ---------------------------------------------------------------------------
+
+rate_limiters = {
+    endpoint: TokenBucketLimiter(rate, burst, RATE_LIMIT_MAX_CLIENTS)
+    for endpoint, (rate, burst) in RATE_LIMITS.items()
+}
+
+# 429响应体预先编码，被限流的请求不做任何其他工作
+THROTTLED_BODY = dumps({
+    "success": False,
+    "error": "请求过于频繁，请稍后再试",
+    "security_info": "按客户端限流可防止自动化注入工具耗尽服务器资源",
+}).encode("utf-8")
+
+
+@app.before_request
+def _admission_control():
+    limiter = rate_limiters.get(request.endpoint)
+    if limiter is None or limiter.allow(request.remote_addr):
+        return None
+    retry_after = max(1, int(limiter.retry_after(request.remote_addr) + 0.999))
+    return Response(
+        THROTTLED_BODY, status=429, mimetype="application/json",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def rate_limit_stats():
+    return {endpoint: limiter.stats() for endpoint, limiter in rate_limiters.items()}
+
+
+# ---------------------------------------------------------------------------
+# 失控查询保护 (Runaway Query Guard)
+# ---------------------------------------------------------------------------
+
+query_guards = {
+    endpoint: QueryGuard(steps, seconds, rows, max_value_bytes=QUERY_MAX_VALUE_BYTES)
+    for endpoint, (steps, seconds, rows) in QUERY_BUDGETS.items()
+}
+
+
+class _Unguarded(contextlib.nullcontext):
+    @staticmethod
+    def fetch(cursor):
+        return fetch_tuples(cursor)
+
+
+def guard_query(endpoint, conn):
+    """返回端点的查询预算上下文；未配置预算时只按元组取回结果"""
+    guard = query_guards.get(endpoint)
+    return guard.watch(conn) if guard is not None else _Unguarded()
+
+
+def query_guard_stats():
+    return {endpoint: guard.stats() for endpoint, guard in query_guards.items()}
+
+
+def query_aborted_response(endpoint, error, query):
+    """查询超出预算时的统一响应"""
+    logging.warning("查询超出预算被中止 (%s): %s", endpoint, error.reason)
+    return jsonify({
+        "endpoint": endpoint,
+        "success": False,
+        "error": str(error),
+        "reason": error.reason,
+        "budget": error.budget,
+        "executed_sql": query,
+        "security_warning": "注入的载荷试图执行失控查询（笛卡尔积、超大值或超多行）",
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 400
+
+
+# ---------------------------------------------------------------------------
+# 慢查询日志 (Slow-Query Log)
+# ---------------------------------------------------------------------------
+
+# 连接池和沙箱的连接都由 DB_CONNECTION_FACTORY 创建，关闭时使用普通连接，没有任何计时开销
+query_profiler = QueryProfiler(
+    threshold_ms=QUERY_PROFILER_THRESHOLD_MS,
+    max_entries=QUERY_PROFILER_MAX_ENTRIES,
+) if QUERY_PROFILER_ENABLED else None
+
+DB_CONNECTION_FACTORY = (
+    query_profiler.connection_factory() if query_profiler is not None else sqlite3.Connection
 )
 
+
 # ---------------------------------------------------------------------------
 # 数据库连接管理 (Database Connection Management)
 # ---------------------------------------------------------------------------
 
-def get_db():
-    """返回一个在请求生命周期内有效的数据库连接"""
-    db = getattr(g, "_database", None)
+storage = create_backend(
+    DB_BACKEND,
+    DATABASE,
+    GOLDEN_DATABASE,
+    DB_STORAGE_PROFILE,
+    pool_size=DB_POOL_SIZE,
+    writer_pool_size=DB_WRITER_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+    pragmas=("temp_store=MEMORY",),
+    factory=DB_CONNECTION_FACTORY,
+)
+
+# 写连接池：承担所有可能产生写入的语句（包括脆弱端点上被注入的语句）
+writer_pool = storage.writer_pool
+
+# 只读连接池：供只读端点使用（memory 后端与写连接池是同一个）
+reader_pool = storage.reader_pool
+
+
+def _sandbox_source():
+    """沙箱模板：优先使用黄金快照（只会被整体替换，可按immutable方式打开）"""
+    if os.path.exists(GOLDEN_DATABASE):
+        return f"{readonly_uri(GOLDEN_DATABASE)}&immutable=1"
+    return readonly_uri(DATABASE)
+
+
+sandboxes = SandboxManager(
+    _sandbox_source(),
+    max_bytes=SANDBOX_MAX_BYTES,
+    idle_timeout=SANDBOX_IDLE_TIMEOUT,
+    max_session_bytes=SANDBOX_SESSION_MAX_BYTES,
+    pragmas=("temp_store=MEMORY",),
+    factory=DB_CONNECTION_FACTORY,
+) if SANDBOX_ENABLED else None
+
+_SANDBOX_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+if SANDBOX_ENABLED:
+    @app.after_request
+    def _set_sandbox_cookie(response):
+        session_id = g.get("_new_sandbox_session")
+        if session_id is not None:
+            response.set_cookie(SANDBOX_COOKIE, session_id, httponly=True, samesite="Lax")
+        return response
+
+
+def sandbox_session_id():
+    """当前请求的沙箱会话id：来自cookie
+
+    没有cookie或格式不对时在响应中下发新的cookie，但本次请求使用按客户端地址共享的沙箱：
+    不保存cookie的客户端（curl、脚本）每个地址只占一个沙箱，不会每个请求克隆一份并挤掉其他人的沙箱。
+    地址会话的id含有 ``:``，伪造的cookie无法冒用。
+    """
+    session_id = request.cookies.get(SANDBOX_COOKIE)
+    if session_id and _SANDBOX_SESSION_ID.fullmatch(session_id):
+        return session_id
+    if g.get("_new_sandbox_session") is None:
+        g._new_sandbox_session = secrets.token_urlsafe(18)
+    return f"addr:{request.remote_addr}"
+
+
+def _current_sandbox():
+    sandbox = g.get("_sandbox")
+    if sandbox is None:
+        with phase("get_db"):
+            sandbox = sandboxes.acquire(sandbox_session_id())
+        g._sandbox = sandbox
+    return sandbox
+
+
+# 本进程重建数据库的次数，和数据库文件状态一起构成 /users 的数据版本
+data_generation = 0
+
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
+
+def users_data_version():
+    """廉价的数据版本标记：由存储后端给出（文件后端为两次stat）；沙箱模式下为会话沙箱的修改计数"""
+    if sandboxes is not None:
+        return _current_sandbox().version()
+    return data_generation, storage.data_version()
+
+
+# (数据生成代数, 是否有全文检索索引)，数据库重建后重新检查
+_search_index_state = (None, False)
+
+
+def search_index_ready(db):
+    global _search_index_state
+    generation, ready = _search_index_state
+    if generation != data_generation:
+        ready = has_search_index(db)
+        _search_index_state = (data_generation, ready)
+    return ready
+
+
+def get_db(readonly=False):
+    """从连接池借出一个在请求生命周期内有效的数据库连接
+
+    ``readonly=True`` 时使用只读连接，WAL模式下不会被写事务阻塞。
+    沙箱模式下读写都使用当前会话的沙箱数据库。
+    """
+    if sandboxes is not None:
+        return _current_sandbox().conn
+    # 读写共用一个连接池时，同一请求只借出一个连接
+    attr = "_db_reader" if readonly and reader_pool is not writer_pool else "_db_writer"
+    db = getattr(g, attr, None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        pool = reader_pool if readonly else writer_pool
+        with phase("get_db"):
+            db = pool.acquire()
+        setattr(g, attr, db)
     return db
 
 
+def release_db():
+    """提前归还当前请求借出的数据库连接（及沙箱），之后再调用 ``get_db()`` 会重新借出"""
+    sandbox = g.pop("_sandbox", None)
+    if sandbox is not None:
+        sandboxes.release(sandbox)
+    db = g.pop("_db_reader", None)
+    if db is not None:
+        reader_pool.release(db)
+    db = g.pop("_db_writer", None)
+    if db is not None:
+        writer_pool.release(db)
+
+
 @app.teardown_appcontext
 def close_connection(exception):
-    """请求结束时关闭数据库连接"""
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
+    """请求结束时将数据库连接归还连接池"""
+    release_db()
 
 
 # ---------------------------------------------------------------------------
 # 数据库初始化 (Database Initialization)
 # ---------------------------------------------------------------------------
 
-def init_db():
-    """创建用户表并插入测试数据"""
-    if os.path.exists(DATABASE):
-        logging.info("数据库已存在，跳过初始化")
+# 同一进程中的初始化（并发的 /setup）依次进行
+_init_lock = threading.Lock()
+
+
+def _building_path(path):
+    """``path`` 旁边的临时文件名，每次调用都不同：并发的初始化不会删除或改写彼此的半成品"""
+    return f"{path}.{os.getpid()}-{secrets.token_hex(4)}.building"
+
+
+def init_db(users=0, secret_count=0, seed=None, force=False):
+    """创建用户表并插入测试数据
+
+    ``users`` / ``secret_count`` 为额外生成的合成用户数与敏感数据条数（见 seeder.py），
+    ``force=True`` 时重建已存在的数据库。
+    """
+    with _init_lock:
+        if storage.exists() and not force:
+            logging.info("数据库已存在，跳过初始化")
+            _upgrade_database_files()
+            if sandboxes is not None:
+                sandboxes.reload(_sandbox_source())
+            return None
+
+        logging.info("正在初始化数据库...")
+        # 先在临时文件中完成批量导入，避免其他连接看到半成品；导入结果保存为黄金快照
+        building = _building_path(GOLDEN_DATABASE)
+        try:
+            timings = seed_database(
+                building, users=users, secrets=secret_count, seed=seed,
+                journal_mode=DB_STORAGE_PROFILE["journal_mode"],
+            )
+            os.replace(building, GOLDEN_DATABASE)
+        finally:
+            if os.path.exists(building):
+                os.remove(building)
+        storage.load(GOLDEN_DATABASE)
+        _data_replaced()
+    logging.info(
+        "数据库初始化完成: %d个合成用户, %d条合成敏感数据, 耗时%s", users, secret_count, timings
+    )
+    return timings
+
+
+def _upgrade_database_files():
+    """旧版本生成的数据库缺少口令哈希列和全文检索索引：原地升级数据库，黄金快照复制后升级再替换"""
+    storage.upgrade(upgrade_schema)
+    if not os.path.exists(GOLDEN_DATABASE):
         return
+    golden = f"{readonly_uri(GOLDEN_DATABASE)}&immutable=1"
+    with contextlib.closing(sqlite3.connect(golden, uri=True)) as conn:
+        outdated = schema_outdated(conn)
+    if outdated:
+        building = _building_path(GOLDEN_DATABASE)
+        try:
+            shutil.copyfile(GOLDEN_DATABASE, building)
+            with contextlib.closing(sqlite3.connect(building)) as conn:
+                upgrade_schema(conn)
+            os.replace(building, GOLDEN_DATABASE)
+        finally:
+            if os.path.exists(building):
+                os.remove(building)
+
+
+def reset_db():
+    """从黄金快照恢复数据库，撤销注入语句造成的修改
+
+    没有黄金快照（数据库由旧版本生成）时按默认规模重新初始化。
+    """
+    if not os.path.exists(GOLDEN_DATABASE):
+        logging.info("没有黄金快照，重新初始化数据库")
+        timings = init_db(force=True)
+        return {"restored_from": None, "timings": timings}
+    started = time.perf_counter()
+    storage.load(GOLDEN_DATABASE)
+    _data_replaced()
+    elapsed = time.perf_counter() - started
+    logging.info("数据库已从黄金快照恢复，耗时%.3f秒", elapsed)
+    return {"restored_from": GOLDEN_DATABASE, "timings": {"restore": round(elapsed, 3)}}
+
+
+def _data_replaced():
+    """数据库内容被整体替换后，使本进程的缓存失效"""
+    global data_generation
+    data_generation += 1
+    response_cache.clear()
+    if sandboxes is not None:
+        sandboxes.reload(_sandbox_source())
+
+
+attack_event_store = AttackEventStore(ATTACK_EVENTS_DB)
+
+attack_log_writer = AttackLogWriter(
+    ATTACK_LOG,
+    max_queue=ATTACK_LOG_QUEUE_SIZE,
+    batch_size=ATTACK_LOG_BATCH_SIZE,
+    flush_interval=ATTACK_LOG_FLUSH_INTERVAL,
+    fsync_interval=ATTACK_LOG_FSYNC_INTERVAL,
+    max_bytes=ATTACK_LOG_MAX_BYTES,
+    backup_count=ATTACK_LOG_BACKUP_COUNT,
+    overflow=ATTACK_LOG_OVERFLOW,
+    recent_size=10,
+    checkpoint_interval=ATTACK_LOG_CHECKPOINT_INTERVAL,
+    event_store=attack_event_store,
+)
 
-    logging.info("正在初始化数据库...")
-    with sqlite3.connect(DATABASE) as conn:
-        conn.executescript(
-            """
-            CREATE TABLE users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                role TEXT DEFAULT 'user',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE sensitive_data (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER,
-                secret_info TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            );
-
-            INSERT INTO users (username, password, role) VALUES
-                ('admin', 'admin123', 'administrator'),
-                ('alice', 'alice_password', 'user'),
-                ('bob', 'bob123', 'user'),
-                ('test_user', 'test123', 'user');
-
-            INSERT INTO sensitive_data (user_id, secret_info) VALUES
-                (1, 'Top Secret Admin Data'),
-                (2, 'Alice Personal Information'),
-                (3, 'Bob Confidential Records');
-            """
-        )
-    logging.info("数据库初始化完成")
 
+def log_attack_attempt(endpoint, query, user_input, patterns=(), client_ip=None):
+    """记录可疑的攻击尝试（放入队列，由后台线程批量写入日志文件和事件表）"""
+    now = time.time()
+    timestamp = datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+    return attack_log_writer.submit(
+        f"[{timestamp}] {endpoint} - Query: {query} - Input: {user_input}\n",
+        event=(now, endpoint, client_ip, tuple(dict.fromkeys(patterns)), len(user_input)),
+    )
 
-def log_attack_attempt(endpoint, query, user_input):
-    """记录可疑的攻击尝试"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(ATTACK_LOG, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {endpoint} - Query: {query} - Input: {user_input}\n")
+
+# 扫描器反复发送相同的载荷，检测结果按原始输入缓存
+detection_memo = DetectionMemo(
+    DEFAULT_MATCHER, DETECTION_CACHE_ENTRIES, DETECTION_CACHE_MAX_INPUT
+) if DETECTION_CACHE_ENTRIES else None
 
 
 def detect_sql_injection(input_string):
-    """简单的SQL注入检测机制"""
-    suspicious_patterns = [
-        "'", '"', '--', '/*', '*/', 'union', 'select', 'drop', 'delete', 
-        'insert', 'update', 'or 1=1', 'and 1=1', 'xp_', 'sp_'
-    ]
-    input_lower = input_string.lower()
-    detected_patterns = [pattern for pattern in suspicious_patterns if pattern in input_lower]
+    """简单的SQL注入检测机制（单次扫描匹配全部特征串，见 detection.py）"""
+    if detection_memo is not None:
+        detected_patterns = detection_memo.matched_patterns(input_string)
+    else:
+        detected_patterns = DEFAULT_MATCHER.matched_patterns(input_string.lower())
     return len(detected_patterns) > 0, detected_patterns
 
 
+def scan_sql_injection(input_string):
+    """返回每一处特征匹配 ``[(特征串, 偏移), ...]``，偏移基于小写化后的输入"""
+    return DEFAULT_MATCHER.scan(input_string.lower())
+
+
 # ---------------------------------------------------------------------------
 # Web界面和路由 (Web Interface and Routes)
 # ---------------------------------------------------------------------------
 
-@app.route("/")
-def index():
-    """主页面 - 显示演示说明和测试链接"""
-    html_template = """
+# 主页内容不变：首次访问时渲染一次，之后直接返回预编码、预压缩的字节
+INDEX_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="zh-CN">
     <head>
@@ -309,32 +763,108 @@ sqlmap -u "http://127.0.0.1:5000/login_safe?username=test&password=test" --batch
     </body>
     </html>
     """
-    return render_template_string(html_template)
+
+INDEX_PAGE = PrecompressedPage(lambda: render_template_string(INDEX_TEMPLATE))
+
+
+@app.route("/")
+def index():
+    """主页面 - 显示演示说明和测试链接（支持ETag/304与gzip、brotli压缩）"""
+    return INDEX_PAGE.response()
 
 
 @app.route("/setup")
 def setup():
-    """初始化数据库的HTTP端点"""
+    """初始化数据库的HTTP端点
+
+    可选参数 ``users`` / ``secrets`` / ``seed`` 生成指定规模的合成数据（会重建数据库），
+    ``force=1`` 时即使数据库已存在也重建。
+    """
     try:
-        init_db()
+        users = int(request.args.get("users", 0))
+        secret_count = int(request.args.get("secrets", 0))
+        seed = request.args.get("seed")
+        seed = int(seed) if seed else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "users、secrets、seed 必须是整数"}), 400
+    if not (0 <= users <= SETUP_MAX_ROWS and 0 <= secret_count <= SETUP_MAX_ROWS):
+        return jsonify({
+            "status": "error",
+            "message": f"合成数据规模必须在 0 到 {SETUP_MAX_ROWS} 之间"
+        }), 400
+    force = bool(users or secret_count) or request.args.get("force") in ("1", "true")
+
+    try:
+        timings = init_db(users=users, secret_count=secret_count, seed=seed, force=force)
         logging.info("通过Web接口初始化数据库")
         return jsonify({
             "status": "success",
             "message": "数据库初始化完成",
+            "seeded": {"users": users, "secrets": secret_count, "seed": seed, "timings": timings},
             "timestamp": datetime.datetime.now().isoformat()
         })
     except Exception as e:
-        logging.error(f"数据库初始化失败: {str(e)}")
+        logging.error("数据库初始化失败: %s", e)
         return jsonify({
             "status": "error",
             "message": f"数据库初始化失败: {str(e)}"
         }), 500
 
 
+@app.route("/reset", methods=["POST"])
+def reset():
+    """从黄金快照恢复数据库（撤销被注入的 DELETE/UPDATE 等修改）
+
+    沙箱模式下只丢弃当前会话的沙箱，下一个请求重新从模板克隆。
+    """
+    if sandboxes is not None:
+        discarded = sandboxes.discard(sandbox_session_id())
+        return jsonify({
+            "status": "success",
+            "message": "会话沙箱已恢复",
+            "sandbox_discarded": discarded,
+            "timestamp": datetime.datetime.now().isoformat()
+        })
+    try:
+        result = reset_db()
+    except sqlite3.Error as e:
+        logging.error("数据库恢复失败: %s", e)
+        return jsonify({"status": "error", "message": f"数据库恢复失败: {str(e)}"}), 500
+    return jsonify({
+        "status": "success",
+        "message": "数据库已恢复",
+        **result,
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+
+
 # ---------------------------------------------------------------------------
 # 脆弱端点 - SQL注入演示 (Vulnerable Endpoint)
 # ---------------------------------------------------------------------------
 
+def _json_response(body, status=200, **kwargs):
+    return Response(body, status=status, mimetype="application/json", **kwargs)
+
+
+# 响应信封的静态部分在导入时编码一次
+LOGIN_VULN_RESPONSE = JSONTemplate({
+    "endpoint": "vulnerable",
+    "success": Slot("success"),
+    "user_count": Slot("user_count"),
+    "users": Slot("users"),
+    "executed_sql": Slot("executed_sql"),
+    "security_analysis": {
+        "vulnerability_detected": True,
+        "risk_level": "HIGH",
+        "attack_patterns": {
+            "username": Slot("username_patterns"),
+            "password": Slot("password_patterns"),
+        },
+    },
+    "timestamp": Slot("timestamp"),
+})
+
+
 @app.route("/login_vuln")
 def login_vuln():
     """🚨 故意存在SQL注入漏洞的登录端点 - 仅用于演示！"""
@@ -342,8 +872,9 @@ def login_vuln():
     password = request.args.get("password", "")
     
     # 检测可疑输入
-    is_suspicious_user, user_patterns = detect_sql_injection(username)
-    is_suspicious_pass, pass_patterns = detect_sql_injection(password)
+    with phase("detect"):
+        is_suspicious_user, user_patterns = detect_sql_injection(username)
+        is_suspicious_pass, pass_patterns = detect_sql_injection(password)
     
     # ⚠️ 故意脆弱的SQL查询构造 - 直接字符串拼接
     query = (
@@ -353,36 +884,40 @@ def login_vuln():
     
     # 记录可疑活动
     if is_suspicious_user or is_suspicious_pass:
-        log_attack_attempt("login_vuln", query, f"user:{username}, pass:{password}")
-        logging.warning(f"检测到可疑SQL注入尝试: {username} | {password}")
+        log_attack_attempt(
+            "login_vuln", query, f"user:{username}, pass:{password}",
+            patterns=user_patterns + pass_patterns, client_ip=request.remote_addr,
+        )
+        logging.warning("检测到可疑SQL注入尝试: %s | %s", username, password)
     
     try:
-        cur = get_db().execute(query)
-        rows = cur.fetchall()
+        db = get_db()
+        with guard_query("login_vuln", db) as watch:
+            with phase("execute"):
+                cur = db.execute(query)
+            with phase("fetch"):
+                rows = watch.fetch(cur)
         
-        result = {
-            "endpoint": "vulnerable",
-            "success": len(rows) > 0,
-            "user_count": len(rows),
-            "users": [dict(r) for r in rows],
-            "executed_sql": query,
-            "security_analysis": {
-                "vulnerability_detected": True,
-                "risk_level": "HIGH",
-                "attack_patterns": {
-                    "username": user_patterns if is_suspicious_user else [],
-                    "password": pass_patterns if is_suspicious_pass else []
-                }
-            },
-            "timestamp": datetime.datetime.now().isoformat()
-        }
+        with phase("serialize"):
+            users = encode_rows(column_names(cur), rows)
         
-        logging.info(f"脆弱端点访问 - 返回{len(rows)}条记录")
-        return jsonify(result)
+        logging.info("脆弱端点访问 - 返回%d条记录", len(rows))
+        with phase("jsonify"):
+            return _json_response(LOGIN_VULN_RESPONSE.render(
+                success=len(rows) > 0,
+                user_count=len(rows),
+                users=users,
+                executed_sql=query,
+                username_patterns=user_patterns if is_suspicious_user else [],
+                password_patterns=pass_patterns if is_suspicious_pass else [],
+                timestamp=datetime.datetime.now().isoformat(),
+            ))
         
+    except QueryBudgetExceeded as e:
+        return query_aborted_response("vulnerable", e, query)
     except sqlite3.Error as e:
         error_msg = str(e)
-        logging.error(f"SQL执行错误: {error_msg}")
+        logging.error("SQL执行错误: %s", error_msg)
         return jsonify({
             "endpoint": "vulnerable",
             "success": False,
@@ -397,9 +932,41 @@ def login_vuln():
 # 安全端点 - 参数化查询演示 (Safe Endpoint)
 # ---------------------------------------------------------------------------
 
+LOGIN_SAFE_RESPONSE = JSONTemplate({
+    "endpoint": "safe",
+    "success": Slot("success"),
+    "user_count": Slot("user_count"),
+    "users": Slot("users"),
+    "security_analysis": {
+        "vulnerability_detected": False,
+        "risk_level": "LOW",
+        "protection_mechanisms": [
+            "参数化查询",
+            "加盐口令哈希",
+            "输入长度限制",
+            "敏感信息过滤",
+            "错误信息控制"
+        ],
+        "suspicious_input_detected": Slot("suspicious"),
+        "attack_patterns_neutralized": Slot("patterns"),
+    },
+    "timestamp": Slot("timestamp"),
+})
+
+
+password_verifier = PasswordVerifier(
+    workers=PASSWORD_VERIFIER_WORKERS,
+    max_pending=PASSWORD_VERIFIER_MAX_PENDING,
+    timeout=PASSWORD_VERIFIER_TIMEOUT,
+)
+
+
 @app.route("/login_safe")
 def login_safe():
-    """✅ 使用参数化查询的安全登录端点"""
+    """✅ 使用参数化查询和口令哈希的安全登录端点
+
+    按用户名查出口令哈希后交给校验进程池比对；用户不存在时也校验一次，响应时间不泄露用户是否存在。
+    """
     username = request.args.get("username", "")
     password = request.args.get("password", "")
     
@@ -413,45 +980,55 @@ def login_safe():
         }), 400
     
     # 检测可疑输入（仅用于统计和警告）
-    is_suspicious_user, user_patterns = detect_sql_injection(username)
-    is_suspicious_pass, pass_patterns = detect_sql_injection(password)
+    with phase("detect"):
+        is_suspicious_user, user_patterns = detect_sql_injection(username)
+        is_suspicious_pass, pass_patterns = detect_sql_injection(password)
     
     if is_suspicious_user or is_suspicious_pass:
-        logging.info(f"安全端点收到可疑输入（已被安全处理）: {username}")
+        logging.info("安全端点收到可疑输入（已被安全处理）: %s", username)
     
     try:
         # ✅ 安全的参数化查询
-        cur = get_db().execute(
-            "SELECT id, username, role FROM users WHERE username=? AND password=?", 
-            (username, password)
-        )
-        rows = cur.fetchall()
-        
-        result = {
-            "endpoint": "safe",
-            "success": len(rows) > 0,
-            "user_count": len(rows),
-            "users": [dict(r) for r in rows],  # 注意：不返回密码字段
-            "security_analysis": {
-                "vulnerability_detected": False,
-                "risk_level": "LOW",
-                "protection_mechanisms": [
-                    "参数化查询",
-                    "输入长度限制", 
-                    "敏感信息过滤",
-                    "错误信息控制"
-                ],
-                "suspicious_input_detected": is_suspicious_user or is_suspicious_pass,
-                "attack_patterns_neutralized": user_patterns + pass_patterns
-            },
-            "timestamp": datetime.datetime.now().isoformat()
-        }
+        db = get_db(readonly=True)
+        with phase("execute"):
+            cur = db.execute(
+                "SELECT id, username, role, password_hash FROM users WHERE username=?",
+                (username,)
+            )
+        with phase("fetch"):
+            rows = fetch_tuples(cur)
+        # 校验耗时远长于查询：先归还连接，不让它在校验期间被占用
+        release_db()
+
+        with phase("verify"):
+            password_hash = rows[0][3] if rows else None
+            verified = password_verifier.verify(password, password_hash or unknown_user_hash())
+        rows = [row[:3] for row in rows] if verified and password_hash else []
+
+        with phase("serialize"):
+            users = encode_rows(column_names(cur)[:3], rows)  # 注意：不返回口令和哈希字段
         
-        logging.info(f"安全端点访问 - 返回{len(rows)}条记录")
-        return jsonify(result)
+        logging.info("安全端点访问 - 返回%d条记录", len(rows))
+        with phase("jsonify"):
+            return _json_response(LOGIN_SAFE_RESPONSE.render(
+                success=len(rows) > 0,
+                user_count=len(rows),
+                users=users,
+                suspicious=is_suspicious_user or is_suspicious_pass,
+                patterns=user_patterns + pass_patterns,
+                timestamp=datetime.datetime.now().isoformat(),
+            ))
         
+    except VerifierUnavailable as e:
+        logging.warning("口令校验不可用: %s", e.reason)
+        return jsonify({
+            "endpoint": "safe",
+            "success": False,
+            "error": str(e),
+            "security_info": "口令校验有排队上限和超时，过载时快速失败"
+        }), 503, {"Retry-After": "1"}
     except sqlite3.Error as e:
-        logging.error(f"数据库查询错误: {str(e)}")
+        logging.error("数据库查询错误: %s", e)
         return jsonify({
             "endpoint": "safe",
             "success": False,
@@ -464,49 +1041,502 @@ def login_safe():
 # 辅助端点 - 统计和分析功能 (Auxiliary Endpoints)
 # ---------------------------------------------------------------------------
 
+def _stream_users(cur, ndjson):
+    """用 fetchmany 分批读取并逐批编码，内存占用与用户表大小无关"""
+    total = 0
+    columns = column_names(cur)
+    if not ndjson:
+        yield '{"users":['
+    while True:
+        rows = fetch_tuples(cur, USERS_FETCH_SIZE)
+        if not rows:
+            break
+        encoded = encode_row_objects(columns, rows)
+        if ndjson:
+            yield "\n".join(encoded) + "\n"
+        else:
+            yield ("," if total else "") + ",".join(encoded)
+        total += len(rows)
+    if not ndjson:
+        yield (
+            f'],"total_users":{total},'
+            f'"timestamp":{dumps(datetime.datetime.now().isoformat())}}}'
+        )
+
+
+USERS_PAGE_RESPONSE = JSONTemplate({
+    "users": Slot("users"),
+    "count": Slot("count"),
+    "after_id": Slot("after_id"),
+    "next_after_id": Slot("next_after_id"),
+    "timestamp": Slot("timestamp"),
+})
+
+
 @app.route("/users")
 def list_users():
-    """列出所有用户（管理功能）"""
+    """列出所有用户（管理功能）
+
+    - ``after_id`` / ``limit``: 基于主键的游标分页，返回 ``next_after_id``
+    - ``format=ndjson``: 每行一个用户的NDJSON
+    - 不带 ``limit`` 时以流式响应返回全部用户
+    """
     try:
-        cur = get_db().execute("SELECT id, username, role, created_at FROM users")
-        users = [dict(row) for row in cur.fetchall()]
-        
-        return jsonify({
-            "total_users": len(users),
-            "users": users,
-            "timestamp": datetime.datetime.now().isoformat()
-        })
+        after_id = int(request.args.get("after_id", 0))
+        limit = request.args.get("limit")
+        limit = min(max(1, int(limit)), USERS_MAX_PAGE_SIZE) if limit else None
+    except ValueError:
+        return jsonify({"error": "after_id 和 limit 必须是整数"}), 400
+    ndjson = request.args.get("format") == "ndjson"
+
+    # 数据未变化时直接返回304或缓存的响应，不访问数据库
+    etag = make_etag("users", users_data_version(), after_id, limit, ndjson)
+    not_modified = response_cache.not_modified(etag, request.headers.get("If-None-Match"))
+    if not_modified is not None:
+        return not_modified
+    if limit is not None:
+        cached = response_cache.get(etag)
+        if cached is not None:
+            return cached.response()
+
+    try:
+        sql = "SELECT id, username, role, created_at FROM users WHERE id > ? ORDER BY id"
+        if limit is None:
+            cur = get_db(readonly=True).execute(sql, (after_id,))
+            mimetype = "application/x-ndjson" if ndjson else "application/json"
+            # 全量结果不缓存响应体，只提供ETag
+            return Response(
+                stream_with_context(_stream_users(cur, ndjson)),
+                mimetype=mimetype, headers={"ETag": etag},
+            )
+
+        cur = get_db(readonly=True).execute(f"{sql} LIMIT ?", (after_id, limit))
+        rows = fetch_tuples(cur)
+        next_after_id = rows[-1][0] if len(rows) == limit else None
+        if ndjson:
+            entry = CachedResponse(
+                "".join(user + "\n" for user in encode_row_objects(column_names(cur), rows)),
+                etag, mimetype="application/x-ndjson",
+                headers={"X-Next-After-Id": str(next_after_id or "")},
+            )
+        else:
+            entry = CachedResponse(USERS_PAGE_RESPONSE.render(
+                users=encode_rows(column_names(cur), rows),
+                count=len(rows),
+                after_id=after_id,
+                next_after_id=next_after_id,
+                timestamp=datetime.datetime.now().isoformat(),
+            ), etag)
+        return response_cache.put(etag, entry).response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+STATS_QUERY_ARGS = (
+    "since", "until", "window", "bucket", "group_by", "endpoint", "pattern", "client_ip", "limit"
+)
+
+
+# 9999-12-31 00:00 UTC：任何时区下都能转换为本地时间
+MAX_TIMESTAMP = 253402214400
+
+
+def _parse_time_arg(name, default):
+    """解析时间参数：Unix时间戳或ISO 8601格式；非有限值或超出范围时抛出ValueError"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        timestamp = float(value)
+    except ValueError:
+        timestamp = datetime.datetime.fromisoformat(value).timestamp()
+    if not (math.isfinite(timestamp) and 0 <= timestamp <= MAX_TIMESTAMP):
+        raise ValueError(f"{name} 超出范围 [0, {MAX_TIMESTAMP}]: {value}")
+    return timestamp
+
+
+def _query_attack_events():
+    """根据 /stats 的查询参数过滤和聚合攻击事件"""
+    args = request.args
+    until = _parse_time_arg("until", time.time())
+    window = float(args.get("window", 86400))
+    if not (math.isfinite(window) and window >= 0):
+        raise ValueError(f"window 必须是非负有限秒数: {args['window']}")
+    # 窗口超出纪元起点时从头查询
+    since = _parse_time_arg("since", max(0.0, until - window))
+    bucket = max(1, int(args.get("bucket", 60)))
+    limit = min(max(1, int(args.get("limit", 50))), 1000)
+    group_by = args.get("group_by", "pattern")
+    filters = {
+        "endpoint": args.get("endpoint") or None,
+        "client_ip": args.get("client_ip") or None,
+        "pattern": args.get("pattern") or None,
+    }
+    series = attack_event_store.aggregate(since, until, bucket, group_by, **filters)
+    for point in series:
+        point["time"] = datetime.datetime.fromtimestamp(point["bucket"]).isoformat()
+    return {
+        "since": datetime.datetime.fromtimestamp(since).isoformat(),
+        "until": datetime.datetime.fromtimestamp(until).isoformat(),
+        "filters": {k: v for k, v in filters.items() if v},
+        "events": attack_event_store.events(since, until, limit=limit, **filters),
+        "aggregation": {
+            "bucket_seconds": bucket,
+            "group_by": group_by,
+            "series": series,
+        },
+    }
+
+
 @app.route("/stats")
 def attack_stats():
-    """显示攻击统计信息"""
+    """显示攻击统计信息
+
+    带过滤参数（since/until/window/endpoint/pattern/client_ip）或聚合参数
+    （bucket/group_by）时，额外返回从事件表索引中查询的结果。
+
+    由攻击日志得出的部分按攻击计数与已入库事件数缓存，各子系统的诊断字段每次请求重新采集；
+    ETag同时覆盖两者，任何一项变化都返回新的响应，否则返回304。时间窗口相对于当前时间
+    （带查询参数但未指定 ``until``）的请求不缓存。
+    """
+    has_query = any(name in request.args for name in STATS_QUERY_ARGS)
+    diagnostics = _stats_diagnostics()
+    if has_query and "until" not in request.args:
+        try:
+            report = _attack_report(has_query)
+        except ValueError as e:
+            return jsonify({"error": f"无效的查询参数: {e}"}), 400
+        report.update(diagnostics)
+        return jsonify(report)
+
+    report_key = make_etag(
+        "stats", attack_log_writer.version(), sorted(request.args.items(multi=True))
+    )
+    etag = make_etag(report_key, diagnostics)
+    not_modified = response_cache.not_modified(etag, request.headers.get("If-None-Match"))
+    if not_modified is not None:
+        return not_modified
+    cached = response_cache.get(report_key)
+    if cached is None:
+        try:
+            report = _attack_report(has_query)
+        except ValueError as e:
+            return jsonify({"error": f"无效的查询参数: {e}"}), 400
+        cached = response_cache.put(report_key, CachedResponse(dumps(report), report_key))
+    # 两部分都是非空JSON对象：去掉报告的 "}" 与诊断的 "{"，拼成一个对象
+    body = cached.body[:-1] + b"," + dumps(diagnostics).encode("utf-8")[1:]
+    return Response(body, mimetype="application/json", headers={"ETag": etag})
+
+
+def _attack_report(has_query):
+    """由攻击日志计数器（及事件表查询）得出的统计；查询参数无效时抛出ValueError"""
     stats = {
-        "database_file": DATABASE,
+        "database_file": storage.location,
         "attack_log_file": ATTACK_LOG,
         "log_exists": os.path.exists(ATTACK_LOG),
         "timestamp": datetime.datetime.now().isoformat()
     }
     
-    if os.path.exists(ATTACK_LOG):
-        with open(ATTACK_LOG, "r", encoding="utf-8") as f:
-            logs = f.readlines()
-        stats["total_attacks"] = len(logs)
-        stats["recent_attacks"] = [log.strip() for log in logs[-10:]]  # 最近10次
+    # 只扫描共享日志文件上次读取之后新追加的部分，多进程时也是全局计数
+    total_attacks, recent_attacks = attack_log_writer.snapshot()
+    stats["total_attacks"] = total_attacks
+    stats["recent_attacks"] = recent_attacks  # 最近10次
+
+    if has_query:
+        stats["attack_events"] = _query_attack_events()
+    return stats
+
+
+def _stats_diagnostics():
+    """各子系统的即时状态，每次请求重新采集，不进入响应缓存"""
+    stats = {}
+    stats["attack_log_writer"] = attack_log_writer.stats()
+    stats["rate_limit"] = rate_limit_stats()
+    stats["password_verifier"] = password_verifier.stats()
+    stats["logging"] = log_pipeline.stats()
+    if detection_memo is not None:
+        stats["detection_cache"] = detection_memo.stats()
+    if query_profiler is not None:
+        stats["query_profiler"] = query_profiler.stats()
+    if sandboxes is not None:
+        stats["sandbox"] = sandboxes.stats()
+    stats["query_guard"] = query_guard_stats()
+    stats["storage_mode"] = DB_STORAGE_MODE
+    stats["storage_backend"] = storage.name
+    stats["db_pool"] = {
+        "reader": reader_pool.stats(),
+        "writer": writer_pool.stats(),
+    }
+    return stats
+
+
+def _metrics_gauges():
+    """连接池、攻击日志写入器等的即时状态，附加在 /metrics 的直方图之后"""
+    pools = {"reader": reader_pool.stats(), "writer": writer_pool.stats()}
+    writer = attack_log_writer.stats()
+    total_attacks, _ = attack_log_writer.snapshot()
+    cache = response_cache.stats()
+    verifier = password_verifier.stats()
+    app_log = log_pipeline.stats()
+    gauges = [
+        ("sqli_demo_db_pool_connections", "Pooled SQLite connections by state.", "gauge", [
+            ({"pool": name, "state": state}, stats[f"{state}_connections"])
+            for name, stats in pools.items() for state in ("open", "idle", "in_use")
+        ]),
+        ("sqli_demo_db_pool_checkouts_total", "Connection checkouts by result.", "counter", [
+            ({"pool": name, "result": result}, stats[key])
+            for name, stats in pools.items()
+            for result, key in (("hit", "hits"), ("miss", "misses"), ("wait", "waits"),
+                                ("timeout", "timeouts"))
+        ]),
+        ("sqli_demo_db_pool_wait_seconds_total", "Time spent waiting for a connection.",
+         "counter", [({"pool": name}, stats["wait_time_ms"] / 1000) for name, stats in pools.items()]),
+        ("sqli_demo_attack_log_queued", "Attack log lines waiting to be written.", "gauge",
+         [({}, writer["queued"])]),
+        ("sqli_demo_attack_log_lines_total", "Attack log lines by outcome.", "counter", [
+            ({"result": key}, writer[key]) for key in ("enqueued", "dropped", "written")
+        ]),
+        ("sqli_demo_attacks_total", "Detected SQL injection attempts.", "counter",
+         [({}, total_attacks)]),
+        ("sqli_demo_rate_limit_requests_total", "Rate limited endpoint requests by outcome.",
+         "counter", [
+             ({"endpoint": endpoint, "result": result}, stats[result])
+             for endpoint, stats in rate_limit_stats().items()
+             for result in ("allowed", "throttled")
+         ]),
+        ("sqli_demo_query_aborts_total", "Injected queries aborted by the query guard.",
+         "counter", [
+             ({"endpoint": endpoint, "reason": reason}, count)
+             for endpoint, stats in query_guard_stats().items()
+             for reason, count in stats["aborts"].items()
+         ]),
+        ("sqli_demo_response_cache_lookups_total", "Response cache lookups by result.", "counter", [
+            ({"result": key}, cache[key]) for key in ("hits", "misses", "not_modified")
+        ]),
+        ("sqli_demo_response_cache_bytes", "Bytes held by the response cache.", "gauge",
+         [({}, cache["bytes"])]),
+        ("sqli_demo_password_verifications_total", "Password checks by outcome.", "counter", [
+            ({"result": key}, verifier[key]) for key in ("verified", "rejected", "timeouts")
+        ]),
+        ("sqli_demo_password_verifier_pool_events_total", "Verifier pool breakages and inline "
+         "fallbacks.", "counter", [
+             ({"event": key}, verifier[key]) for key in ("pool_restarts", "inline_fallbacks")
+         ]),
+        ("sqli_demo_app_log_records_total", "Application log records by outcome.", "counter", [
+            ({"result": key}, app_log[key]) for key in ("enqueued", "sampled_out", "dropped")
+        ]),
+    ]
+    if detection_memo is not None:
+        memo = detection_memo.stats()
+        gauges.append((
+            "sqli_demo_detection_cache_lookups_total", "Detection verdict cache lookups by result.",
+            "counter", [({"result": key}, memo[key]) for key in ("hits", "misses", "bypassed")],
+        ))
+    if query_profiler is not None:
+        profiled = query_profiler.stats()
+        gauges.append((
+            "sqli_demo_sql_statements_total", "Profiled SQL statements by speed.", "counter", [
+                ({"speed": "slow"}, profiled["slow"]),
+                ({"speed": "fast"}, profiled["statements"] - profiled["slow"]),
+            ],
+        ))
+    if sandboxes is not None:
+        sandbox = sandboxes.stats()
+        gauges += [
+            ("sqli_demo_sandboxes", "Per-session sandbox databases.", "gauge",
+             [({}, sandbox["sandboxes"])]),
+            ("sqli_demo_sandbox_bytes", "Memory held by sandbox databases.", "gauge",
+             [({}, sandbox["bytes"])]),
+            ("sqli_demo_sandbox_events_total", "Sandbox lifecycle events.", "counter", [
+                ({"event": key}, sandbox[key])
+                for key in ("clones", "evicted", "expired", "rejected")
+            ]),
+        ]
+    return gauges
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus文本格式的请求分阶段耗时直方图与连接池指标（每个工作进程独立统计）"""
+    if request_metrics is None:
+        return jsonify({"error": "指标统计未启用（METRICS_ENABLED=0）"}), 404
+    return Response(
+        request_metrics.render(_metrics_gauges()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.route("/debug/slow_queries")
+def slow_queries():
+    """慢查询表：按规范化SQL归并的耗时统计与查询计划（每个工作进程独立统计）
+
+    - ``sort``: max_ms（默认）/ total_ms / count / last_seen
+    - ``limit``: 返回的条数
+    - ``full_scan=1``: 只返回计划中包含全表扫描的语句
+    """
+    if query_profiler is None:
+        return jsonify({"error": "慢查询日志未启用（QUERY_PROFILER_ENABLED=0）"}), 404
+    sort = request.args.get("sort", "max_ms")
+    if sort not in SORT_KEYS:
+        return jsonify({"error": f"sort 可选值: {', '.join(SORT_KEYS)}"}), 400
+    try:
+        limit = max(1, int(request.args.get("limit", 50)))
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
+    queries = query_profiler.slow_queries(sort)
+    if request.args.get("full_scan") == "1":
+        queries = [entry for entry in queries if entry["full_scan"]]
+    return jsonify({
+        "profiler": query_profiler.stats(),
+        "sort": sort,
+        "queries": queries[:limit],
+        "timestamp": datetime.datetime.now().isoformat(),
+    })
+
+
+class DetectBodyTooLarge(ValueError):
+    """/detect 的请求体超过 ``DETECT_MAX_BYTES`` 字节或 ``DETECT_MAX_ITEMS`` 项"""
+
+
+class _DetectBody:
+    """读取 /detect 的请求体，累计超过 ``DETECT_MAX_BYTES`` 时抛出 DetectBodyTooLarge"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.remaining = DETECT_MAX_BYTES
+
+    def _take(self, data):
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise DetectBodyTooLarge(f"请求体超过 {DETECT_MAX_BYTES} 字节")
+        return data
+
+    def readline(self):
+        return self._take(self.stream.readline(self.remaining + 1))
+
+    def read(self):
+        return self._take(self.stream.read(self.remaining + 1))
+
+
+def _open_detect_items():
+    """返回 /detect 请求体的逐项迭代器：NDJSON按行流式读取，JSON数组整体解析
+
+    JSON请求体在开始流式响应之前解析并校验，不是数组时抛出ValueError；
+    ``Content-Length`` 或JSON数组超过上限时抛出DetectBodyTooLarge。
+    """
+    if (request.content_length or 0) > DETECT_MAX_BYTES:
+        raise DetectBodyTooLarge(f"请求体超过 {DETECT_MAX_BYTES} 字节")
+    body = _DetectBody(request.stream)
+    if request.mimetype == "application/json":
+        return _json_array_items(body.read() or b"[]")
+
+    first = body.readline()
+    while first and not first.strip():
+        first = body.readline()
+    if first.lstrip().startswith(b"["):
+        return _json_array_items(first + body.read())
+    return _iter_ndjson_items(first, body)
+
+
+def _json_array_items(body):
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("JSON请求体必须是数组")
+    if len(items) > DETECT_MAX_ITEMS:
+        raise DetectBodyTooLarge(f"输入项超过 {DETECT_MAX_ITEMS} 项")
+    return iter(items)
+
+
+def _iter_ndjson_items(line, body):
+    """逐行解析NDJSON，无效的行作为错误项输出而不中断整个响应
+
+    响应已经开始，超过字节数或条数上限时输出一个错误项后停止，其余输入不再读取。
+    """
+    count = 0
+    while line:
+        if line.strip():
+            if count >= DETECT_MAX_ITEMS:
+                yield DetectBodyTooLarge(f"输入项超过 {DETECT_MAX_ITEMS} 项，其余输入未检测")
+                return
+            count += 1
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"无效的JSON行: {e}")
+        try:
+            line = body.readline()
+        except DetectBodyTooLarge as e:
+            yield DetectBodyTooLarge(f"{e}，其余输入未检测")
+            return
+
+
+def _detect_verdict(index, item):
+    """对单个输入项运行检测，返回一行NDJSON结果"""
+    item_id = None
+    if isinstance(item, dict):
+        item_id = item.get("id")
+        item = item.get("input")
+    if isinstance(item, Exception) or not isinstance(item, str):
+        error = str(item) if isinstance(item, Exception) else "输入项必须是字符串或包含input字段的对象"
+        verdict = {"index": index, "id": item_id, "error": error}
     else:
-        stats["total_attacks"] = 0
-        stats["recent_attacks"] = []
-    
-    return jsonify(stats)
+        matches = scan_sql_injection(item)
+        verdict = {
+            "index": index,
+            "id": item_id,
+            "suspicious": bool(matches),
+            "patterns": list(dict.fromkeys(pattern for pattern, _ in matches)),
+            "matches": matches,
+        }
+    return dumps(verdict)
+
+
+@app.route("/detect", methods=["POST"])
+def bulk_detect():
+    """批量检测输入是否包含SQL注入特征（不访问数据库）
+
+    请求体为NDJSON（每行一个字符串或 ``{"id": ..., "input": ...}``）或JSON数组，
+    响应为逐项输出的NDJSON。JSON请求体无效或不是数组时返回400；NDJSON中无效的行在结果中标记为错误。
+    请求体超过 ``DETECT_MAX_BYTES`` / ``DETECT_MAX_ITEMS`` 时返回413，NDJSON流中途超限时以一个错误项结束。
+    """
+    try:
+        items = _open_detect_items()
+    except DetectBodyTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": f"请求体解析失败: {e}"}), 400
+
+    def generate():
+        buffer = []
+        for index, item in enumerate(items):
+            buffer.append(_detect_verdict(index, item))
+            if len(buffer) >= DETECT_CHUNK_ITEMS:
+                yield "\n".join(buffer) + "\n"
+                buffer.clear()
+        if buffer:
+            yield "\n".join(buffer) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 
 # ---------------------------------------------------------------------------
 # 高级演示功能 (Advanced Demo Features)
 # ---------------------------------------------------------------------------
 
-@app.route("/advanced_vuln")
+ADVANCED_VULN_RESPONSE = JSONTemplate({
+    "search_term": Slot("search_term"),
+    "results": Slot("results"),
+    "executed_sql": Slot("executed_sql"),
+    "warning": "此端点演示了更复杂的SQL注入场景",
+    "example_payloads": [
+        "admin' UNION SELECT username,password,'SECRET' FROM users--",
+        "' OR 1=1--",
+        "test' AND (SELECT COUNT(*) FROM users)>0--"
+    ]
+})
+
+
+@app.route("/advanced_vuln", endpoint="advanced_vuln")
 def advanced_vulnerability():
     """更复杂的SQL注入场景演示"""
     search_term = request.args.get("search", "")
@@ -524,20 +1554,18 @@ def advanced_vulnerability():
     """
     
     try:
-        cur = get_db().execute(query)
-        results = [dict(row) for row in cur.fetchall()]
+        db = get_db()
+        with guard_query("advanced_vuln", db) as watch:
+            cur = db.execute(query)
+            results = encode_rows(column_names(cur), watch.fetch(cur))
         
-        return jsonify({
-            "search_term": search_term,
-            "results": results,
-            "executed_sql": query,
-            "warning": "此端点演示了更复杂的SQL注入场景",
-            "example_payloads": [
-                "admin' UNION SELECT username,password,'SECRET' FROM users--",
-                "' OR 1=1--",
-                "test' AND (SELECT COUNT(*) FROM users)>0--"
-            ]
-        })
+        return _json_response(ADVANCED_VULN_RESPONSE.render(
+            search_term=search_term,
+            results=results,
+            executed_sql=query,
+        ))
+    except QueryBudgetExceeded as e:
+        return query_aborted_response("advanced_vuln", e, query)
     except Exception as e:
         return jsonify({
             "error": str(e),
@@ -546,11 +1574,134 @@ def advanced_vulnerability():
         }), 400
 
 
+ADVANCED_SAFE_RESPONSE = JSONTemplate({
+    "endpoint": "advanced_safe",
+    "search_term": Slot("search_term"),
+    "search_mode": Slot("search_mode"),
+    "sort": Slot("sort"),
+    "result_count": Slot("result_count"),
+    "results": Slot("results"),
+    "offset": Slot("offset"),
+    "limit": Slot("limit"),
+    "next_offset": Slot("next_offset"),
+    "security_analysis": {
+        "vulnerability_detected": False,
+        "risk_level": "LOW",
+        "protection_mechanisms": [
+            "参数化查询",
+            "全文检索语法转义",
+            "输入长度限制",
+            "敏感信息过滤",
+        ],
+        "suspicious_input_detected": Slot("suspicious"),
+        "attack_patterns_neutralized": Slot("patterns"),
+    },
+    "timestamp": Slot("timestamp"),
+})
+
+
+@app.route("/advanced_safe")
+def advanced_safe():
+    """✅ /advanced_vuln 的安全版本：参数化的全文检索，按相关度排序并分页
+
+    检索词不少于3个字符时走FTS5 trigram索引，更短时回退到带LIMIT的参数化LIKE查询。
+    ``sort=id`` 跳过相关度计算，匹配很多的检索词也只需读取一页索引。
+    不返回敏感数据表中的内容。
+    """
+    search_term = request.args.get("search", "")
+    if not search_term:
+        return jsonify({"error": "请提供search参数"}), 400
+    if len(search_term) > SEARCH_MAX_TERM_LENGTH:
+        return jsonify({
+            "endpoint": "advanced_safe",
+            "success": False,
+            "error": "输入长度超出限制",
+            "security_info": "实施输入长度限制是基础安全措施"
+        }), 400
+    try:
+        limit = min(int(request.args.get("limit", 20)), SEARCH_MAX_PAGE_SIZE)
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit 和 offset 必须是整数"}), 400
+    if limit < 1 or offset < 0 or offset > SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"limit 必须为正数，offset 范围为 0-{SEARCH_MAX_OFFSET}"}), 400
+    sort = request.args.get("sort", "rank")
+    if sort not in SORT_ORDERS:
+        return jsonify({"error": f"sort 可选值: {', '.join(SORT_ORDERS)}"}), 400
+
+    with phase("detect"):
+        is_suspicious, patterns = detect_sql_injection(search_term)
+
+    try:
+        db = get_db(readonly=True)
+        with phase("execute"):
+            mode, cur = search_users(
+                db, search_term, limit + 1, offset, sort, indexed=search_index_ready(db)
+            )
+        with phase("fetch"):
+            rows = fetch_tuples(cur)
+        has_more = len(rows) > limit
+        del rows[limit:]
+        with phase("serialize"):
+            results = encode_rows(column_names(cur), rows)
+        with phase("jsonify"):
+            return _json_response(ADVANCED_SAFE_RESPONSE.render(
+                search_term=search_term,
+                search_mode=mode,
+                sort=sort if mode == "fts5" else "id",
+                result_count=len(rows),
+                results=results,
+                offset=offset,
+                limit=limit,
+                next_offset=offset + limit if has_more else None,
+                suspicious=is_suspicious,
+                patterns=patterns,
+                timestamp=datetime.datetime.now().isoformat(),
+            ))
+    except sqlite3.Error as e:
+        logging.error("检索查询错误: %s", e)
+        return jsonify({
+            "endpoint": "advanced_safe",
+            "success": False,
+            "error": "检索失败",
+            "security_info": "错误信息已被过滤，不暴露数据库细节"
+        }), 500
+
+
+# ---------------------------------------------------------------------------
+# 配置检查 (Configuration Checks)
+# ---------------------------------------------------------------------------
+
+def check_endpoint_settings():
+    """RATE_LIMITS / QUERY_BUDGETS 按端点名匹配，拼错的端点名会被静默忽略，因此在启动时给出警告"""
+    for setting, endpoints in (("RATE_LIMITS", RATE_LIMITS), ("QUERY_BUDGETS", QUERY_BUDGETS)):
+        unknown = sorted(set(endpoints) - set(app.view_functions))
+        if unknown:
+            logging.warning("%s 中的端点未注册，该配置不会生效: %s", setting, ", ".join(unknown))
+
+
+check_endpoint_settings()
+
+
 # ---------------------------------------------------------------------------
 # 程序入口 (Entry Point)
 # ---------------------------------------------------------------------------
 
 if __name__ == "__main__":
+    import argparse
+    from server import add_server_arguments, serve_from_args
+
+    parser = argparse.ArgumentParser(description="SQL注入攻击与防御演示系统")
+    add_server_arguments(parser)
+    parser.add_argument("--seed-users", type=int, default=0, help="额外生成的合成用户数")
+    parser.add_argument("--seed-secret-count", "--seed-secrets", type=int, default=0,
+                        help="额外生成的合成敏感数据条数")
+    parser.add_argument("--seed", type=int, default=None, help="合成数据随机种子")
+    parser.add_argument("--reinit", action="store_true", help="重建已存在的数据库")
+    parser.add_argument("--init-only", action="store_true", help="只初始化数据库，不启动服务")
+    parser.add_argument("--reset", action="store_true", help="从黄金快照恢复数据库后退出")
+    cli_args = parser.parse_args()
+
     print("=" * 80)
     print("🔐 SQL注入攻击与防御演示系统")
     print("SQL Injection Attack & Defense Demo System")
@@ -559,16 +1710,27 @@ if __name__ == "__main__":
     print("⚠️  请勿用于恶意攻击 | Do Not Use for Malicious Attacks")
     print("=" * 80)
     
+    if cli_args.reset:
+        print(f"♻️  {reset_db()}")
+        raise SystemExit(0)
+
     # 自动初始化数据库
-    init_db()
+    init_db(
+        users=cli_args.seed_users,
+        secret_count=cli_args.seed_secret_count,
+        seed=cli_args.seed,
+        force=cli_args.reinit,
+    )
+    if cli_args.init_only:
+        raise SystemExit(0)
     
     print("🚀 服务启动信息:")
-    print(f"   - 本地访问: http://127.0.0.1:5000/")
-    print(f"   - 脆弱端点: http://127.0.0.1:5000/login_vuln")
-    print(f"   - 安全端点: http://127.0.0.1:5000/login_safe")
-    print(f"   - 数据库文件: {DATABASE}")
+    print(f"   - 本地访问: http://127.0.0.1:{cli_args.port}/")
+    print(f"   - 脆弱端点: http://127.0.0.1:{cli_args.port}/login_vuln")
+    print(f"   - 安全端点: http://127.0.0.1:{cli_args.port}/login_safe")
+    print(f"   - 数据库: {storage.location} ({storage.name})")
     print(f"   - 攻击日志: {ATTACK_LOG}")
     print("=" * 80)
     
-    # 启动Flask应用
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # 启动服务：默认使用多进程生产服务器，--server dev 为Flask调试服务器
+    serve_from_args(app, cli_args)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求分阶段耗时统计
+Per-Request Phase Timing Metrics
+
+按端点、状态码和阶段（检测、取连接、执行、取数、序列化……）把耗时记录到
+固定分桶的直方图中，并以Prometheus文本格式导出。每个请求的各阶段耗时先
+记在请求本地的列表里，请求结束时一次加锁写入直方图。
+Records durations per endpoint, status and phase (detection, connection
+checkout, execute, fetch, serialization, ...) into fixed-bucket histograms
+and renders them in the Prometheus text exposition format. Phase timings are
+collected in a request-local list and folded into the histograms under a
+single lock acquisition when the request ends.
+"""
+
+import bisect
+import threading
+import time
+
+# 默认分桶（秒）：各阶段通常在亚毫秒级，低端分得更细
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class PhaseTimer:
+    """``with`` 块计时，退出时把 ``(phase, seconds)`` 追加到请求本地列表"""
+
+    __slots__ = ("phases", "name", "started")
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.phases.append((self.name, time.perf_counter() - self.started))
+        return False
+
+
+class Histogram:
+    """固定分桶直方图：每组标签一行计数（非累积存储，导出时再累加）"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, seconds):
+        """调用方需持有 ``RequestMetrics`` 的锁"""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        bounds = [_format_float(b) for b in self.buckets] + ["+Inf"]
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(
+                f'{key}="{_escape(value)}"' for key, value in zip(self.label_names, labels)
+            )
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {_format_float(series[-1])}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+
+
+class RequestMetrics:
+    """请求总耗时与分阶段耗时直方图"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="sqli_demo"):
+        self._lock = threading.Lock()
+        self.requests = Histogram(
+            f"{prefix}_request_duration_seconds",
+            "Request handling time by endpoint and status.",
+            ("endpoint", "status"), buckets,
+        )
+        self.phases = Histogram(
+            f"{prefix}_request_phase_duration_seconds",
+            "Time spent in each request phase by endpoint and status.",
+            ("endpoint", "status", "phase"), buckets,
+        )
+
+    def record(self, endpoint, status, total, phases):
+        """记录一个请求：总耗时 + 各阶段 ``(phase, seconds)``（同名阶段会累加）"""
+        status = str(status)
+        merged = {}
+        for name, seconds in phases:
+            merged[name] = merged.get(name, 0.0) + seconds
+        with self._lock:
+            self.requests.observe((endpoint, status), total)
+            for name, seconds in merged.items():
+                self.phases.observe((endpoint, status, name), seconds)
+
+    def render(self, gauges=()):
+        """导出Prometheus文本格式；``gauges`` 为 ``(name, help, type, [(labels_dict, value)])``"""
+        lines = []
+        with self._lock:
+            self.requests.render(lines)
+            self.phases.render(lines)
+        for name, help_text, metric_type, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {_format_float(value)}")
+                else:
+                    lines.append(f"{name} {_format_float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_float(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+口令哈希与校验服务
+Password Hashing and Verification Service
+
+口令以加盐的PBKDF2-SHA256或scrypt哈希保存，代价参数写在哈希串中，可随时调高而不影响已有哈希。
+校验是纯CPU计算，由 ``PasswordVerifier`` 交给进程池执行：请求线程只提交任务并等待结果，
+吞吐量随CPU核数增长；排队的任务数有上限，等待超时的请求直接失败而不是无限堆积。
+Passwords are stored as salted PBKDF2-SHA256 or scrypt hashes with the cost
+parameters encoded in the hash string, so the cost can be raised at any time
+without invalidating existing hashes. Verification is pure CPU work and
+``PasswordVerifier`` runs it in a process pool: the request thread only
+submits and waits, throughput scales with cores, the number of queued checks
+is bounded, and requests that wait too long fail instead of piling up.
+
+哈希格式 | Hash formats:
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+"""
+
+import base64
+import functools
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from db_pool import _fork_hook
+
+# 新哈希使用的算法与代价：pbkdf2_sha256 的代价为迭代次数，scrypt 的代价为 n（r=8, p=1）
+PASSWORD_HASH_ALGORITHM = os.environ.get("PASSWORD_HASH_ALGORITHM", "pbkdf2_sha256")
+PASSWORD_HASH_COST = int(os.environ.get("PASSWORD_HASH_COST", "0"))
+
+DEFAULT_COSTS = {"pbkdf2_sha256": 200_000, "scrypt": 2 ** 14}
+SALT_BYTES = 16
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(secret, salt, n, r, p):
+    # 所需内存约为 128*n*r*p 字节，OpenSSL默认上限32MB，这里按参数放宽
+    return hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p + 1024 ** 2)
+
+
+def hash_password(password, algorithm=None, cost=None, salt=None):
+    """返回口令的哈希串；未指定时使用 ``PASSWORD_HASH_ALGORITHM`` / ``PASSWORD_HASH_COST``"""
+    algorithm = algorithm or PASSWORD_HASH_ALGORITHM
+    if algorithm not in DEFAULT_COSTS:
+        raise ValueError(f"未知的口令哈希算法: {algorithm} (可选: {', '.join(DEFAULT_COSTS)})")
+    cost = cost or PASSWORD_HASH_COST or DEFAULT_COSTS[algorithm]
+    salt = salt or secrets.token_bytes(SALT_BYTES)
+    secret = password.encode("utf-8")
+    if algorithm == "scrypt":
+        digest = _scrypt(secret, salt, cost, 8, 1)
+        return f"scrypt${cost}$8$1${_b64(salt)}${_b64(digest)}"
+    digest = hashlib.pbkdf2_hmac("sha256", secret, salt, cost)
+    return f"pbkdf2_sha256${cost}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, encoded):
+    """以常数时间比较校验口令；哈希串格式不对时返回False"""
+    try:
+        algorithm, *params = encoded.split("$")
+        secret = password.encode("utf-8")
+        if algorithm == "pbkdf2_sha256":
+            iterations, salt, expected = params
+            digest = hashlib.pbkdf2_hmac("sha256", secret, _unb64(salt), int(iterations))
+        elif algorithm == "scrypt":
+            n, r, p, salt, expected = params
+            digest = _scrypt(secret, _unb64(salt), int(n), int(r), int(p))
+        else:
+            return False
+    except (ValueError, AttributeError):
+        return False
+    return hmac.compare_digest(digest, _unb64(expected))
+
+
+@functools.lru_cache(maxsize=None)
+def unknown_user_hash():
+    """用户不存在（或没有口令哈希）时用于校验的哈希，使响应时间与用户存在时相同"""
+    return hash_password(secrets.token_urlsafe(16))
+
+
+class VerifierUnavailable(RuntimeError):
+    """校验队列已满或等待超时；``reason`` 为 queue_full / timeout"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class PasswordVerifier:
+    """在进程池中校验口令
+
+    - ``workers``: 进程数，0表示在调用线程中直接校验
+    - ``max_pending``: 提交到进程池、尚未完成的校验数上限
+    - ``timeout``: 一次校验（含排队）最多等待的秒数
+    - ``max_restarts``: 进程池连续损坏（子进程意外退出）这么多次后不再重建，改为在调用线程中校验
+
+    进程池损坏时受影响的校验改在调用线程中完成，下一次校验重建进程池。
+    """
+
+    def __init__(self, workers=0, max_pending=None, timeout=5.0, start_method="spawn",
+                 max_restarts=3):
+        self.workers = workers
+        self.max_pending = max_pending or max(1, workers) * 4
+        self.timeout = timeout
+        self.start_method = start_method
+        self.max_restarts = max_restarts
+        self._executor = None
+        self._broken = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats = {
+            "verified": 0, "rejected": 0, "timeouts": 0, "wait_time_ms": 0.0,
+            "pool_restarts": 0, "inline_fallbacks": 0,
+        }
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+
+    def _reset_after_fork(self):
+        """进程池属于父进程：子进程丢弃引用（不关闭），首次使用时重新创建"""
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                    )
+        return self._executor
+
+    def _pool_broken(self, executor):
+        """丢弃已损坏的进程池，下次使用时重建；连续损坏过多时停用进程池"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._broken += 1
+                self._stats["pool_restarts"] += 1
+                if self._broken >= self.max_restarts:
+                    logging.error("口令校验进程池连续%d次损坏，改为在请求线程中校验", self._broken)
+                else:
+                    logging.warning("口令校验进程池损坏（子进程意外退出），将重建")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _verify_inline(self, password, encoded, fallback=False):
+        result = verify_password(password, encoded)
+        with self._lock:
+            self._stats["verified"] += 1
+            self._stats["inline_fallbacks"] += fallback
+        return result
+
+    def start(self):
+        """预先启动全部工作进程，避免第一批请求承担进程启动开销"""
+        if self.workers:
+            executor = self._get_executor()
+            for future in [executor.submit(verify_password, "", "") for _ in range(self.workers)]:
+                future.result()
+
+    def verify(self, password, encoded):
+        """校验口令；排队或计算超时时抛出 ``VerifierUnavailable``"""
+        if not self.workers:
+            return self._verify_inline(password, encoded)
+        if self._broken >= self.max_restarts:
+            return self._verify_inline(password, encoded, fallback=True)
+
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise VerifierUnavailable("queue_full", "口令校验队列已满，请稍后再试")
+        executor = self._get_executor()
+        try:
+            future = executor.submit(verify_password, password, encoded)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._pool_broken(executor)
+            return self._verify_inline(password, encoded, fallback=True)
+        except Exception:
+            self._slots.release()
+            raise
+        # 名额在计算真正结束时才归还，超时放弃等待的任务仍占用名额
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise VerifierUnavailable("timeout", "口令校验超时") from None
+        except BrokenProcessPool:
+            self._pool_broken(executor)
+            return self._verify_inline(password, encoded, fallback=True)
+        with self._lock:
+            self._broken = 0
+            self._stats["verified"] += 1
+            self._stats["wait_time_ms"] += (time.perf_counter() - started) * 1000
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "timeout": self.timeout,
+            "pool_disabled": bool(self.workers) and self._broken >= self.max_restarts,
+            "wait_time_ms": round(stats["wait_time_ms"], 3),
+        })
+        return stats
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预渲染、预压缩的静态响应
+Pre-Rendered, Pre-Compressed Static Responses
+
+内容不变的页面只渲染一次，保存为原始、gzip、brotli（安装时）三种字节形式，
+每种形式带自己的强ETag；请求时只做内容协商和 ``If-None-Match`` 比较。
+Pages whose content never changes are rendered once and kept as identity,
+gzip and (when installed) brotli bytes, each with its own strong ETag. A
+request only costs content negotiation and an ``If-None-Match`` check.
+"""
+
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import Response, request
+
+from response_cache import etag_matches
+
+# 压缩后没有变小的变体不会被保存
+_COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    _COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=11)
+
+# 客户端同时接受多种编码时的优先顺序
+_PREFERENCE = ("br", "gzip", "identity")
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回q值大于0的编码集合"""
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+class PrecompressedPage:
+    """首次请求时渲染 ``render()`` 的结果并缓存所有编码变体"""
+
+    def __init__(self, render, mimetype="text/html; charset=utf-8",
+                 cache_control="no-cache"):
+        self._render = render
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self._variants = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        body = self._render()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        variants = {"identity": body}
+        for name, compress in _COMPRESSORS.items():
+            compressed = compress(body)
+            if len(compressed) < len(body):
+                variants[name] = compressed
+        return {
+            name: (data, f'"{hashlib.sha256(data).hexdigest()[:32]}"')
+            for name, data in variants.items()
+        }
+
+    def variants(self):
+        """``{encoding: (bytes, etag)}``，首次调用时构建"""
+        if self._variants is None:
+            with self._lock:
+                if self._variants is None:
+                    self._variants = self._build()
+        return self._variants
+
+    def invalidate(self):
+        self._variants = None
+
+    def response(self):
+        """按当前请求协商编码，ETag匹配时返回304"""
+        variants = self.variants()
+        accepted = _accepted_encodings(request.headers.get("Accept-Encoding", ""))
+        encoding = "identity"
+        for name in _PREFERENCE:
+            if name in variants and (name in accepted or "*" in accepted or name == "identity"):
+                encoding = name
+                break
+        body, etag = variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": self.cache_control,
+        }
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, mimetype=self.mimetype, headers=headers)
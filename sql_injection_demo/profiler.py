@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+慢查询日志与查询计划采集
+Slow-Query Log and Query-Plan Capture
+
+``QueryProfiler.connection_factory()`` 返回一个 ``sqlite3.Connection`` 子类，作为连接池和沙箱的
+``factory`` 使用后，每条语句的 ``execute`` 与 ``fetchall``/``fetchmany``/``fetchone`` 都被计时。
+语句在结果取完、游标关闭或重新执行时结算；总耗时超过阈值的语句按规范化SQL（字面量替换为 ``?``、
+空白合并）归并到有界的慢查询表中（按最近出现顺序淘汰），每种语句第一次变慢时采集
+``EXPLAIN QUERY PLAN``，计划中的全表扫描会被标记出来。
+``QueryProfiler.connection_factory()`` returns a ``sqlite3.Connection``
+subclass; used as the ``factory`` of the connection pools and sandboxes, it
+times the ``execute`` and ``fetchall``/``fetchmany``/``fetchone`` calls of
+every statement. A statement is settled when its results are exhausted or
+its cursor is closed or re-executed. Statements whose total time exceeds the
+threshold are folded by normalized SQL (literals replaced with ``?``,
+whitespace collapsed) into a bounded slow-query table evicted in
+least-recently-seen order; ``EXPLAIN QUERY PLAN`` is captured the first time
+each statement is slow, and full table scans in the plan are flagged.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# 慢查询表中保存的原始SQL示例的最大长度
+MAX_EXAMPLE_LENGTH = 2000
+
+SORT_KEYS = ("max_ms", "total_ms", "count", "last_seen")
+
+
+def normalize_sql(sql):
+    """把字符串和数字字面量替换为 ``?`` 并合并空白，同一语句的不同参数归为一类"""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def is_full_scan(detail):
+    """``SCAN t`` 是全表扫描；虚拟表（FTS5）和常量行不算"""
+    return detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail \
+        and detail != "SCAN CONSTANT ROW"
+
+
+def explain_query_plan(conn, sql, parameters=()):
+    """返回按层级缩进的查询计划行"""
+    rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    return plan
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """记录当前语句的执行与取数耗时，语句结束时交给连接的 ``profiler``"""
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        if self._sql is not None:
+            self._settle()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error:
+            self._begin(sql, parameters, time.perf_counter() - started)
+            self._settle(error=True)
+            raise
+        self._begin(sql, parameters, time.perf_counter() - started)
+        return self
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            rows = super().fetchall()
+        except sqlite3.Error:
+            self._fetched(started, 0, done=True, error=True)
+            raise
+        self._fetched(started, len(rows), done=True)
+        return rows
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        try:
+            rows = super().fetchmany(size)
+        except sqlite3.Error:
+            self._fetched(started, 0, done=True, error=True)
+            raise
+        self._fetched(started, len(rows), done=len(rows) < size)
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            row = super().fetchone()
+        except sqlite3.Error:
+            self._fetched(started, 0, done=True, error=True)
+            raise
+        self._fetched(started, row is not None, done=row is None)
+        return row
+
+    def close(self):
+        if self._sql is not None:
+            self._settle()
+        super().close()
+
+    def __del__(self):
+        # 未取完就被回收的语句：此时连接可能已归还连接池，不再执行EXPLAIN
+        if self._sql is not None:
+            self._settle(explain=False)
+
+    def _begin(self, sql, parameters, elapsed):
+        self._sql = sql
+        self._parameters = parameters
+        self._execute_time = elapsed
+        self._fetch_time = 0.0
+        self._rows = 0
+
+    def _fetched(self, started, rows, done, error=False):
+        if self._sql is None:
+            return
+        self._fetch_time += time.perf_counter() - started
+        self._rows += rows
+        if done:
+            self._settle(error=error)
+
+    def _settle(self, error=False, explain=True):
+        sql, self._sql = self._sql, None
+        profiler = getattr(self.connection, "profiler", None)
+        if profiler is not None:
+            profiler.observe(
+                self.connection if explain else None, sql, self._parameters,
+                self._execute_time, self._fetch_time, self._rows, error,
+            )
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """游标默认使用 ``ProfiledCursor``；``profiler`` 由 ``QueryProfiler.connection_factory`` 设置"""
+
+    profiler = None
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+class QueryProfiler:
+    """语句计时与有界慢查询表（线程安全）
+
+    - ``threshold_ms``: 执行加取数的总耗时达到该毫秒数的语句计入慢查询表
+    - ``max_entries``: 慢查询表最多保存的规范化语句数
+    - ``explain``: 是否为慢查询采集 ``EXPLAIN QUERY PLAN``
+    """
+
+    def __init__(self, threshold_ms=10.0, max_entries=200, explain=True):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self.explain = explain
+        self._threshold = threshold_ms / 1000
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "statements": 0, "time_ms": 0.0, "slow": 0, "errors": 0,
+            "evicted": 0, "plan_errors": 0,
+        }
+
+    def connection_factory(self):
+        """返回绑定到本profiler的连接类，用作 ``sqlite3.connect(factory=...)``"""
+        return type("ProfiledConnection", (ProfiledConnection,), {"profiler": self})
+
+    def observe(self, conn, sql, parameters, execute_time, fetch_time, rows, error=False):
+        """记录一条已结束的语句；``conn`` 为None时不采集查询计划"""
+        elapsed = execute_time + fetch_time
+        slow = elapsed >= self._threshold
+        with self._lock:
+            stats = self._stats
+            stats["statements"] += 1
+            stats["time_ms"] += elapsed * 1000
+            stats["errors"] += error
+            if not slow:
+                return
+            stats["slow"] += 1
+            entry = self._record(sql, elapsed, execute_time, fetch_time, rows, error)
+            needs_plan = self.explain and conn is not None and entry["plan"] is None
+
+        if needs_plan:
+            try:
+                plan = explain_query_plan(conn, sql, parameters)
+            except (sqlite3.Error, ValueError):
+                with self._lock:
+                    self._stats["plan_errors"] += 1
+                return
+            with self._lock:
+                entry["plan"] = plan
+                entry["full_scan"] = any(is_full_scan(line.strip()) for line in plan)
+
+    def _record(self, sql, elapsed, execute_time, fetch_time, rows, error):
+        """更新慢查询表（调用者持有 ``self._lock``）"""
+        key = normalize_sql(sql)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                "sql": key, "count": 0, "errors": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0,
+                "execute_ms": 0.0, "fetch_ms": 0.0, "rows": 0,
+                "plan": None, "full_scan": None,
+                "first_seen": time.time(), "last_seen": 0.0, "example": None,
+            }
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+        else:
+            self._entries.move_to_end(key)
+        ms = elapsed * 1000
+        entry["count"] += 1
+        entry["errors"] += error
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        entry["last_ms"] = ms
+        entry["execute_ms"] += execute_time * 1000
+        entry["fetch_ms"] += fetch_time * 1000
+        entry["rows"] = rows
+        entry["last_seen"] = time.time()
+        entry["example"] = sql[:MAX_EXAMPLE_LENGTH]
+        return entry
+
+    def slow_queries(self, sort="max_ms", limit=None):
+        """返回慢查询表的副本，按 ``sort`` 降序排列"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort 可选值: {', '.join(SORT_KEYS)}")
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        for entry in entries[:limit]:
+            entry["avg_ms"] = entry["total_ms"] / entry["count"]
+            for key in ("total_ms", "max_ms", "last_ms", "avg_ms", "execute_ms", "fetch_ms"):
+                entry[key] = round(entry[key], 3)
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked"] = len(self._entries)
+        stats.update({
+            "time_ms": round(stats["time_ms"], 3),
+            "threshold_ms": self.threshold_ms,
+            "max_entries": self.max_entries,
+        })
+        return stats
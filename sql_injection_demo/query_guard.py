@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+失控查询保护
+Runaway Query Guard
+
+注入的载荷可以构造巨大的笛卡尔积或 ``randomblob`` 循环。通过
+``set_progress_handler`` 为每条查询设置虚拟机指令数和耗时预算，
+取结果时限制最大行数，并用 ``SQLITE_LIMIT_LENGTH`` 限制单个值的大小，
+超出任何一项都会中止查询并抛出 ``QueryBudgetExceeded``。
+Injected payloads can force huge cartesian joins or ``randomblob`` loops.
+Each query gets a VM-step and wall-clock budget enforced through
+``set_progress_handler``, a row cap when results are fetched, and a
+``SQLITE_LIMIT_LENGTH`` cap on single values; exceeding any of them aborts
+the query with ``QueryBudgetExceeded``.
+"""
+
+import sqlite3
+import threading
+import time
+
+# 每执行这么多条虚拟机指令回调一次进度处理函数
+CHECK_INTERVAL = 1000
+
+# 3.11之前的sqlite3模块没有 setlimit
+_HAS_SETLIMIT = hasattr(sqlite3.Connection, "setlimit")
+
+
+class QueryBudgetExceeded(sqlite3.OperationalError):
+    """查询超出预算被中止；``reason`` 为 steps / time / rows / size"""
+
+    def __init__(self, reason, budget):
+        super().__init__("query aborted: budget exceeded")
+        self.reason = reason
+        self.budget = budget
+
+
+def parse_budgets(spec):
+    """解析 ``endpoint=最大指令数:最长秒数:最大行数,...``，0表示不限制该项"""
+    budgets = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        endpoint, _, value = item.partition("=")
+        steps, seconds, rows = (value.split(":") + ["0", "0", "0"])[:3]
+        budgets[endpoint.strip()] = (int(steps or 0), float(seconds or 0), int(rows or 0))
+    return budgets
+
+
+class QueryGuard:
+    """一个端点的查询预算，用法::
+
+        guard = QueryGuard(max_steps=10_000_000, max_seconds=0.5, max_rows=1000)
+        with guard.watch(conn) as watch:
+            rows = watch.fetch(conn.execute(sql))
+    """
+
+    def __init__(self, max_steps=0, max_seconds=0.0, max_rows=0,
+                 max_value_bytes=1024 * 1024, check_interval=CHECK_INTERVAL):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.max_rows = max_rows
+        self.max_value_bytes = max_value_bytes
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self.aborts = {"steps": 0, "time": 0, "rows": 0, "size": 0}
+
+    def budget(self):
+        return {
+            "max_steps": self.max_steps,
+            "max_seconds": self.max_seconds,
+            "max_rows": self.max_rows,
+            "max_value_bytes": self.max_value_bytes,
+        }
+
+    def watch(self, conn):
+        """在 ``with`` 块内对 ``conn`` 上执行的语句施加预算"""
+        return _Watch(self, conn)
+
+    def _record_abort(self, reason):
+        with self._lock:
+            self.aborts[reason] += 1
+        return QueryBudgetExceeded(reason, self.budget())
+
+    def stats(self):
+        with self._lock:
+            aborts = dict(self.aborts)
+        return {**self.budget(), "aborts": aborts}
+
+
+class _Watch:
+    __slots__ = ("guard", "conn", "reason", "_old_length")
+
+    def __init__(self, guard, conn):
+        self.guard = guard
+        self.conn = conn
+        self.reason = None
+        self._old_length = None
+
+    def __enter__(self):
+        guard = self.guard
+        max_calls = guard.max_steps // guard.check_interval if guard.max_steps else 0
+        deadline = time.perf_counter() + guard.max_seconds if guard.max_seconds else 0.0
+        calls = 0
+        clock = time.perf_counter
+
+        def progress():
+            nonlocal calls
+            calls += 1
+            if max_calls and calls > max_calls:
+                self.reason = "steps"
+                return 1
+            if deadline and clock() > deadline:
+                self.reason = "time"
+                return 1
+            return 0
+
+        if max_calls or deadline:
+            self.conn.set_progress_handler(progress, guard.check_interval)
+        if guard.max_value_bytes and _HAS_SETLIMIT:
+            self._old_length = self.conn.setlimit(
+                sqlite3.SQLITE_LIMIT_LENGTH, guard.max_value_bytes
+            )
+        return self
+
+    def fetch(self, cursor):
+        """以元组取回结果，超过 ``max_rows`` 时中止"""
+        cursor.row_factory = None
+        max_rows = self.guard.max_rows
+        if not max_rows:
+            return cursor.fetchall()
+        rows = cursor.fetchmany(max_rows + 1)
+        if len(rows) > max_rows:
+            self.reason = "rows"
+            cursor.close()  # 释放未读完的语句
+            raise self.guard._record_abort("rows")
+        return rows
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.set_progress_handler(None, 0)
+        if self._old_length is not None:
+            self.conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, self._old_length)
+        if exc_type is None or isinstance(exc, QueryBudgetExceeded):
+            return False
+        if isinstance(exc, sqlite3.OperationalError) and self.reason in ("steps", "time"):
+            raise self.guard._record_abort(self.reason) from exc
+        if isinstance(exc, sqlite3.DataError) or (
+            isinstance(exc, sqlite3.Error) and "too big" in str(exc)
+        ):
+            raise self.guard._record_abort("size") from exc
+        return False
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条件GET与按版本缓存的响应
+Conditional GET and Version-Keyed Response Cache
+
+轮询型端点先计算一个廉价的版本标记（数据库文件状态、攻击计数……），
+由它和请求参数得到ETag：``If-None-Match`` 匹配时直接返回304，
+否则在按版本键入的LRU缓存中查找已编码的响应，都不命中才真正查询。
+Polling endpoints first compute a cheap version token (database file state,
+attack counters, ...). The ETag is derived from that token plus the request
+arguments: a matching ``If-None-Match`` gets a 304, otherwise the encoded
+response is looked up in an LRU cache keyed by version, and only a miss runs
+the real query.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+
+def make_etag(*parts):
+    """由任意可 ``repr`` 的部分生成强ETag"""
+    return f'"{hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(header, etag):
+    """``If-None-Match`` 使用弱比较：忽略 ``W/`` 前缀"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def file_version(*paths):
+    """文件的 ``(inode, 修改时间ns, 大小)``；不存在或为空的文件记为 ``None``
+
+    SQLite WAL模式下每次提交都会追加WAL文件，检查点会改写主文件，
+    因此主文件加 ``-wal`` 文件的状态可以作为跨进程的数据版本。
+    第一个连接打开时创建的空WAL文件不代表数据变化，所以空文件与不存在等同。
+    """
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((st.st_ino, st.st_mtime_ns, st.st_size) if st.st_size else None)
+    return tuple(version)
+
+
+class CachedResponse:
+    """已编码的响应体及其元数据"""
+
+    __slots__ = ("body", "etag", "mimetype", "headers")
+
+    def __init__(self, body, etag, mimetype="application/json", headers=None):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.etag = etag
+        self.mimetype = mimetype
+        self.headers = dict(headers or {})
+
+    def response(self):
+        headers = dict(self.headers)
+        headers["ETag"] = self.etag
+        return Response(self.body, mimetype=self.mimetype, headers=headers)
+
+
+class ResponseCache:
+    """按条目数和总字节数限制的LRU响应缓存（线程安全）"""
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry.body)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self._stats["evictions"] += 1
+        return entry
+
+    def not_modified(self, etag, if_none_match, headers=None):
+        """``If-None-Match`` 匹配时返回304响应，否则返回None"""
+        if not if_none_match or not etag_matches(if_none_match, etag):
+            return None
+        with self._lock:
+            self._stats["not_modified"] += 1
+        headers = dict(headers or {})
+        headers["ETag"] = etag
+        return Response(status=304, headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes)
+        return stats
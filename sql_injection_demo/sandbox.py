@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按会话隔离的沙箱数据库
+Per-Session Sandbox Databases
+
+每个会话拥有一份独立的内存数据库，由内存中的模板数据库通过backup API克隆
+（逐页内存复制，不读磁盘），某位参与者注入的修改不会影响其他人。
+所有沙箱的总内存（``page_count * page_size``）有硬上限：超出时按最近最少使用的顺序
+淘汰空闲沙箱，长时间未访问的沙箱在新会话到来时被清除。被淘汰的会话下次访问时重新克隆。
+借出中的沙箱按它允许增长到的最大值计入，请求执行期间的写入不会让总量超过上限。
+Every session gets its own in-memory database, cloned from an in-memory
+template with the backup API (a page-by-page memory copy, no disk reads), so
+one attendee's injected changes never affect anyone else. Total sandbox
+memory (``page_count * page_size``) has a hard cap: idle sandboxes are evicted
+in least-recently-used order when it is exceeded, and sandboxes idle for too
+long are expired whenever a new session arrives. An evicted session is simply
+cloned again on its next request. A sandbox that is checked out counts at the
+largest size it may grow to, so writes made during a request can never push
+the total over the cap.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db_pool import _fork_hook
+
+
+class SandboxUnavailable(sqlite3.OperationalError):
+    """沙箱内存已满且所有沙箱都在使用中，无法为新会话克隆"""
+
+
+class Sandbox:
+    """一个会话的内存数据库；``lock`` 保证同一会话的请求依次使用连接"""
+
+    __slots__ = ("session_id", "conn", "lock", "bytes", "last_used", "users", "generation")
+
+    def __init__(self, session_id, generation):
+        self.session_id = session_id
+        self.conn = None
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.last_used = time.monotonic()
+        self.users = 0
+        self.generation = generation
+
+    def version(self):
+        """沙箱数据版本：克隆代数 + 连接上累计的修改行数"""
+        return self.session_id, self.generation, self.conn.total_changes
+
+
+def _database_bytes(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+class SandboxManager:
+    """从模板克隆、按会话复用的沙箱集合（线程安全）
+
+    - ``source``: 模板数据库文件路径或URI，第一次克隆时载入内存
+    - ``max_bytes``: 所有沙箱的总内存上限
+    - ``idle_timeout``: 空闲超过该秒数的沙箱会被清除
+    - ``max_session_bytes``: 单个沙箱允许增长到的大小，默认为模板的两倍
+    - ``factory``: 沙箱连接的连接类，传给 ``sqlite3.connect``
+    """
+
+    def __init__(self, source, max_bytes, idle_timeout=1800.0, max_session_bytes=None,
+                 row_factory=sqlite3.Row, pragmas=(), factory=sqlite3.Connection):
+        self.source = source
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.max_session_bytes = max_session_bytes
+        self.row_factory = row_factory
+        self.pragmas = tuple(pragmas)
+        self.factory = factory
+        self._sandboxes = OrderedDict()
+        self._lock = threading.Lock()
+        self._template_lock = threading.Lock()
+        self._template = None
+        self._template_bytes = 0
+        self._max_page_count = 0
+        self._session_bytes = 0
+        self._bytes = 0
+        self._generation = 0
+        self._stats = {
+            "hits": 0, "clones": 0, "clone_time_ms": 0.0,
+            "evicted": 0, "expired": 0, "rejected": 0,
+        }
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+
+    # ------------------------------------------------------------------
+    # 模板
+    # ------------------------------------------------------------------
+
+    def reload(self, source=None):
+        """更换模板（数据库被重建或恢复后调用）：丢弃所有现有沙箱，下一次克隆时重新载入"""
+        with self._template_lock:
+            if source is not None:
+                self.source = source
+            old, self._template = self._template, None
+        if old is not None:
+            old.close()
+        self.clear()
+
+    def _ensure_template(self):
+        with self._template_lock:
+            if self._template is None:
+                self._load_template()
+
+    def _load_template(self):
+        """把模板数据库整体载入内存（调用者持有 ``_template_lock``）"""
+        template = sqlite3.connect(":memory:", check_same_thread=False)
+        disk = sqlite3.connect(self.source, uri=self.source.startswith("file:"))
+        try:
+            disk.backup(template)
+        finally:
+            disk.close()
+        self._template_bytes = _database_bytes(template)
+        page_size = template.execute("PRAGMA page_size").fetchone()[0]
+        max_session_bytes = self.max_session_bytes or 2 * self._template_bytes
+        self._max_page_count = max(1, max_session_bytes // page_size)
+        self._session_bytes = self._max_page_count * page_size
+        self._template = template
+
+    def _reset_after_fork(self):
+        """子进程不复用父进程的SQLite连接：丢弃继承来的模板和沙箱（不关闭），需要时重新载入"""
+        self._lock = threading.Lock()
+        self._template_lock = threading.Lock()
+        self._template = None
+        self._sandboxes = OrderedDict()
+        self._bytes = 0
+
+    def _clone(self):
+        conn = sqlite3.connect(":memory:", check_same_thread=False, factory=self.factory)
+        try:
+            with self._template_lock:
+                if self._template is None:
+                    self._load_template()
+                self._template.backup(conn)
+                max_page_count = self._max_page_count
+            conn.row_factory = self.row_factory
+            conn.execute(f"PRAGMA max_page_count={max_page_count}")
+            for pragma in self.pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    # ------------------------------------------------------------------
+    # 借出与归还
+    # ------------------------------------------------------------------
+
+    def acquire(self, session_id):
+        """返回会话的沙箱（持有其锁），不存在时从模板克隆；用完后必须 ``release``"""
+        if self._template is None:
+            self._ensure_template()
+        while True:
+            with self._lock:
+                sandbox = self._sandboxes.get(session_id)
+                if sandbox is None:
+                    sandbox = self._admit(session_id)
+                    created = True
+                    sandbox.users += 1
+                else:
+                    sandbox.users += 1
+                    if sandbox.users == 1:
+                        try:
+                            self._reserve(sandbox)
+                        except SandboxUnavailable:
+                            sandbox.users -= 1
+                            raise
+                    self._sandboxes.move_to_end(session_id)
+                    self._stats["hits"] += 1
+                    created = False
+
+            if created:
+                # 新沙箱的锁在放入表中之前已经持有，同一会话的其他请求等待克隆完成
+                try:
+                    started = time.perf_counter()
+                    sandbox.conn = self._clone()
+                    elapsed = time.perf_counter() - started
+                except Exception:
+                    with self._lock:
+                        if self._sandboxes.get(session_id) is sandbox:
+                            self._unlink(sandbox)
+                        sandbox.users -= 1
+                    sandbox.lock.release()
+                    raise
+                with self._lock:
+                    self._stats["clones"] += 1
+                    self._stats["clone_time_ms"] += elapsed * 1000
+                return sandbox
+
+            sandbox.lock.acquire()
+            with self._lock:
+                if self._sandboxes.get(session_id) is sandbox:
+                    return sandbox
+                # 等待期间沙箱被丢弃或克隆失败，重新查找
+                stale = self._leave(sandbox)
+            sandbox.lock.release()
+            if stale:
+                self._close(sandbox)
+
+    def release(self, sandbox):
+        """归还沙箱：回滚未提交的事务，最后一个使用者归还时把预留的内存占用改为实际大小"""
+        conn = sandbox.conn
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            size = _database_bytes(conn)
+        except sqlite3.Error:
+            size = sandbox.bytes
+        sandbox.last_used = time.monotonic()
+        with self._lock:
+            if sandbox.users == 1 and self._sandboxes.get(sandbox.session_id) is sandbox:
+                self._bytes += size - sandbox.bytes
+                sandbox.bytes = size
+            stale = self._leave(sandbox)
+        sandbox.lock.release()
+        if stale:
+            self._close(sandbox)
+
+    def discard(self, session_id):
+        """丢弃会话的沙箱（例如恢复数据），下次访问时重新克隆"""
+        with self._lock:
+            sandbox = self._sandboxes.get(session_id)
+            if sandbox is None:
+                return False
+            self._unlink(sandbox)
+            idle = sandbox.users == 0
+        if idle:
+            self._close(sandbox)
+        return True
+
+    def clear(self):
+        """丢弃所有沙箱；使用中的沙箱在归还时关闭"""
+        with self._lock:
+            dropped = list(self._sandboxes.values())
+            self._sandboxes.clear()
+            self._bytes = 0
+            idle = [sandbox for sandbox in dropped if sandbox.users == 0]
+        for sandbox in idle:
+            self._close(sandbox)
+
+    # ------------------------------------------------------------------
+    # 内存上限与淘汰（调用者持有 self._lock）
+    # ------------------------------------------------------------------
+
+    def _admit(self, session_id):
+        self._expire_idle(time.monotonic())
+        needed = self._session_bytes
+        self._evict_lru(needed)
+        if self._bytes + needed > self.max_bytes:
+            self._stats["rejected"] += 1
+            raise SandboxUnavailable("沙箱内存已满，请稍后再试")
+        self._generation += 1
+        sandbox = Sandbox(session_id, self._generation)
+        sandbox.lock.acquire()
+        sandbox.bytes = needed
+        self._sandboxes[session_id] = sandbox
+        self._bytes += needed
+        return sandbox
+
+    def _reserve(self, sandbox):
+        """空闲沙箱被再次借出：把它的内存占用从实际大小提高到允许的最大值（调用者已把 ``users`` 加一）"""
+        needed = self._session_bytes - sandbox.bytes
+        if needed <= 0:
+            return
+        self._evict_lru(needed)
+        if self._bytes + needed > self.max_bytes:
+            self._stats["rejected"] += 1
+            raise SandboxUnavailable("沙箱内存已满，请稍后再试")
+        sandbox.bytes += needed
+        self._bytes += needed
+
+    def _expire_idle(self, now):
+        """清除空闲超时的沙箱：按最近使用顺序，遇到未超时的即停止"""
+        if not self.idle_timeout:
+            return
+        for sandbox in list(self._sandboxes.values()):
+            if now - sandbox.last_used <= self.idle_timeout:
+                break
+            if sandbox.users == 0:
+                self._unlink(sandbox)
+                self._close(sandbox)
+                self._stats["expired"] += 1
+
+    def _evict_lru(self, needed):
+        """淘汰最久未使用的空闲沙箱，直到能再容纳 ``needed`` 字节"""
+        for sandbox in list(self._sandboxes.values()):
+            if self._bytes + needed <= self.max_bytes:
+                break
+            if sandbox.users == 0:
+                self._unlink(sandbox)
+                self._close(sandbox)
+                self._stats["evicted"] += 1
+
+    def _unlink(self, sandbox):
+        del self._sandboxes[sandbox.session_id]
+        self._bytes -= sandbox.bytes
+
+    def _leave(self, sandbox):
+        """使用者减一；返回已不在表中且无人使用、应当关闭的沙箱"""
+        sandbox.users -= 1
+        return sandbox.users == 0 and self._sandboxes.get(sandbox.session_id) is not sandbox
+
+    @staticmethod
+    def _close(sandbox):
+        conn, sandbox.conn = sandbox.conn, None
+        if conn is not None:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "sandboxes": len(self._sandboxes),
+                "in_use": sum(1 for s in self._sandboxes.values() if s.users),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "template_bytes": self._template_bytes,
+                "session_max_bytes": self._session_bytes,
+            })
+        clones = stats["clones"]
+        stats["avg_clone_ms"] = round(stats.pop("clone_time_ms") / clones, 3) if clones else 0.0
+        return stats
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户全文检索
+Indexed User Search
+
+``users`` 表的用户名和角色建有FTS5 trigram索引（外部内容表，由触发器保持同步），
+任意子串检索都走索引并按bm25排序，不再对整表做 ``LIKE '%term%'`` 扫描。
+trigram至少需要3个字符，更短的检索词回退到带 ``LIMIT`` 的参数化LIKE查询——
+短词几乎匹配每一行，扫描很快就能凑满一页。
+Usernames and roles are covered by an FTS5 trigram index (an external-content
+table kept in sync by triggers), so any substring search is answered from the
+index and ranked with bm25 instead of scanning the table with
+``LIKE '%term%'``. Trigrams need at least three characters; shorter terms fall
+back to a parameterized, ``LIMIT``-ed LIKE query, which fills a page quickly
+because such terms match almost every row.
+"""
+
+import functools
+import sqlite3
+
+# trigram分词器可检索的最短长度
+MIN_TRIGRAM_LENGTH = 3
+
+# 用户名的匹配权重高于角色
+RANK_WEIGHTS = (2.0, 1.0)
+
+SEARCH_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    username, role, content='users', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts (rowid, username, role) VALUES (new.id, new.username, new.role);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, role)
+    VALUES ('delete', old.id, old.username, old.role);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, role)
+    VALUES ('delete', old.id, old.username, old.role);
+    INSERT INTO users_fts (rowid, username, role) VALUES (new.id, new.username, new.role);
+END;
+"""
+
+# 先只在索引上排序分页，再回表取当前页的行。
+# 按相关度排序需要为每个匹配计算bm25，匹配数很多时明显慢于按id排序
+INDEXED_QUERIES = {
+    "rank": """
+SELECT u.id, u.username, u.role, round(-f.rank, 4) AS score
+FROM (
+    SELECT rowid, rank FROM users_fts WHERE users_fts MATCH ?
+    ORDER BY rank, rowid LIMIT ? OFFSET ?
+) f
+JOIN users u ON u.id = f.rowid
+ORDER BY f.rank, u.id
+""",
+    "id": """
+SELECT u.id, u.username, u.role, NULL AS score
+FROM (
+    SELECT rowid FROM users_fts WHERE users_fts MATCH ? ORDER BY rowid LIMIT ? OFFSET ?
+) f
+JOIN users u ON u.id = f.rowid
+ORDER BY u.id
+""",
+}
+
+SORT_ORDERS = tuple(INDEXED_QUERIES)
+
+LIKE_QUERY = """
+SELECT id, username, role, NULL AS score
+FROM users
+WHERE username LIKE ? ESCAPE '\\' OR role LIKE ? ESCAPE '\\'
+ORDER BY id
+LIMIT ? OFFSET ?
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def trigram_available():
+    """当前SQLite是否编译了FTS5且支持trigram分词器（3.34+）"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(x, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def has_search_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'"
+    ).fetchone() is not None
+
+
+def create_search_index(conn):
+    """创建检索索引和同步触发器；索引是新建的时从 ``users`` 表整体构建
+
+    SQLite不支持trigram时返回False，检索只能使用LIKE。
+    """
+    if not trigram_available():
+        return False
+    existed = has_search_index(conn)
+    conn.executescript(SEARCH_INDEX)
+    if not existed:
+        with conn:
+            conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+            conn.execute(
+                "INSERT INTO users_fts (users_fts, rank) VALUES ('rank', ?)",
+                (f"bm25({', '.join(map(str, RANK_WEIGHTS))})",),
+            )
+    return True
+
+
+def match_expression(term):
+    """把检索词整体作为一个短语（子串）匹配，用户输入中的FTS5语法不会生效"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def like_pattern(term):
+    """转义LIKE通配符后包装为子串模式"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_users(conn, term, limit, offset=0, sort="rank", indexed=True):
+    """检索用户名或角色包含 ``term`` 的用户，返回 ``(mode, cursor)``
+
+    ``sort`` 为 ``"rank"``（相关度）或 ``"id"``；LIKE回退总是按id排序。
+    ``mode`` 为 ``"fts5"`` 或 ``"like"``；``indexed=False`` 表示索引不可用。
+    """
+    if indexed and len(term) >= MIN_TRIGRAM_LENGTH:
+        return "fts5", conn.execute(
+            INDEXED_QUERIES[sort], (match_expression(term), limit, offset)
+        )
+    pattern = like_pattern(term)
+    return "like", conn.execute(LIKE_QUERY, (pattern, pattern, limit, offset))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+演示数据库构建与合成数据生成
+Demo Database Builder and Synthetic Data Seeder
+
+除了固定的4个演示账户外，可按指定规模生成具有真实分布的用户与敏感数据，
+用于在接近生产规模的数据量下测量延迟。给定随机种子时结果完全确定。
+Besides the four fixed demo accounts, generates users and secrets with
+realistic distributions at a given scale so latency can be measured against
+production-sized tables. Output is fully deterministic for a given seed.
+
+用法 | Usage:
+    python seeder.py demo.db --users 1000000 --secrets 200000 --seed 42
+"""
+
+import argparse
+import operator
+import os
+import random
+import sqlite3
+import time
+
+from passwords import SALT_BYTES, hash_password
+from search import create_search_index, has_search_index, trigram_available
+
+
+# 表结构：唯一索引和外键索引在批量导入完成后再创建
+SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    role TEXT DEFAULT 'user',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    password_hash TEXT
+);
+
+CREATE TABLE sensitive_data (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    secret_info TEXT,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+"""
+
+INDEXES = """
+CREATE UNIQUE INDEX idx_users_username ON users (username);
+CREATE INDEX idx_sensitive_data_user_id ON sensitive_data (user_id);
+"""
+
+# 固定的演示账户，README和示例攻击载荷都依赖它们。
+# password 列保留明文供脆弱端点演示；password_hash 供安全端点校验
+BASE_USERS = (
+    ("admin", "admin123", "administrator"),
+    ("alice", "alice_password", "user"),
+    ("bob", "bob123", "user"),
+    ("test_user", "test123", "user"),
+)
+
+BASE_SECRETS = (
+    (1, "Top Secret Admin Data"),
+    (2, "Alice Personal Information"),
+    (3, "Bob Confidential Records"),
+)
+
+FIRST_NAMES = (
+    "james", "mary", "john", "linda", "robert", "susan", "michael", "karen",
+    "david", "lisa", "william", "nancy", "richard", "betty", "joseph", "sandra",
+    "thomas", "ashley", "charles", "emily", "wei", "fang", "jing", "lei",
+    "min", "yan", "hui", "tao", "hiroshi", "yuki", "carlos", "maria",
+    "ahmed", "fatima", "ivan", "olga", "pierre", "claire", "hans", "anna",
+)
+
+LAST_NAMES = (
+    "smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis",
+    "wang", "li", "zhang", "liu", "chen", "yang", "huang", "zhao",
+    "sato", "suzuki", "kim", "lee", "park", "nguyen", "tran", "singh",
+    "kumar", "muller", "schmidt", "rossi", "silva", "santos", "ivanov", "novak",
+)
+
+# 用户名格式及其权重：{f}=名, {l}=姓, {i}=首字母；末尾追加用户id保证唯一
+USERNAME_FORMATS = (
+    ("{f}.{l}", 35), ("{f}{l}", 20), ("{f}_{l}", 10), ("{i}{l}", 15), ("{f}", 12), ("{l}.{f}", 8),
+)
+
+# 角色分布：绝大多数为普通用户
+ROLE_WEIGHTS = (
+    ("user", 900), ("moderator", 50), ("editor", 30), ("auditor", 15), ("administrator", 5),
+)
+
+PASSWORD_WORDS = (
+    "password", "qwerty", "letmein", "dragon", "monkey", "sunshine", "welcome",
+    "shadow", "master", "football", "iloveyou", "princess", "secret", "summer",
+)
+
+# 合成用户的口令取自这个小集合：每个口令只计算一次哈希，由所有使用它的行共用，
+# 合成用户也能通过安全端点登录，而不必逐行计算百万次慢哈希
+SYNTHETIC_PASSWORDS = tuple(f"{word}{1000 + 271 * i}" for i, word in enumerate(PASSWORD_WORDS))
+
+SECRET_TEMPLATES = (
+    "Credit card ending ",
+    "SSN ***-**-",
+    "API key sk_live_",
+    "Medical record #",
+    "Salary CNY ",
+    "Recovery code ",
+    "Home address unit ",
+)
+
+# 合成数据的注册时间范围（固定起点保证结果可复现）
+CREATED_AT_START = 1609459200  # 2021-01-01 00:00:00 UTC
+CREATED_AT_SPAN = 3 * 365 * 24 * 3600
+
+BATCH_SIZE = 50000
+
+
+def _lookup_table(weighted, size=1 << 16):
+    """把带权重的候选值展开成长度为 ``size`` 的查找表，按权重比例重复"""
+    total = sum(weight for _, weight in weighted)
+    table = []
+    for value, weight in weighted:
+        table.extend([value] * round(weight * size / total))
+    table.extend([weighted[0][0]] * (size - len(table)))
+    return table[:size]
+
+
+def _random_indices(rng, n):
+    """生成 ``n`` 个 [0, 65536) 范围内的随机下标（整批在C层完成）"""
+    return memoryview(rng.getrandbits(16 * n).to_bytes(2 * n, "little")).cast("H")
+
+
+def _pick(table, indices):
+    return operator.itemgetter(*indices)(table) if len(indices) > 1 else [table[indices[0]]]
+
+
+def _salt_generator(seed):
+    """返回生成口令哈希盐的函数：给定种子时由种子派生（构建结果可复现），否则返回None使用随机盐"""
+    if seed is None:
+        return lambda: None
+    rng = random.Random(f"password-salt:{seed}")
+    return lambda: rng.randbytes(SALT_BYTES)
+
+
+def _user_batches(rng, count, first_id, password_hashes):
+    """按批生成 ``(username, password, role, created_epoch, password_hash)``
+
+    候选值预先展开成65536项的查找表，每批用一次随机位生成全部下标，
+    再用 ``itemgetter`` 批量取值，逐行操作都在C层完成。
+    """
+    if count <= 0:
+        return
+    bases = _lookup_table([
+        (fmt.format(f=f, l=l, i=f[0]), weight)
+        for fmt, weight in USERNAME_FORMATS for f in FIRST_NAMES for l in LAST_NAMES
+    ])
+    passwords = _lookup_table([(password, 1) for password in password_hashes])
+    roles = _lookup_table(ROLE_WEIGHTS)
+    # 注册时间随id递增，并叠加少于一个间隔的抖动
+    step = max(1, CREATED_AT_SPAN // max(count, 1))
+    jitters = [(v * step) >> 16 for v in range(1 << 16)]
+
+    for start in range(0, count, BATCH_SIZE):
+        n = min(BATCH_SIZE, count - start)
+        ids = range(first_id + start, first_id + start + n)
+        # 用户名末尾追加用户id保证唯一
+        names = map(str.__add__, _pick(bases, _random_indices(rng, n)), map(str, ids))
+        created = map(
+            operator.add,
+            range(CREATED_AT_START + start * step, CREATED_AT_START + (start + n) * step, step),
+            _pick(jitters, _random_indices(rng, n)),
+        )
+        picked = _pick(passwords, _random_indices(rng, n))
+        yield list(zip(
+            names,
+            picked,
+            _pick(roles, _random_indices(rng, n)),
+            created,
+            map(password_hashes.__getitem__, picked),
+        ))
+
+
+def _secret_batches(rng, count, max_user_id):
+    """按批生成 ``(user_id, secret_info)``，user_id 偏向较早注册的用户"""
+    if count <= 0:
+        return
+    # 下标平方映射到用户id，形成偏向早期用户的分布
+    owners = [1 + (v * v * max_user_id >> 32) for v in range(1 << 16)]
+    templates = _lookup_table([(template, 1) for template in SECRET_TEMPLATES])
+    for start in range(0, count, BATCH_SIZE):
+        n = min(BATCH_SIZE, count - start)
+        numbers = map(str, range(start * 7919 + 10 ** 6, (start + n) * 7919 + 10 ** 6, 7919))
+        yield list(zip(
+            _pick(owners, _random_indices(rng, n)),
+            map(str.__add__, _pick(templates, _random_indices(rng, n)), numbers),
+        ))
+
+
+def seed_database(path, users=0, secrets=0, seed=None, journal_mode="WAL"):
+    """在 ``path`` 新建演示数据库：演示账户 + ``users`` 个合成用户 + ``secrets`` 条敏感数据
+
+    批量导入期间关闭日志与同步，在少量大事务中用 executemany 写入，导入完成后再建索引。
+    返回各阶段耗时（秒）。
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    next_salt = _salt_generator(seed)
+    timings = {}
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.executescript(SCHEMA)
+
+        conn.execute("BEGIN")
+        # 演示账户的注册时间固定为合成数据的起点，而不是构建时间
+        conn.executemany(
+            "INSERT INTO users (username, password, role, created_at, password_hash) "
+            "VALUES (?, ?, ?, datetime(?, 'unixepoch'), ?)",
+            [(username, password, role, CREATED_AT_START,
+              hash_password(password, salt=next_salt()))
+             for username, password, role in BASE_USERS],
+        )
+        conn.executemany(
+            "INSERT INTO sensitive_data (user_id, secret_info) VALUES (?, ?)", BASE_SECRETS
+        )
+        first_id = len(BASE_USERS) + 1
+        password_hashes = {
+            password: hash_password(password, salt=next_salt())
+            for password in (SYNTHETIC_PASSWORDS if users > 0 else ())
+        }
+        for batch in _user_batches(rng, users, first_id, password_hashes):
+            conn.executemany(
+                "INSERT INTO users (username, password, role, created_at, password_hash) "
+                "VALUES (?, ?, ?, datetime(?, 'unixepoch'), ?)",
+                batch,
+            )
+        timings["users"] = time.perf_counter() - started
+
+        mark = time.perf_counter()
+        for batch in _secret_batches(rng, secrets, len(BASE_USERS) + users):
+            conn.executemany(
+                "INSERT INTO sensitive_data (user_id, secret_info) VALUES (?, ?)", batch
+            )
+        conn.execute("COMMIT")
+        timings["secrets"] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        conn.executescript(INDEXES)
+        conn.execute("ANALYZE")
+        timings["indexes"] = time.perf_counter() - mark
+
+        # 全文检索索引及其同步触发器（SQLite不支持trigram时跳过）
+        mark = time.perf_counter()
+        if create_search_index(conn):
+            timings["search_index"] = time.perf_counter() - mark
+
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    finally:
+        conn.close()
+
+    timings["total"] = time.perf_counter() - started
+    return {name: round(value, 3) for name, value in timings.items()}
+
+
+def schema_outdated(conn):
+    """数据库是否由旧版本生成、缺少后来新增的列或索引"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    return "password_hash" not in columns or (trigram_available() and not has_search_index(conn))
+
+
+def upgrade_schema(conn):
+    """为旧版本生成的数据库补上口令哈希列（并为演示账户计算哈希）和全文检索索引"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "password_hash" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
+            conn.executemany(
+                "UPDATE users SET password_hash=? WHERE username=? AND password=?",
+                [(hash_password(password), username, password)
+                 for username, password, _ in BASE_USERS],
+            )
+    create_search_index(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成演示数据库（可指定合成数据规模）")
+    parser.add_argument("path", nargs="?", default="demo.db")
+    parser.add_argument("--users", type=int, default=0, help="额外生成的用户数")
+    parser.add_argument("--secrets", type=int, default=0, help="额外生成的敏感数据条数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（指定后结果可复现）")
+    parser.add_argument("--journal-mode", default="WAL")
+    args = parser.parse_args(argv)
+
+    timings = seed_database(args.path, args.users, args.secrets, args.seed, args.journal_mode)
+    print(f"✅ 已生成 {args.path}: {len(BASE_USERS) + args.users} 个用户, "
+          f"{len(BASE_SECRETS) + args.secrets} 条敏感数据")
+    print(f"⏱️  耗时 | Timings: {timings}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程生产服务启动器
+Multi-Process Production Server Launcher
+
+优先使用 gunicorn（预派生多进程 + 线程），其次 waitress（单进程多线程）；
+两者都不可用时使用内置的预派生服务器：主进程预加载应用并监听端口，
+fork出的每个工作进程用固定大小的线程池处理请求，支持HUP平滑重启。
+Prefers gunicorn (pre-fork processes + threads), then waitress (one process,
+many threads). When neither is installed, a built-in pre-fork server is used:
+the master preloads the app and owns the listening socket, each forked
+worker serves requests from a fixed-size thread pool, and SIGHUP triggers a
+graceful rolling restart.
+"""
+
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+SERVERS = ("auto", "gunicorn", "waitress", "builtin", "dev")
+
+
+def default_workers():
+    """可用CPU核数（``--workers 0`` 时使用）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ---------------------------------------------------------------------------
+# gunicorn / waitress
+# ---------------------------------------------------------------------------
+
+def _serve_gunicorn(app, host, port, workers, threads, keepalive, graceful_timeout):
+    from gunicorn.app.base import BaseApplication
+
+    class DemoApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread" if threads > 1 else "sync",
+                "preload_app": True,
+                "keepalive": keepalive,
+                "graceful_timeout": graceful_timeout,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    DemoApplication().run()
+
+
+def _serve_waitress(app, host, port, workers, threads, keepalive):
+    from waitress import serve
+
+    if workers > 1:
+        print("⚠️  waitress 为单进程服务器，--workers 被忽略 | waitress is single-process")
+    serve(app, host=host, port=port, threads=threads, channel_timeout=max(keepalive, 1))
+
+
+# ---------------------------------------------------------------------------
+# 内置预派生服务器 (Built-in Pre-Fork Server)
+# ---------------------------------------------------------------------------
+
+def _make_worker_server(app, sock, threads, keepalive):
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 读取一个请求的超时；请求之间的空闲等待不在线程中进行，见 PooledWSGIServer
+        timeout = keepalive
+        parked = False
+
+        def handle_one_request(self):
+            super().handle_one_request()
+            # 连接保持且没有已缓冲的后续请求时，把连接交还给服务器等待下一个请求
+            if not self.close_connection and not self._has_buffered_input():
+                self.parked = True
+                self.close_connection = True
+
+        def _has_buffered_input(self):
+            self.connection.setblocking(False)
+            try:
+                return bool(self.rfile.peek(1))
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+
+        def log_request(self, *args, **kwargs):
+            pass  # 访问日志由应用自身记录，避免每个请求额外写一次stderr
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """用固定大小的线程池代替每连接一个线程
+
+        等待请求的连接不占用线程池：新接受的连接和处理完一个请求后保持的keep-alive连接
+        都交给一个selector线程等待，可读时才提交到线程池，空闲超过 ``keepalive`` 秒后关闭。
+        否则只要有 ``threads`` 个连接不发送请求（浏览器预连接、空闲keep-alive），
+        整个工作进程就要等到它们超时。
+        """
+
+        multithread = True
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+            self._idle_lock = threading.Lock()
+            self._to_park = []
+            self._closing = False
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._wake_w.setblocking(False)
+            self._idle_thread = threading.Thread(
+                target=self._idle_loop, name="http-keepalive", daemon=True
+            )
+            self._idle_thread.start()
+
+        def process_request(self, request, client_address):
+            if not self._park(request, client_address):
+                self.executor.submit(self._process, request, client_address)
+
+        def finish_request(self, request, client_address):
+            """处理连接上的请求，连接应保持等待下一个请求时返回True"""
+            return self.RequestHandlerClass(request, client_address, self).parked
+
+        def _process(self, request, client_address):
+            parked = False
+            try:
+                parked = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if not (parked and self._park(request, client_address)):
+                    self.shutdown_request(request)
+
+        def _park(self, request, client_address):
+            with self._idle_lock:
+                if self._closing:
+                    return False
+                self._to_park.append((request, client_address))
+            self._wake()
+            return True
+
+        def _wake(self):
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                pass  # 缓冲区已满说明已有未处理的唤醒
+
+        def _idle_loop(self):
+            """等待空闲连接可读（重新提交到线程池）或超时（关闭）"""
+            selector = selectors.DefaultSelector()
+            selector.register(self._wake_r, selectors.EVENT_READ)
+            idle = {}  # socket -> (client_address, deadline)
+            closing = False
+            while not closing:
+                now = time.monotonic()
+                timeout = max(0.0, min(d for _, d in idle.values()) - now) if idle else None
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wake_r:
+                        try:
+                            self._wake_r.recv(4096)
+                        except OSError:
+                            pass
+                        continue
+                    selector.unregister(key.fileobj)
+                    client_address, _ = idle.pop(key.fileobj)
+                    try:
+                        self.executor.submit(self._process, key.fileobj, client_address)
+                    except RuntimeError:  # 线程池已关闭
+                        self.shutdown_request(key.fileobj)
+                with self._idle_lock:
+                    parked, self._to_park = self._to_park, []
+                    closing = self._closing
+                deadline = time.monotonic() + keepalive
+                for request, client_address in parked:
+                    try:
+                        selector.register(request, selectors.EVENT_READ)
+                    except (ValueError, OSError):  # 连接已被对端关闭
+                        self.shutdown_request(request)
+                        continue
+                    idle[request] = (client_address, deadline)
+                now = time.monotonic()
+                for request in [s for s, (_, d) in idle.items() if closing or d <= now]:
+                    selector.unregister(request)
+                    del idle[request]
+                    self.shutdown_request(request)
+            selector.close()
+
+        def close_idle(self):
+            """停止接收空闲连接并关闭正在等待的连接；之后处理完的请求直接关闭连接"""
+            with self._idle_lock:
+                self._closing = True
+            self._wake()
+            self._idle_thread.join()
+            self._wake_r.close()
+            self._wake_w.close()
+
+    return PooledWSGIServer(
+        sock.getsockname()[0], sock.getsockname()[1], app,
+        handler=KeepAliveHandler, fd=sock.fileno(),
+    )
+
+
+def _run_worker(app, sock, threads, keepalive, graceful_timeout):
+    """工作进程：服务请求直到收到SIGTERM，然后等待处理中的请求完成"""
+    server = _make_worker_server(app, sock, threads, keepalive)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.close_idle()
+        server.executor.shutdown(wait=True, cancel_futures=False)
+        os._exit(0)
+
+
+class PreForkServer:
+    """主进程：预加载应用、持有监听socket、派生并看护工作进程
+
+    - SIGTERM / SIGINT: 通知所有工作进程优雅退出，超时后强制结束
+    - SIGHUP: 逐个启动新工作进程并让旧进程优雅退出（平滑重启）
+    - 工作进程意外退出时自动补齐
+    """
+
+    def __init__(self, app, host, port, workers, threads, keepalive=5, graceful_timeout=30):
+        self.app = app
+        self.workers = workers
+        self.threads = threads
+        self.keepalive = keepalive
+        self.graceful_timeout = graceful_timeout
+        self.sock = socket.create_server((host, port), backlog=2048, reuse_port=False)
+        self.sock.set_inheritable(True)
+        self.children = set()
+        self._stopping = False
+        self._reload = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # 子进程无论如何都不能回到主进程的看护循环，否则会成为第二个master
+            try:
+                _run_worker(self.app, self.sock, self.threads, self.keepalive,
+                            self.graceful_timeout)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stderr.flush()
+                os._exit(1)
+        self.children.add(pid)
+        return pid
+
+    def _wait(self, pid, flags=0):
+        """回收指定工作进程，已退出时返回True"""
+        try:
+            done, _ = os.waitpid(pid, flags)
+        except ChildProcessError:
+            done = pid
+        if done:
+            self.children.discard(pid)
+        return bool(done)
+
+    def _terminate(self, pids):
+        """向工作进程发送SIGTERM，超过 ``graceful_timeout`` 仍未退出的强制结束"""
+        pending = set(pids)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while pending and time.monotonic() < deadline:
+            pending = {pid for pid in pending if not self._wait(pid, os.WNOHANG)}
+            if pending:
+                time.sleep(0.05)
+        for pid in pending:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self._wait(pid)
+
+    def _reap(self):
+        """回收已退出的工作进程（非阻塞）"""
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            self.children.discard(pid)
+
+    def _rolling_restart(self):
+        old = list(self.children)
+        for pid in old:
+            self._spawn()
+            self._terminate([pid])
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for _ in range(self.workers):
+            self._spawn()
+        print(f"✅ 内置预派生服务器已启动: {self.workers} 个工作进程 × {self.threads} 线程 "
+              f"(master pid {os.getpid()})")
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                print("🔄 平滑重启工作进程 | Graceful restart")
+                self._rolling_restart()
+            self._reap()
+            # 补齐意外退出的工作进程
+            for _ in range(self.workers - len(self.children)):
+                if not self._stopping:
+                    self._spawn()
+            time.sleep(0.2)
+
+        self._terminate(list(self.children))
+        self.sock.close()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+
+def _serve_builtin(app, host, port, workers, threads, keepalive, graceful_timeout):
+    if not hasattr(os, "fork"):
+        # Windows等不支持fork的平台：单进程线程池
+        print("⚠️  当前平台不支持fork，使用单进程线程池 | fork unavailable, single process")
+        sock = socket.create_server((host, port), backlog=2048)
+        server = _make_worker_server(app, sock, threads, keepalive)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close_idle()
+            server.executor.shutdown(wait=True)
+        return
+    PreForkServer(app, host, port, workers, threads, keepalive, graceful_timeout).run()
+
+
+# ---------------------------------------------------------------------------
+# 统一入口 (Entry)
+# ---------------------------------------------------------------------------
+
+def _available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def resolve_server(server):
+    """``auto`` 时按 gunicorn → waitress → builtin 的顺序选择可用的服务器"""
+    if server != "auto":
+        return server
+    if os.name == "posix" and _available("gunicorn"):
+        return "gunicorn"
+    if _available("waitress"):
+        return "waitress"
+    return "builtin"
+
+
+def add_server_arguments(parser):
+    """为命令行添加服务器相关参数（start_demo.py 与主程序共用）"""
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--server", choices=SERVERS, default=os.environ.get("SERVER", "auto"),
+                        help="auto: gunicorn → waitress → builtin；dev: Flask调试服务器")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("WORKERS", "0")) or default_workers(),
+                        help="工作进程数，默认及0表示CPU核数")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("THREADS", "4")),
+                        help="每个工作进程的线程数")
+    parser.add_argument("--keepalive", type=int, default=int(os.environ.get("KEEPALIVE", "5")),
+                        help="空闲keep-alive连接保持秒数")
+    parser.add_argument("--graceful-timeout", type=int,
+                        default=int(os.environ.get("GRACEFUL_TIMEOUT", "30")),
+                        help="停止/重启时等待处理中请求的秒数")
+    return parser
+
+
+def serve_from_args(app, args):
+    serve(app, host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+          server=args.server, keepalive=args.keepalive, graceful_timeout=args.graceful_timeout)
+
+
+def serve(app, host="0.0.0.0", port=5000, workers=0, threads=4, server="auto",
+          keepalive=5, graceful_timeout=30):
+    """以生产模式运行 ``app``"""
+    workers = workers or default_workers()
+    server = resolve_server(server)
+    print(f"🚀 服务器: {server} | workers={workers} threads={threads} "
+          f"keepalive={keepalive}s | http://{host}:{port}")
+    sys.stdout.flush()
+
+    if server == "gunicorn":
+        _serve_gunicorn(app, host, port, workers, threads, keepalive, graceful_timeout)
+    elif server == "waitress":
+        _serve_waitress(app, host, port, workers, threads, keepalive)
+    elif server == "builtin":
+        _serve_builtin(app, host, port, workers, threads, keepalive, graceful_timeout)
+    elif server == "dev":
+        app.run(host=host, port=port, debug=True)
+    else:
+        raise ValueError(f"未知的服务器类型: {server}")
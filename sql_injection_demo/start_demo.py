@@ -6,11 +6,14 @@ SQL Injection Demo System Startup Script
 
 这个脚本用于在Windows环境下正确启动演示系统
 This script is used to properly start the demo system on Windows
+
+用法 | Usage:
+    python start_demo.py --workers 4 --threads 8 --port 5000
+    python start_demo.py --server dev    # Flask调试服务器 | debug server
 """
 
-import os
+import argparse
 import sys
-import time
 import subprocess
 from pathlib import Path
 
@@ -30,8 +33,20 @@ def check_dependencies():
             print("❌ Flask 安装失败 | Flask installation failed")
             return False
 
-def main():
+def pause(prompt):
+    """交互式终端中等待回车，容器等非交互环境直接跳过"""
+    if sys.stdin.isatty():
+        input(prompt)
+
+
+def main(argv=None):
     """主函数"""
+    from server import add_server_arguments, serve_from_args
+
+    parser = argparse.ArgumentParser(description="启动SQL注入演示系统")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
     print("=" * 60)
     print("🔐 SQL注入攻击与防御演示系统")
     print("   SQL Injection Demo System")
@@ -39,31 +54,34 @@ def main():
     
     # 检查依赖
     if not check_dependencies():
-        input("按回车键退出... | Press Enter to exit...")
+        pause("按回车键退出... | Press Enter to exit...")
         return
     
     # 检查主文件是否存在
     demo_file = Path("flask_sql_injection_demo.py")
     if not demo_file.exists():
         print("❌ 演示文件不存在 | Demo file not found")
-        input("按回车键退出... | Press Enter to exit...")
+        pause("按回车键退出... | Press Enter to exit...")
         return
     
     print("\n🚀 启动演示系统... | Starting demo system...")
-    print("📍 访问地址 | Access URL: http://127.0.0.1:5000")
+    print(f"📍 访问地址 | Access URL: http://127.0.0.1:{args.port}")
     print("⚠️  请在浏览器中打开上述地址 | Please open the above URL in browser")
     print("🛑 按 Ctrl+C 停止服务 | Press Ctrl+C to stop service")
     print("=" * 60)
     
     try:
-        # 启动Flask应用
-        os.system("python flask_sql_injection_demo.py")
+        # 在本进程中预加载应用并初始化数据库，工作进程由服务器fork出来共享这份应用
+        import flask_sql_injection_demo as demo
+
+        demo.init_db()
+        serve_from_args(demo.app, args)
     except KeyboardInterrupt:
         print("\n\n🛑 服务已停止 | Service stopped")
     except Exception as e:
         print(f"\n❌ 启动失败 | Startup failed: {e}")
     
-    input("\n按回车键退出... | Press Enter to exit...")
+    pause("\n按回车键退出... | Press Enter to exit...")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可替换的存储后端
+Pluggable Storage Backends
+
+``get_db()`` / ``init_db()`` 通过存储后端访问数据库。后端提供读写连接池，负责把黄金快照装入存储，
+并给出廉价的数据版本：
+- ``file``: 数据库文件（默认），只读连接以 ``mode=ro`` 打开，WAL模式下读写互不阻塞
+- ``memory``: 每个工作进程一个 ``:memory:`` 连接，第一次使用时从快照载入，所有请求依次使用它
+- ``shared_memory``: 每个工作进程一个 ``cache=shared`` 的命名内存数据库（``file::memory:?cache=shared``
+  的命名形式），多个连接共享同一份数据，由一个常驻连接保持数据库存活
+内存后端的数据属于各自的工作进程：一个进程中的修改（包括 ``/reset``）对其他进程不可见。
+``get_db()`` / ``init_db()`` reach the database through a storage backend,
+which provides the reader and writer pools, loads the golden snapshot into
+storage and reports a cheap data version:
+- ``file``: a database file (default); readers open it with ``mode=ro`` and
+  WAL keeps readers and the writer from blocking each other
+- ``memory``: one ``:memory:`` connection per worker, loaded from the
+  snapshot on first use and used by one request at a time
+- ``shared_memory``: one named ``cache=shared`` in-memory database per worker
+  (the named form of ``file::memory:?cache=shared``) shared by several
+  connections and kept alive by an anchor connection
+In-memory data belongs to its worker process: changes made in one process
+(including ``/reset``) are not visible to the others.
+"""
+
+import contextlib
+import os
+import shutil
+import sqlite3
+import threading
+
+from db_pool import ConnectionPool, _fork_hook, readonly_uri, reader_pragmas, writer_pragmas
+from response_cache import file_version
+
+BACKENDS = ("file", "memory", "shared_memory")
+
+# 各后端默认使用的调优参数（db_pool.STORAGE_PROFILES），可由 DB_STORAGE_MODE 覆盖
+DEFAULT_STORAGE_MODES = {"file": "wal", "memory": "memory", "shared_memory": "memory"}
+
+
+def _copy_database(snapshot, dest):
+    """通过backup API把快照整体复制到 ``dest`` 连接（遵守SQLite锁）
+
+    快照文件只会被整体替换（新inode），以immutable方式打开免去加锁和-shm文件。
+    """
+    source = sqlite3.connect(f"{readonly_uri(snapshot)}&immutable=1", uri=True)
+    try:
+        source.backup(dest)
+    finally:
+        source.close()
+
+
+class StorageBackend:
+    """存储后端接口
+
+    - ``reader_pool`` / ``writer_pool``: 只读与读写连接池（可以是同一个）
+    - ``exists()``: 存储中是否已有数据，否则需要初始化
+    - ``load(snapshot)``: 用快照文件替换存储中的数据
+    - ``upgrade(func)``: 对存储中的数据库执行schema升级 ``func(conn)``
+    - ``data_version()``: 廉价的数据版本，数据变化后一定不同
+    """
+
+    name = None
+
+    def __init__(self, database, snapshot, profile, pool_size=8, writer_pool_size=1,
+                 timeout=5.0, health_check_interval=30.0, pragmas=(),
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.snapshot = snapshot
+        self.profile = profile
+        self.pool_size = pool_size
+        self.writer_pool_size = writer_pool_size
+        self.pragmas = tuple(pragmas)
+        self.pool_options = {
+            "timeout": timeout,
+            "health_check_interval": health_check_interval,
+            "factory": factory,
+        }
+        self.location = database
+        self.reader_pool = None
+        self.writer_pool = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot)
+
+    def upgrade(self, func):
+        """内存后端的数据从快照载入，升级快照即可"""
+
+    def stats(self):
+        return {"backend": self.name, "location": self.location, "profile": self.profile}
+
+
+class FileBackend(StorageBackend):
+    """数据库文件：读连接池以只读方式打开，写连接池承担所有可能产生写入的语句"""
+
+    name = "file"
+
+    def __init__(self, database, snapshot, profile, **options):
+        super().__init__(database, snapshot, profile, **options)
+        self.writer_pool = ConnectionPool(
+            database,
+            size=self.writer_pool_size,
+            pragmas=writer_pragmas(profile) + self.pragmas,
+            **self.pool_options,
+        )
+        self.reader_pool = ConnectionPool(
+            readonly_uri(database),
+            size=self.pool_size,
+            pragmas=reader_pragmas(profile) + self.pragmas,
+            uri=True,
+            **self.pool_options,
+        )
+
+    def exists(self):
+        return os.path.exists(self.database)
+
+    def load(self, snapshot):
+        """数据库文件不存在时复制快照文件，否则通过写连接整体复制
+
+        写连接池保证本进程内没有其他写入同时进行；backup持有数据库写锁，
+        其他进程的连接在下一个读事务中看到恢复后的内容，连接无需重开。
+        """
+        if not os.path.exists(self.database):
+            building = f"{self.database}.building"
+            shutil.copyfile(snapshot, building)
+            os.replace(building, self.database)
+            return
+        dest = self.writer_pool.acquire()
+        try:
+            _copy_database(snapshot, dest)
+            if self.profile["journal_mode"].upper() == "WAL":
+                # 整库复制写出的WAL与数据库一样大，检查点后截断
+                dest.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self.writer_pool.release(dest)
+
+    def upgrade(self, func):
+        with contextlib.closing(
+            sqlite3.connect(self.database, timeout=self.pool_options["timeout"])
+        ) as conn:
+            func(conn)
+
+    def data_version(self):
+        """两次stat，不访问数据库，其他进程的写入也能看到"""
+        return file_version(self.database, f"{self.database}-wal")
+
+
+class _SnapshotPool(ConnectionPool):
+    """新建的 ``:memory:`` 连接先从快照载入数据；每个连接各自拥有一份数据库"""
+
+    def __init__(self, snapshot, **kwargs):
+        super().__init__(":memory:", **kwargs)
+        self.snapshot = snapshot
+        self.loads = 0
+        self.connection = None
+
+    def _connect(self):
+        conn = super()._connect()
+        try:
+            _copy_database(self.snapshot, conn)
+        except Exception:
+            conn.close()
+            raise
+        self.loads += 1
+        self.connection = conn
+        return conn
+
+    def _reset_after_fork(self):
+        super()._reset_after_fork()
+        self.connection = None
+
+
+class MemoryBackend(StorageBackend):
+    """每个工作进程一个 ``:memory:`` 连接，读写共用（连接池容量为1）"""
+
+    name = "memory"
+
+    def __init__(self, database, snapshot, profile, **options):
+        super().__init__(database, snapshot, profile, **options)
+        self.location = ":memory:"
+        pool = _SnapshotPool(
+            snapshot,
+            size=1,
+            pragmas=writer_pragmas(profile) + self.pragmas,
+            **self.pool_options,
+        )
+        self.reader_pool = self.writer_pool = pool
+
+    def load(self, snapshot):
+        pool = self.writer_pool
+        pool.snapshot = snapshot
+        loads = pool.loads
+        conn = pool.acquire()
+        try:
+            if pool.loads == loads:  # 刚新建的连接已经从快照载入
+                _copy_database(snapshot, conn)
+        finally:
+            pool.release(conn)
+
+    def data_version(self):
+        """所有写入都经过同一个连接：载入次数 + 连接上累计的修改行数"""
+        pool = self.writer_pool
+        conn = pool.connection
+        return pool.loads, conn.total_changes if conn is not None else 0
+
+
+class _SharedMemoryPool(ConnectionPool):
+    """连接前先确保本进程的共享内存数据库已载入"""
+
+    def __init__(self, backend, **kwargs):
+        super().__init__(backend.location, uri=True, **kwargs)
+        self.backend = backend
+
+    def _connect(self):
+        self.database = self.backend._ensure_anchor()
+        return super()._connect()
+
+
+class SharedMemoryBackend(StorageBackend):
+    """每个工作进程一个 ``cache=shared`` 命名内存数据库，读写连接池共享同一份数据
+
+    共享缓存使用表级锁，读者遇到写锁时立即失败而不是等待，因此只读连接开启
+    ``read_uncommitted``，不再获取表读锁（可能读到未提交的修改）。
+    """
+
+    name = "shared_memory"
+
+    def __init__(self, database, snapshot, profile, **options):
+        super().__init__(database, snapshot, profile, **options)
+        self.memory_name = os.path.splitext(os.path.basename(database))[0] or "sqli_demo"
+        self.location = self._uri()
+        self._lock = threading.Lock()
+        self._anchor = None
+        self._loads = 0
+        self.writer_pool = _SharedMemoryPool(
+            self,
+            size=self.writer_pool_size,
+            pragmas=writer_pragmas(profile) + self.pragmas,
+            **self.pool_options,
+        )
+        self.reader_pool = _SharedMemoryPool(
+            self,
+            size=self.pool_size,
+            pragmas=reader_pragmas(profile) + ("read_uncommitted=ON",) + self.pragmas,
+            **self.pool_options,
+        )
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_fork_hook(self))
+
+    def _uri(self):
+        # 名称带上进程号：fork出的子进程建立自己的数据库，不接触继承来的共享缓存
+        return f"file:{self.memory_name}-{os.getpid()}?mode=memory&cache=shared"
+
+    def _ensure_anchor(self):
+        """返回本进程数据库的URI，第一次调用时创建常驻连接并从快照载入"""
+        with self._lock:
+            if self._anchor is None:
+                self.location = self._uri()
+                anchor = sqlite3.connect(self.location, uri=True, check_same_thread=False)
+                try:
+                    _copy_database(self.snapshot, anchor)
+                except Exception:
+                    anchor.close()
+                    raise
+                self._anchor = anchor
+                self._loads += 1
+            return self.location
+
+    def _reset_after_fork(self):
+        """丢弃继承来的常驻连接（不关闭），子进程第一次连接时重新载入"""
+        self._lock = threading.Lock()
+        self._anchor = None
+
+    def load(self, snapshot):
+        self.snapshot = snapshot
+        if self._anchor is None:
+            self._ensure_anchor()
+            return
+        dest = self.writer_pool.acquire()
+        try:
+            _copy_database(snapshot, dest)
+        finally:
+            self.writer_pool.release(dest)
+
+    def data_version(self):
+        """常驻连接上的 ``PRAGMA data_version``：其他连接每提交一次就会变化"""
+        with self._lock:
+            if self._anchor is None:
+                return self._loads, None
+            return self._loads, self._anchor.execute("PRAGMA data_version").fetchone()[0]
+
+
+_BACKEND_CLASSES = {
+    "file": FileBackend,
+    "memory": MemoryBackend,
+    "shared_memory": SharedMemoryBackend,
+}
+
+
+def create_backend(backend, database, snapshot, profile, **options):
+    """按名称创建存储后端；``snapshot`` 为黄金快照文件，内存后端从它载入数据"""
+    if backend not in _BACKEND_CLASSES:
+        raise ValueError(f"未知的存储后端: {backend} (可选: {', '.join(BACKENDS)})")
+    return _BACKEND_CLASSES[backend](database, snapshot, profile, **options)
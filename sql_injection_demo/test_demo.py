@@ -10,6 +10,10 @@ Used to verify that all functions of the demo system work properly
 
 import requests
 import json
+import multiprocessing
+import os
+import signal
+import threading
 import time
 import sqlite3
 from urllib.parse import quote
@@ -50,6 +54,30 @@ class SQLInjectionDemoTester:
         except Exception as e:
             self.log_test("数据库初始化", False, f"设置失败: {str(e)}")
     
+    def test_concurrent_setup(self):
+        """测试并发的 /setup：各自使用独立的临时文件，全部成功且之后数据库可用"""
+        statuses = []
+        def setup(seed):
+            try:
+                response = requests.get(f"{self.base_url}/setup",
+                                        params={"users": 200, "secrets": 20, "seed": seed}, timeout=30)
+                statuses.append(response.status_code)
+            except Exception as e:
+                statuses.append(str(e))
+        
+        threads = [threading.Thread(target=setup, args=(seed,)) for seed in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        try:
+            response = requests.get(f"{self.base_url}/login_safe",
+                                    params={"username": "admin", "password": "admin123"}, timeout=5)
+            success = statuses == [200] * 3 and response.json().get("success", False)
+            self.log_test("并发初始化数据库", success, f"状态码: {statuses}")
+        except Exception as e:
+            self.log_test("并发初始化数据库", False, str(e))
+    
     def test_vulnerable_endpoint(self):
         """测试脆弱端点"""
         test_cases = [
@@ -148,6 +176,137 @@ class SQLInjectionDemoTester:
             except Exception as e:
                 self.log_test(f"高级漏洞 - {test_name}", False, str(e))
     
+    def test_attack_event_queries(self):
+        """测试 /stats 的事件过滤与聚合（含只给出 client_ip 的过滤）"""
+        try:
+            requests.get(f"{self.base_url}/login_vuln",
+                         params={"username": "admin' OR 1=1--", "password": "x"}, timeout=5)
+            events = []
+            for _ in range(10):  # 事件由日志写入线程批量入库
+                data = requests.get(f"{self.base_url}/stats", params={"window": 3600}, timeout=5).json()
+                events = data["attack_events"]["events"]
+                if events:
+                    break
+                time.sleep(0.5)
+            client_ip = events[0]["client_ip"] if events else "127.0.0.1"
+        except Exception as e:
+            self.log_test("攻击事件查询", False, str(e))
+            return
+        
+        test_cases = [
+            ("按客户端IP过滤", {"client_ip": client_ip}),
+            ("按端点分组", {"group_by": "endpoint"}),
+            ("按特征过滤并按客户端IP分组", {"pattern": "'", "group_by": "client_ip"}),
+        ]
+        for test_name, params in test_cases:
+            try:
+                params["window"] = 3600
+                response = requests.get(f"{self.base_url}/stats", params=params, timeout=5)
+                success = response.status_code == 200
+                message = f"HTTP {response.status_code}"
+                if success:
+                    series = response.json()["attack_events"]["aggregation"]["series"]
+                    success = len(series) > 0
+                    message = f"返回{len(series)}个分桶"
+                self.log_test(f"攻击事件查询 - {test_name}", success, message)
+            except Exception as e:
+                self.log_test(f"攻击事件查询 - {test_name}", False, str(e))
+        
+        # 非有限或超出范围的时间参数返回400，而不是转换时间时溢出返回500
+        for params in ({"until": "1e20"}, {"window": "inf"}, {"since": "nan"}, {"window": "-1"},
+                       {"since": "0001-01-01T00:00:00"}):
+            try:
+                response = requests.get(f"{self.base_url}/stats", params=params, timeout=5)
+                self.log_test(f"攻击事件查询 - 无效参数 {params}", response.status_code == 400,
+                              f"HTTP {response.status_code}")
+            except Exception as e:
+                self.log_test(f"攻击事件查询 - 无效参数 {params}", False, str(e))
+    
+    def test_bulk_detect(self):
+        """测试 /detect 批量检测：JSON数组、NDJSON，以及非数组JSON请求体返回400"""
+        test_cases = [
+            ("JSON数组", json.dumps(["admin", "' OR 1=1--"]), "application/json", 200, 2),
+            ("NDJSON", '"admin"\n{"id": 7, "input": "1 UNION SELECT"}\n', "application/x-ndjson", 200, 2),
+            ("JSON对象", json.dumps({"input": "' OR 1=1--"}), "application/json", 400, 0),
+            ("JSON标量", "5", "application/json", 400, 0),
+            ("NDJSON非字符串行", '5', "application/x-ndjson", 200, 1),
+        ]
+        
+        for test_name, body, content_type, expected_status, expected_items in test_cases:
+            try:
+                response = requests.post(f"{self.base_url}/detect", data=body.encode("utf-8"),
+                                         headers={"Content-Type": content_type}, timeout=5)
+                success = response.status_code == expected_status
+                if success and expected_status == 200:
+                    verdicts = [json.loads(line) for line in response.text.splitlines() if line]
+                    success = len(verdicts) == expected_items
+                self.log_test(f"批量检测 - {test_name}", success, f"HTTP {response.status_code}")
+            except Exception as e:
+                self.log_test(f"批量检测 - {test_name}", False, str(e))
+        
+        # 超过默认上限（10000项、8MB）：JSON数组与超长请求体返回413，NDJSON以一个错误项结束
+        try:
+            response = requests.post(f"{self.base_url}/detect", json=["x"] * 10001, timeout=10)
+            self.log_test("批量检测 - JSON数组超过条数上限", response.status_code == 413,
+                          f"HTTP {response.status_code}")
+            response = requests.post(f"{self.base_url}/detect", data=b" " * (8 * 1024 * 1024 + 1),
+                                     headers={"Content-Type": "application/json"}, timeout=10)
+            self.log_test("批量检测 - 请求体超过字节上限", response.status_code == 413,
+                          f"HTTP {response.status_code}")
+            response = requests.post(f"{self.base_url}/detect", data='"x"\n' * 10001,
+                                     headers={"Content-Type": "application/x-ndjson"}, timeout=10)
+            verdicts = [json.loads(line) for line in response.text.splitlines() if line]
+            success = response.status_code == 200 and len(verdicts) == 10001 and \
+                "error" in verdicts[-1] and "error" not in verdicts[-2]
+            self.log_test("批量检测 - NDJSON超过条数上限", success, f"返回{len(verdicts)}行")
+        except Exception as e:
+            self.log_test("批量检测 - 上限", False, str(e))
+    
+    def test_conditional_get(self):
+        """测试 /users 与 /stats 的ETag和304，以及 /stats 诊断字段的实时性"""
+        for endpoint in ["/users", "/stats"]:
+            try:
+                response = requests.get(f"{self.base_url}{endpoint}", timeout=5)
+                etag = response.headers.get("ETag")
+                again = requests.get(f"{self.base_url}{endpoint}",
+                                     headers={"If-None-Match": etag or ""}, timeout=5)
+                success = bool(etag) and again.status_code == 304
+                self.log_test(f"条件请求 - {endpoint}", success, f"再次请求返回 {again.status_code}")
+            except Exception as e:
+                self.log_test(f"条件请求 - {endpoint}", False, str(e))
+        
+        try:
+            before = requests.get(f"{self.base_url}/stats", timeout=5)
+            verified = before.json()["password_verifier"]["verified"]
+            requests.get(f"{self.base_url}/login_safe",
+                         params={"username": "admin", "password": "admin123"}, timeout=5)
+            after = requests.get(f"{self.base_url}/stats",
+                                 headers={"If-None-Match": before.headers.get("ETag", "")}, timeout=5)
+            success = after.status_code == 200 and \
+                after.json()["password_verifier"]["verified"] > verified
+            self.log_test("条件请求 - /stats 诊断字段更新", success, f"状态码: {after.status_code}")
+        except Exception as e:
+            self.log_test("条件请求 - /stats 诊断字段更新", False, str(e))
+    
+    def test_rate_limiting(self):
+        """测试按客户端限流（需在其他测试之后运行，会耗尽本机对该端点的令牌）"""
+        for endpoint, params in [
+            ("/advanced_vuln", {"search": "admin"}),
+            ("/login_vuln", {"username": "admin", "password": "x"}),
+        ]:
+            try:
+                statuses = []
+                for _ in range(60):
+                    response = requests.get(f"{self.base_url}{endpoint}", params=params, timeout=5)
+                    statuses.append(response.status_code)
+                    if response.status_code == 429:
+                        break
+                success = statuses[-1] == 429 and "Retry-After" in response.headers
+                self.log_test(f"按客户端限流 - {endpoint}", success,
+                            f"第{len(statuses)}个请求返回 {statuses[-1]}")
+            except Exception as e:
+                self.log_test(f"按客户端限流 - {endpoint}", False, str(e))
+    
     def check_database_file(self):
         """检查数据库文件"""
         try:
@@ -161,6 +320,639 @@ class SQLInjectionDemoTester:
         except Exception as e:
             self.log_test("数据库文件检查", False, str(e))
     
+    def check_password_verifier_recovery(self):
+        """检查口令校验进程池：工作进程被杀死后校验仍然可用，并重建进程池"""
+        from passwords import PasswordVerifier, hash_password
+        
+        verifier = PasswordVerifier(workers=2)
+        try:
+            encoded = hash_password("admin123", cost=1000)
+            verifier.start()
+            for child in multiprocessing.active_children():
+                os.kill(child.pid, signal.SIGKILL)
+            time.sleep(0.5)
+            results = [verifier.verify("admin123", encoded), verifier.verify("wrong", encoded)]
+            stats = verifier.stats()
+            success = results == [True, False] and stats["pool_restarts"] == 1
+            self.log_test("口令校验进程池恢复", success,
+                        f"重建{stats['pool_restarts']}次，回退{stats['inline_fallbacks']}次")
+        except Exception as e:
+            self.log_test("口令校验进程池恢复", False, str(e))
+        finally:
+            verifier.shutdown()
+    
+    def check_sandbox_limits(self):
+        """检查沙箱内存上限：借出中的沙箱按单会话上限计入，所有沙箱都在使用时新会话被拒绝"""
+        import tempfile
+        from sandbox import SandboxManager, SandboxUnavailable
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "template.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+            conn.commit()
+            conn.close()
+            manager = SandboxManager(path, max_bytes=0)
+            try:
+                manager._ensure_template()
+                manager.max_bytes = 2 * manager.stats()["session_max_bytes"]
+                first, second = manager.acquire("a"), manager.acquire("b")
+                in_use = manager.stats()["bytes"]
+                try:
+                    manager.acquire("c")
+                    rejected = False
+                except SandboxUnavailable:
+                    rejected = True
+                manager.release(first)
+                third = manager.acquire("c")
+                stats = manager.stats()
+                manager.release(second)
+                manager.release(third)
+                success = in_use == manager.max_bytes and rejected and \
+                    stats["evicted"] == 1 and stats["bytes"] <= manager.max_bytes
+                self.log_test("沙箱内存上限", success,
+                            f"使用中{in_use}字节，拒绝{stats['rejected']}次，淘汰{stats['evicted']}个")
+            except Exception as e:
+                self.log_test("沙箱内存上限", False, str(e))
+            finally:
+                manager.clear()
+    
+    def test_cookieless_sandbox(self):
+        """测试不带cookie的请求共用按地址分配的沙箱（仅在 SANDBOX_ENABLED=1 时运行）"""
+        try:
+            before = requests.get(f"{self.base_url}/stats", timeout=5).json().get("sandbox")
+            if before is None:
+                return
+            responses = [requests.get(f"{self.base_url}/users", timeout=5) for _ in range(5)]
+            after = requests.get(f"{self.base_url}/stats", timeout=5).json()["sandbox"]
+            success = all("sandbox_session" in r.cookies for r in responses) and \
+                after["clones"] - before["clones"] <= 1
+            self.log_test("无cookie请求的沙箱", success,
+                        f"5个请求克隆了{after['clones'] - before['clones']}个沙箱")
+        except Exception as e:
+            self.log_test("无cookie请求的沙箱", False, str(e))
+    
+    def check_connection_pool(self):
+        """检查连接池：多线程并发借还时连接数不超过上限，池满时等待超时"""
+        import tempfile
+        from db_pool import ConnectionPool, PoolTimeout
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = ConnectionPool(os.path.join(tmp, "pool.db"), size=2, timeout=1.0)
+            errors = []
+            def worker():
+                try:
+                    for _ in range(20):
+                        conn = pool.acquire()
+                        try:
+                            conn.execute("SELECT 1").fetchone()
+                        finally:
+                            pool.release(conn)
+                except Exception as e:
+                    errors.append(e)
+            try:
+                threads = [threading.Thread(target=worker) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                held = [pool.acquire(), pool.acquire()]
+                try:
+                    pool.acquire(timeout=0.05)
+                    timed_out = False
+                except PoolTimeout:
+                    timed_out = True
+                for conn in held:
+                    pool.release(conn)
+                stats = pool.stats()
+                success = not errors and timed_out and stats["open_connections"] <= 2 and \
+                    stats["hits"] + stats["misses"] >= 160
+                self.log_test("连接池并发借还", success,
+                            f"打开{stats['open_connections']}个连接，命中率{stats['hit_rate']}")
+            except Exception as e:
+                self.log_test("连接池并发借还", False, str(e))
+            finally:
+                pool.close()
+    
+    def check_wal_reader_writer(self):
+        """检查WAL模式：写事务未提交时只读连接不被阻塞，只读连接不能写入"""
+        import tempfile
+        from db_pool import ConnectionPool, reader_pragmas, readonly_uri, storage_profile, writer_pragmas
+        
+        profile = storage_profile("wal")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "wal.db")
+            writers = ConnectionPool(path, size=1, pragmas=writer_pragmas(profile))
+            writer = writers.acquire()
+            try:
+                writer.execute("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+                writer.execute("INSERT INTO users DEFAULT VALUES")
+                writer.commit()
+                readers = ConnectionPool(readonly_uri(path), size=1, uri=True, timeout=0.1,
+                                         pragmas=reader_pragmas(profile))
+                reader = readers.acquire()
+                try:
+                    writer.execute("INSERT INTO users DEFAULT VALUES")
+                    count = reader.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+                    try:
+                        reader.execute("INSERT INTO users DEFAULT VALUES")
+                        read_only = False
+                    except sqlite3.OperationalError:
+                        read_only = True
+                    journal_mode = writer.execute("PRAGMA journal_mode").fetchone()[0]
+                    success = journal_mode == "wal" and count == 1 and read_only
+                    self.log_test("WAL读写分离", success,
+                                f"日志模式{journal_mode}，写事务进行中读到{count}行")
+                finally:
+                    readers.release(reader)
+                    readers.close()
+            except Exception as e:
+                self.log_test("WAL读写分离", False, str(e))
+            finally:
+                writers.release(writer)
+                writers.close()
+    
+    def check_pattern_matcher(self):
+        """检查Aho-Corasick匹配结果与逐个子串查找一致（含相互重叠的特征串）"""
+        from detection import DEFAULT_MATCHER, SUSPICIOUS_PATTERNS, PatternMatcher
+        
+        payloads = [
+            "admin", "' or 1=1--", "1 UNION SELECT password FROM users/*",
+            "'; DROP TABLE users; --", "exec xp_cmdshell", "and 1=1 and 1=2", "",
+        ]
+        try:
+            mismatches = [
+                payload for payload in payloads
+                if DEFAULT_MATCHER.matched_patterns(payload.lower()) !=
+                [p for p in SUSPICIOUS_PATTERNS if p in payload.lower()]
+            ]
+            overlapping = PatternMatcher(["he", "she", "his", "hers"]).scan("ushers")
+            success = not mismatches and overlapping == [("she", 1), ("he", 2), ("hers", 2)]
+            self.log_test("多模式匹配", success, f"不一致的载荷: {mismatches}，重叠匹配: {overlapping}")
+        except Exception as e:
+            self.log_test("多模式匹配", False, str(e))
+    
+    def check_attack_log_writer(self):
+        """检查攻击日志写入器：文件轮转后重启，检查点恢复的计数与最近记录不丢失"""
+        import tempfile
+        from attack_log import AttackLogWriter
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attack_log.txt")
+            lines = [f"attack {n:03d} from 127.0.0.1\n" for n in range(30)]
+            writer = AttackLogWriter(path, batch_size=5, flush_interval=0.01, max_bytes=100)
+            try:
+                for start in range(0, len(lines), 5):
+                    for line in lines[start:start + 5]:
+                        writer.submit(line)
+                    writer.flush()
+                writer.close()
+                rotations = writer.stats()["rotations"]
+                restored = AttackLogWriter(path)
+                total, recent = restored.snapshot()
+                success = rotations > 1 and total == len(lines) and \
+                    recent == [line.strip() for line in lines[-10:]]
+                self.log_test("攻击日志检查点恢复", success, f"轮转{rotations}次后恢复{total}条")
+            except Exception as e:
+                self.log_test("攻击日志检查点恢复", False, str(e))
+            finally:
+                writer.close()
+    
+    def test_attack_counters(self):
+        """测试 /stats 的攻击计数：被检测到的攻击计入总数和最近记录，多进程时由任意进程回答都可见"""
+        try:
+            # 等之前的测试在各工作进程中排队的记录都写入共享日志
+            before = requests.get(f"{self.base_url}/stats", timeout=5).json()
+            for _ in range(10):
+                time.sleep(0.6)
+                settled = requests.get(f"{self.base_url}/stats", timeout=5).json()
+                if settled["total_attacks"] == before["total_attacks"]:
+                    break
+                before = settled
+            requests.get(f"{self.base_url}/login_vuln",
+                         params={"username": "admin'--", "password": "counter-check"}, timeout=5)
+            # 其他工作进程的记录写入共享日志后才可见
+            deadline = time.time() + 3
+            while True:
+                after = requests.get(f"{self.base_url}/stats", timeout=5).json()
+                added = after["total_attacks"] - before["total_attacks"]
+                if added >= 1 or time.time() > deadline:
+                    break
+                time.sleep(0.1)
+            success = added == 1 and "counter-check" in after["recent_attacks"][-1]
+            self.log_test("攻击计数器", success, f"总数增加{added}")
+        except Exception as e:
+            self.log_test("攻击计数器", False, str(e))
+    
+    def test_users_pagination(self):
+        """测试 /users 的游标分页与NDJSON输出和全量列表一致"""
+        try:
+            full = requests.get(f"{self.base_url}/users", timeout=10).json()["users"]
+            paged, after_id = [], 0
+            while after_id is not None and len(paged) <= len(full):
+                page = requests.get(f"{self.base_url}/users",
+                                    params={"after_id": after_id, "limit": 2}, timeout=5).json()
+                paged.extend(page["users"])
+                after_id = page["next_after_id"]
+            ndjson = requests.get(f"{self.base_url}/users", params={"format": "ndjson"}, timeout=10)
+            streamed = [json.loads(line) for line in ndjson.text.splitlines() if line]
+            ids = [user["id"] for user in full]
+            success = ids == sorted(ids) and [user["id"] for user in paged] == ids and \
+                streamed == full
+            self.log_test("用户列表分页", success, f"全量{len(full)}个，分页{len(paged)}个")
+        except Exception as e:
+            self.log_test("用户列表分页", False, str(e))
+    
+    def test_load_benchmark(self):
+        """测试压测工具：对不限流的端点并发施压，汇总出延迟分位数且没有错误"""
+        from benchmark import LOAD_SCENARIOS, HTTPLoadClient, run_load
+        
+        try:
+            paths = [LOAD_SCENARIOS[name] for name in ("index", "users", "stats")]
+            result = run_load(HTTPLoadClient(self.base_url), paths, concurrency=4, duration=1.0)
+            latency = result["latency_ms"]
+            success = result["requests"] > 0 and result["errors"] == 0 and \
+                latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+            self.log_test("并发压测", success,
+                        f"{result['requests']}个请求，{result['rps']} RPS，p99 {latency['p99']}ms")
+        except Exception as e:
+            self.log_test("并发压测", False, str(e))
+    
+    def check_prefork_server(self):
+        """检查内置预派生服务器：补齐被杀死的工作进程，SIGTERM后主进程和工作进程全部退出"""
+        import subprocess
+        import sys
+        
+        port = 5099
+        code = (
+            "import os\n"
+            "from server import serve\n"
+            "def app(environ, start_response):\n"
+            "    start_response('200 OK', [('Content-Type', 'text/plain')])\n"
+            "    return [str(os.getpid()).encode()]\n"
+            f"serve(app, host='127.0.0.1', port={port}, workers=2, threads=2, "
+            "server='builtin', graceful_timeout=5)\n"
+        )
+        master = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+        def worker_pids(count):
+            pids = set()
+            for _ in range(count):
+                pids.add(int(requests.get(f"http://127.0.0.1:{port}/", timeout=5).text))
+            return pids
+        try:
+            for _ in range(50):
+                try:
+                    before = worker_pids(10)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            killed = before.pop()
+            os.kill(killed, signal.SIGKILL)
+            time.sleep(1)
+            after = worker_pids(10)
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=10)
+            leftover = []
+            for pid in before | after:
+                try:
+                    os.kill(pid, 0)
+                    leftover.append(pid)
+                except ProcessLookupError:
+                    pass
+            success = killed not in after and bool(after) and not leftover
+            self.log_test("预派生服务器", success,
+                        f"杀死工作进程{killed}后由{sorted(after)}服务，残留{leftover}")
+        except Exception as e:
+            self.log_test("预派生服务器", False, str(e))
+        finally:
+            if master.poll() is None:
+                master.kill()
+                master.wait()
+    
+    def test_metrics(self):
+        """测试 /metrics：每个请求计入按端点的耗时直方图，并导出分阶段耗时和连接池指标"""
+        def users_count(text):
+            for line in text.splitlines():
+                if line.startswith("sqli_demo_request_duration_seconds_count{") and \
+                        'endpoint="list_users"' in line and 'status="200"' in line:
+                    return int(float(line.rsplit(" ", 1)[1]))
+            return 0
+        try:
+            before = requests.get(f"{self.base_url}/metrics", timeout=5).text
+            for after_id in range(3):
+                requests.get(f"{self.base_url}/users",
+                             params={"after_id": after_id, "limit": 1}, timeout=5)
+            response = requests.get(f"{self.base_url}/metrics", timeout=5)
+            added = users_count(response.text) - users_count(before)
+            success = response.status_code == 200 and added == 3 and \
+                "sqli_demo_request_phase_duration_seconds_bucket" in response.text and \
+                "sqli_demo_db_pool_connections" in response.text
+            self.log_test("请求耗时指标", success, f"/users 计数增加{added}")
+        except Exception as e:
+            self.log_test("请求耗时指标", False, str(e))
+    
+    def check_fast_json(self):
+        """检查快速JSON编码与 json.dumps 的结果解析后一致（含转义、中文和混合类型的列）"""
+        from fast_json import JSONTemplate, Slot, encode_rows
+        
+        columns = ["id", "username", "role", "score"]
+        rows = [
+            (1, "admin", "admin", None),
+            (2, 'quote"back\\slash', "user", 1.5),
+            (3, "张三\n", "user", True),
+            (4, "</script>", None, 7),
+        ]
+        expected = [dict(zip(columns, row)) for row in rows]
+        try:
+            template = JSONTemplate({"status": "ok", "users": Slot("users"), "count": Slot("count")})
+            batches = [rows[:1], rows]
+            decoded = [json.loads(encode_rows(columns, batch)) for batch in batches]
+            rendered = json.loads(template.render(users=encode_rows(columns, rows), count=len(rows)))
+            success = decoded == [expected[:1], expected] and \
+                rendered == {"status": "ok", "users": expected, "count": len(rows)}
+            self.log_test("快速JSON编码", success, f"编码了{len(rows)}行")
+        except Exception as e:
+            self.log_test("快速JSON编码", False, str(e))
+    
+    def test_index_compression(self):
+        """测试首页的压缩变体：内容与未压缩版本一致，各变体有独立的ETag并支持304"""
+        try:
+            plain = requests.get(f"{self.base_url}/", headers={"Accept-Encoding": "identity"}, timeout=5)
+            gzipped = requests.get(f"{self.base_url}/", headers={"Accept-Encoding": "gzip"}, timeout=5)
+            again = requests.get(f"{self.base_url}/", timeout=5, headers={
+                "Accept-Encoding": "gzip", "If-None-Match": gzipped.headers.get("ETag", ""),
+            })
+            success = gzipped.headers.get("Content-Encoding") == "gzip" and \
+                "Content-Encoding" not in plain.headers and \
+                gzipped.content == plain.content and \
+                gzipped.headers["ETag"] != plain.headers["ETag"] and \
+                again.status_code == 304 and "Accept-Encoding" in gzipped.headers.get("Vary", "")
+            self.log_test("首页压缩与ETag", success,
+                        f"未压缩{len(plain.content)}字节，再次请求返回 {again.status_code}")
+        except Exception as e:
+            self.log_test("首页压缩与ETag", False, str(e))
+    
+    def test_query_guard(self):
+        """测试失控查询保护：无限递归按指令数中止、超多行按行数中止，并计入 /stats"""
+        test_cases = [
+            ("steps", "%' AND (WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+                      "SELECT COUNT(*) FROM c) > 0 /*"),
+            ("rows", "%' UNION ALL SELECT x, x, x FROM (WITH RECURSIVE c(x) AS "
+                     "(SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 5000) SELECT x FROM c) /*"),
+        ]
+        for reason, payload in test_cases:
+            try:
+                before = requests.get(f"{self.base_url}/stats", timeout=5).json()
+                started = time.time()
+                response = requests.get(f"{self.base_url}/advanced_vuln",
+                                        params={"search": payload}, timeout=10)
+                elapsed = time.time() - started
+                after = requests.get(f"{self.base_url}/stats", timeout=5).json()
+                aborts = after["query_guard"]["advanced_vuln"]["aborts"][reason] - \
+                    before["query_guard"]["advanced_vuln"]["aborts"][reason]
+                success = response.status_code == 400 and \
+                    response.json().get("reason") == reason and aborts == 1
+                self.log_test(f"失控查询保护 - {reason}", success, f"{elapsed:.2f}秒后中止")
+            except Exception as e:
+                self.log_test(f"失控查询保护 - {reason}", False, str(e))
+    
+    def check_search_index(self):
+        """检查全文检索：FTS5 trigram索引与参数化LIKE回退返回相同的用户，检索词中的语法不生效"""
+        import tempfile
+        from search import create_search_index, search_users
+        from seeder import seed_database
+        
+        terms = ["adm", "user", "li4", 'a"b', "%_%", "' OR 1=1--"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "search.db")
+            seed_database(path, users=2000, seed=7)
+            conn = sqlite3.connect(path)
+            try:
+                if not create_search_index(conn):
+                    self.log_test("全文检索索引", True, "当前SQLite不支持trigram，跳过")
+                    return
+                mismatches = []
+                for term in terms:
+                    results = {}
+                    for indexed in (True, False):
+                        mode, cur = search_users(conn, term, 10000, sort="id", indexed=indexed)
+                        results[mode] = cur.fetchall()
+                    if results["fts5"] != results["like"]:
+                        mismatches.append(term)
+                success = not mismatches
+                self.log_test("全文检索索引", success, f"结果不一致的检索词: {mismatches}")
+            except Exception as e:
+                self.log_test("全文检索索引", False, str(e))
+            finally:
+                conn.close()
+    
+    def test_reset(self):
+        """测试 /reset：直接删掉数据库中的用户后，从黄金快照恢复原有数据"""
+        try:
+            before = requests.get(f"{self.base_url}/users", timeout=5).json()["users"]
+            conn = sqlite3.connect("demo.db")
+            with conn:
+                conn.execute("DELETE FROM users WHERE username <> 'admin'")
+            conn.close()
+            damaged = requests.get(f"{self.base_url}/users", timeout=5).json()["users"]
+            response = requests.post(f"{self.base_url}/reset", timeout=10)
+            after = requests.get(f"{self.base_url}/users", timeout=5).json()["users"]
+            success = response.status_code == 200 and after == before
+            self.log_test("数据库恢复", success,
+                        f"删除后{len(damaged)}个用户，恢复后{len(after)}个")
+        except Exception as e:
+            self.log_test("数据库恢复", False, str(e))
+    
+    def check_log_pipeline(self):
+        """检查异步日志：同类消息按速率采样，被丢弃的条数附在下一条放行的记录上，错误不采样"""
+        import logging
+        import tempfile
+        from app_logging import LogPipeline
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app.log")
+            logger = logging.getLogger("test_demo.log_pipeline")
+            logger.propagate = False
+            pipeline = LogPipeline(path, fmt="json", sample_rate=1.0, sample_burst=5, console=False)
+            try:
+                pipeline.install(logger)
+                for n in range(50):
+                    logger.info("请求 %d 完成", n)
+                logger.error("数据库错误: %s", "disk I/O error")
+                time.sleep(1.1)
+                logger.info("请求 %d 完成", 50)
+                stats = pipeline.stats()
+                pipeline.stop()
+                with open(path, encoding="utf-8") as f:
+                    entries = [json.loads(line) for line in f]
+                infos = [entry for entry in entries if entry["level"] == "INFO"]
+                errors = [entry for entry in entries if entry["level"] == "ERROR"]
+                success = 5 <= len(infos) < 10 and len(errors) == 1 and \
+                    infos[-1].get("sampled_out") == stats["sampled_out"] > 0 and \
+                    len(infos) + stats["sampled_out"] == 51
+                self.log_test("异步采样日志", success,
+                            f"写出{len(entries)}条，采样丢弃{stats['sampled_out']}条")
+            except Exception as e:
+                self.log_test("异步采样日志", False, str(e))
+            finally:
+                pipeline.stop()
+                for handler in pipeline.handlers:
+                    handler.close()
+    
+    def check_query_profiler(self):
+        """检查慢查询表：只是字面量不同的语句归为一类，查询计划标出全表扫描"""
+        from profiler import QueryProfiler
+        
+        profiler = QueryProfiler(threshold_ms=0)
+        conn = sqlite3.connect(":memory:", factory=profiler.connection_factory())
+        try:
+            conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+            conn.executemany("INSERT INTO users (username) VALUES (?)",
+                             [(f"user{n}",) for n in range(1000)])
+            for name in ("admin", "o''brien"):
+                conn.execute(f"SELECT id FROM users WHERE username = '{name}'").fetchall()
+            conn.execute("SELECT username FROM users WHERE id = 42").fetchall()
+            entries = {entry["sql"]: entry for entry in profiler.slow_queries()}
+            scan = entries.get("SELECT id FROM users WHERE username = ?", {})
+            lookup = entries.get("SELECT username FROM users WHERE id = ?", {})
+            success = scan.get("count") == 2 and scan.get("full_scan") is True and \
+                lookup.get("full_scan") is False
+            self.log_test("慢查询表与查询计划", success, f"记录了{len(entries)}类语句，计划: {scan.get('plan')}")
+        except Exception as e:
+            self.log_test("慢查询表与查询计划", False, str(e))
+        finally:
+            conn.close()
+    
+    def check_storage_backends(self):
+        """检查各存储后端：从快照载入、写入后数据版本变化且读连接可见、重新载入恢复数据"""
+        import tempfile
+        from db_pool import storage_profile
+        from seeder import seed_database
+        from storage import BACKENDS, DEFAULT_STORAGE_MODES, create_backend
+        
+        def user_count(pool):
+            conn = pool.acquire()
+            try:
+                return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            finally:
+                pool.release(conn)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = os.path.join(tmp, "golden.db")
+            seed_database(snapshot, users=100, seed=3)
+            for name in BACKENDS:
+                backend = create_backend(name, os.path.join(tmp, f"{name}.db"), snapshot,
+                                         storage_profile(DEFAULT_STORAGE_MODES[name]))
+                try:
+                    backend.load(snapshot)
+                    loaded = user_count(backend.reader_pool)
+                    version = backend.data_version()
+                    conn = backend.writer_pool.acquire()
+                    try:
+                        with conn:
+                            conn.execute("DELETE FROM users WHERE username <> 'admin'")
+                    finally:
+                        backend.writer_pool.release(conn)
+                    changed = backend.data_version() != version
+                    deleted = user_count(backend.reader_pool)
+                    backend.load(snapshot)
+                    restored = user_count(backend.reader_pool)
+                    success = loaded > 100 and changed and deleted == 1 and restored == loaded
+                    self.log_test(f"存储后端 - {name}", success,
+                                f"载入{loaded}个用户，删除后{deleted}个，恢复后{restored}个")
+                except Exception as e:
+                    self.log_test(f"存储后端 - {name}", False, str(e))
+                finally:
+                    backend.reader_pool.close()
+                    backend.writer_pool.close()
+    
+    def check_detection_memo(self):
+        """检查检测结果缓存：重复载荷命中缓存且结果一致，超长输入不缓存，按LRU淘汰"""
+        from detection import DEFAULT_MATCHER, DetectionMemo
+        
+        memo = DetectionMemo(DEFAULT_MATCHER, max_entries=2, max_input_length=20)
+        payloads = ["admin'--", "admin'--", "Admin'--", "1 UNION SELECT 1", "x" * 21 + "' or 1=1"]
+        try:
+            results = [memo.matched_patterns(payload) for payload in payloads]
+            expected = [DEFAULT_MATCHER.matched_patterns(payload.lower()) for payload in payloads]
+            success = results == expected
+            results[2].append("modified")
+            cached = memo.matched_patterns("Admin'--")
+            stats = memo.stats()
+            success = success and cached == expected[2] and \
+                stats["hits"] == 2 and stats["misses"] == 3 and stats["bypassed"] == 1 and stats["evicted"] == 1 and stats["entries"] == 2
+            self.log_test("检测结果缓存", success,
+                        f"命中{stats['hits']}次，未命中{stats['misses']}次，淘汰{stats['evicted']}个")
+        except Exception as e:
+            self.log_test("检测结果缓存", False, str(e))
+    
+    def check_keepalive_idle(self):
+        """检查等待请求的连接不占用线程池：2个线程时3个不发送请求的连接不影响新的请求"""
+        import socket
+        from server import _make_worker_server
+        
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "2")])
+            return [b"ok"]
+        
+        sock = socket.create_server(("127.0.0.1", 0))
+        server = _make_worker_server(app, sock, threads=2, keepalive=5)
+        port = sock.getsockname()[1]
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.1},
+                         daemon=True).start()
+        idle = []
+        try:
+            for _ in range(3):
+                idle.append(socket.create_connection(("127.0.0.1", port), timeout=5))
+            time.sleep(0.2)
+            started = time.time()
+            fresh = requests.get(f"http://127.0.0.1:{port}/", timeout=3)
+            elapsed = time.time() - started
+            # 等待中的连接之后发送的请求照常处理
+            idle[0].sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            late = idle[0].recv(4096)
+            success = fresh.text == "ok" and elapsed < 1 and late.startswith(b"HTTP/1.1 200")
+            self.log_test("空闲连接不占用线程", success,
+                        f"新请求耗时{elapsed:.2f}秒，空闲连接稍后的请求: {late[:15]!r}")
+        except Exception as e:
+            self.log_test("空闲连接不占用线程", False, str(e))
+        finally:
+            for conn in idle:
+                conn.close()
+            server.shutdown()
+            server.close_idle()
+            server.executor.shutdown(wait=True)
+            server.server_close()
+            sock.close()
+    
+    def check_seeder_determinism(self):
+        """检查数据生成：同一种子两次生成的数据库完全相同（含口令哈希），合成用户的口令哈希可以校验"""
+        import tempfile
+        from passwords import verify_password
+        from seeder import seed_database
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                dumps = []
+                for name in ("a.db", "b.db"):
+                    path = os.path.join(tmp, name)
+                    seed_database(path, users=200, secrets=20, seed=11)
+                    conn = sqlite3.connect(path)
+                    try:
+                        dumps.append(list(conn.iterdump()))
+                        rows = conn.execute(
+                            "SELECT password, password_hash FROM users WHERE id > 4 LIMIT 3"
+                        ).fetchall()
+                    finally:
+                        conn.close()
+                verified = [verify_password(password, encoded) for password, encoded in rows]
+                same = dumps[0] == dumps[1]
+                self.log_test("数据生成可复现", same and all(verified),
+                            f"两次生成{'相同' if same else '不同'}，合成用户口令校验{verified}")
+            except Exception as e:
+                self.log_test("数据生成可复现", False, str(e))
+    
     def run_all_tests(self):
         """运行所有测试"""
         print("=" * 80)
@@ -175,13 +967,41 @@ class SQLInjectionDemoTester:
         # 运行测试
         self.test_basic_connectivity()
         self.test_database_setup()
+        self.test_concurrent_setup()
         time.sleep(1)  # 等待数据库初始化完成
         
         self.check_database_file()
+        self.check_password_verifier_recovery()
+        self.check_sandbox_limits()
+        self.check_connection_pool()
+        self.check_wal_reader_writer()
+        self.check_pattern_matcher()
+        self.check_attack_log_writer()
+        self.check_prefork_server()
+        self.check_fast_json()
+        self.check_search_index()
+        self.check_log_pipeline()
+        self.check_query_profiler()
+        self.check_storage_backends()
+        self.check_detection_memo()
+        self.check_keepalive_idle()
+        self.check_seeder_determinism()
         self.test_vulnerable_endpoint()
         self.test_safe_endpoint()
         self.test_auxiliary_endpoints()
         self.test_advanced_vulnerability()
+        self.test_bulk_detect()
+        self.test_attack_event_queries()
+        self.test_conditional_get()
+        self.test_cookieless_sandbox()
+        self.test_attack_counters()
+        self.test_users_pagination()
+        self.test_load_benchmark()
+        self.test_metrics()
+        self.test_index_compression()
+        self.test_query_guard()
+        self.test_reset()
+        self.test_rate_limiting()
         
         # 统计结果
         total_tests = len(self.test_results)